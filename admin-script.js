@@ -350,7 +350,7 @@ async function exportData() {
     showNotification('📥 データをエクスポートしています...', 'info');
     
     try {
-        // APIからエクスポートデータを取得
+        // エクスポートはサーバーのバックグラウンドジョブで作成される
         const response = await fetch('/api/export');
         
         if (!response.ok) {
@@ -360,16 +360,21 @@ async function exportData() {
         const result = await response.json();
         
         if (result.success) {
-            // CSVデータを取得してダウンロード
-            const csvData = result.data;
-            const blob = new Blob([csvData], { type: 'text/csv;charset=utf-8;' });
+            const job = await waitForJob(result.status_url);
+            
+            // 作成されたCSVファイルをダウンロード
+            const download = await fetch(result.download_url);
+            if (!download.ok) {
+                throw new Error('エクスポートファイルの取得に失敗しました');
+            }
+            const blob = await download.blob();
             const url = URL.createObjectURL(blob);
             const link = document.createElement('a');
             link.href = url;
             link.download = `survey_responses_${new Date().toISOString().split('T')[0]}.csv`;
             link.click();
             
-            showNotification(`✅ ${result.count}件のデータをエクスポートしました`, 'success');
+            showNotification(`✅ ${job.result.count}件のデータをエクスポートしました`, 'success');
             console.log('📥 エクスポート完了');
         } else {
             throw new Error('エクスポートデータの生成に失敗しました');
@@ -384,6 +389,24 @@ async function exportData() {
     }
 }
 
+// バックグラウンドジョブの完了待ち（完了したジョブの状態を返す）
+async function waitForJob(statusUrl, options = {}) {
+    while (true) {
+        const response = await fetch(statusUrl, options);
+        if (!response.ok) {
+            throw new Error('ジョブの状態を取得できませんでした');
+        }
+        const { job } = await response.json();
+        if (job.status === 'completed') {
+            return job;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'ジョブが失敗しました');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // エクスポートのフォールバック処理
 function exportDataFallback() {
     const exportData = {
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 匿名性の閾値を適用した集計
+
+企業向けの分析API（サマリー・分析・クロス集計・期間比較・キードライバー分析）の集計は
+AnonymousAggregator を経由し、回答者の特定を防ぐ閾値 k（企業毎に設定可能）をここで一律に適用する。
+
+    一次秘匿  回答者数が k 未満のグループ・回答数が k 未満の設問はSQLの HAVING で除外し、
+              小セルの数値をデータベースから読み込まない
+    補完秘匿  秘匿したグループが1つだけ、または秘匿したグループの回答者数の合計が k 未満の場合、
+              上位の合計（企業全体・部署全体）から表示したグループを引くと秘匿した値が逆算できるため、
+              表示するグループのうち回答者数の少ない順に追加で秘匿する
+
+集計元は回答の保存時に加算しておくクロス集計セル（crosstab.py）と点数毎の件数のみで、回答は走査しない。
+"""
+
+from crosstab import RESPONDENTS_QUESTION, build_crosstab
+
+
+class AnonymousAggregator:
+    """1企業（company_id が None の場合は全企業）の集計に閾値 min_cell_size を適用する
+
+    session: 読み取り用の StorageSession
+    """
+
+    def __init__(self, session, company_id, min_cell_size):
+        self.session = session
+        self.company_id = company_id
+        self.min_cell_size = min_cell_size
+
+    def _cells(self, group_by, filters=None, questions=None):
+        """秘匿後のセル (グループ列の値..., 設問, 回答数, 合計, 二乗和) と秘匿したグループのキー"""
+        rows = self.session.fetch_crosstab(
+            self.company_id, group_by, filters,
+            list(questions) + [RESPONDENTS_QUESTION] if questions else None,
+            min_count=self.min_cell_size
+        )
+        small = self.session.fetch_small_groups(self.company_id, group_by, filters, self.min_cell_size)
+        suppressed = {tuple(row[:len(group_by)]) for row in small}
+        if group_by and suppressed:
+            rows = complementary_suppression(
+                rows, len(group_by), suppressed, small[0][-1], self.min_cell_size
+            )
+        return rows, suppressed
+
+    def crosstab(self, group_by, filters=None, questions=None):
+        """クロス集計（crosstab.build_crosstab と同じ形式、秘匿したグループは suppressed）"""
+        rows, suppressed = self._cells(group_by, filters, questions)
+        return build_crosstab(rows, group_by, self.min_cell_size, suppressed)
+
+    def pooled_means(self, group_by, questions, filters=None):
+        """グループ毎の回答者数と指定設問を合わせた平均点（秘匿したグループは suppressed）
+
+        戻り値は [{グループ列: 値, 'respondents', 'mean', 'suppressed'}]（グループ列の値の順）。
+        """
+        rows, suppressed = self._cells(group_by, filters, questions)
+        groups = {key: None for key in suppressed}
+        for row in rows:
+            key = tuple(row[:len(group_by)])
+            question, count, total = row[len(group_by):len(group_by) + 3]
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, 0]
+            if question == RESPONDENTS_QUESTION:
+                group[0] = count
+            else:
+                group[1] += count
+                group[2] += total
+
+        result = []
+        for key in sorted(groups):
+            group = groups[key]
+            entry = dict(zip(group_by, key))
+            if group is None:
+                entry.update(respondents=None, mean=None, suppressed=True)
+            else:
+                entry.update(
+                    respondents=group[0], mean=round(group[2] / group[1], 3) if group[1] else None, suppressed=False
+                )
+            result.append(entry)
+        return result
+
+    def score_distribution(self, questions):
+        """指定設問を合わせた点数毎の件数（企業の回答者数が閾値未満の場合はNone、件数が閾値未満の点数は含めない）"""
+        overall = self.pooled_means((), [RESPONDENTS_QUESTION])
+        if not overall or overall[0]['suppressed']:
+            return None
+        return dict(self.session.fetch_score_distribution(self.company_id, questions, self.min_cell_size))
+
+
+def complementary_suppression(rows, key_length, suppressed, suppressed_total, min_cell_size):
+    """補完秘匿（表示するグループのうち回答者数の少ない順に、逆算できなくなるまで suppressed に加える）
+
+    rows: 一次秘匿後のセル、suppressed: 一次秘匿したグループのキー（更新する）、
+    suppressed_total: 一次秘匿したグループの回答者数の合計。戻り値は表示するグループのセル。
+    """
+    sizes = {
+        tuple(row[:key_length]): row[key_length + 1]
+        for row in rows if row[key_length] == RESPONDENTS_QUESTION
+    }
+    _complement(sizes, suppressed, suppressed_total, min_cell_size)
+    return [row for row in rows if tuple(row[:key_length]) not in suppressed]
+
+
+def suppress_counts(counts, min_cell_size):
+    """件数 {値: 件数} の一次秘匿と補完秘匿（レポートの度数分布・部署などの件数）
+
+    合計が別に公開される件数の表に AnonymousAggregator と同じ規則を適用する。
+    戻り値は (表示する件数, 秘匿した値の集合)。
+    """
+    suppressed = {value for value, count in counts.items() if count < min_cell_size}
+    if suppressed:
+        _complement(
+            {value: count for value, count in counts.items() if value not in suppressed},
+            suppressed, sum(counts[value] for value in suppressed), min_cell_size
+        )
+    return {value: count for value, count in counts.items() if value not in suppressed}, suppressed
+
+
+def _complement(sizes, suppressed, suppressed_total, min_cell_size):
+    """秘匿した値が1つだけ、または合計が閾値未満の間、sizes の少ない順に suppressed に加える"""
+    for key in sorted(sizes, key=lambda key: (sizes[key], str(key))):
+        if len(suppressed) >= 2 and suppressed_total >= min_cell_size:
+            break
+        suppressed.add(key)
+        suppressed_total += sizes[key]
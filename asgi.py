@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - ASGIエントリポイント（任意）
+
+大量同時回答向けに /api/submit と /api/stream を非同期で処理し、それ以外のリクエストは
+既存のFlaskアプリ（WSGI）にスレッドプール経由で委譲する。
+SQLiteへの書き込みは専用のライタースレッドがまとめてコミットする。
+
+起動（uvicornが必要: pip install uvicorn）:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    python3 start_server.py --asgi
+"""
+
+import asyncio
+import json
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs
+
+import server
+from event_stream import AsyncSubscription, format_sse
+from server import app, logger
+
+# ライタースレッドが一度にコミットする最大件数
+WRITER_BATCH_SIZE = 256
+
+# WSGIへ委譲するリクエストボディをメモリに保持する上限（超えた分は一時ファイルに書き出す）
+WSGI_BODY_SPOOL_BYTES = 1024 * 1024
+
+
+class AsyncSQLiteWriter:
+    """専用スレッドでSQLite書き込みを直列化し、結果をasyncioのFutureで返す
+
+    キューに溜まった書き込みは1トランザクションにまとめてコミットする（グループコミット）。
+    各ジョブはSAVEPOINT内で実行するため、失敗したジョブのみがロールバックされる。
+    """
+
+    def __init__(self, database_path, after_commit=None):
+        self.database_path = database_path
+        self.after_commit = after_commit
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+
+    async def run(self, func, *args):
+        """func(cursor, *args) をライタースレッドで実行し、コミット後に結果を返す"""
+        if self.thread is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.put((func, args, loop, future))
+        return await future
+
+    def _run(self):
+        server.ensure_database_ready()
+        conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        cursor = conn.cursor()
+        stopping = False
+        while not stopping:
+            batch = [self.jobs.get()]
+            while len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [job for job in batch if job is not None]
+            if batch:
+                self._execute_batch(cursor, batch)
+        conn.close()
+
+    def _execute_batch(self, cursor, batch):
+        results = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for func, args, loop, future in batch:
+                cursor.execute('SAVEPOINT job')
+                try:
+                    results.append((loop, future, func(cursor, *args), None))
+                    cursor.execute('RELEASE job')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO job')
+                    cursor.execute('RELEASE job')
+                    results.append((loop, future, None, e))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"非同期書き込みのコミットに失敗しました: {str(e)}")
+            if cursor.connection.in_transaction:
+                cursor.execute('ROLLBACK')
+            results = [(loop, future, None, e) for func, args, loop, future in batch]
+
+        # 企業別データベースへの回答の書き込み（カタログのコミット後、応答を返す前）
+        server.flush_shard_outbox()
+
+        for loop, future, result, error in results:
+            loop.call_soon_threadsafe(self._resolve, future, result, error)
+
+        if self.after_commit is not None:
+            try:
+                self.after_commit()
+            except Exception as e:
+                logger.error(f"コミット後処理に失敗しました: {str(e)}")
+
+    @staticmethod
+    def _resolve(future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+writer = AsyncSQLiteWriter(server.DATABASE_PATH, after_commit=server.update_statistics)
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive, limit):
+    """リクエストボディの読み込み（上限超過時はNone）"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def handle_submit(scope, receive, send):
+    """調査回答の保存（非同期版、処理内容は server.submit_survey と同じ）"""
+    try:
+        client = scope.get('client')
+        client_ip = client[0] if client else None
+        if not server.rate_limit_check(client_ip):
+            logger.warning(f"レート制限違反: {client_ip}")
+            return await send_json(send, 429, {'error': 'レート制限に達しました'})
+
+        body = await read_body(receive, server.SUBMISSION_MAX_BYTES)
+        if body is None:
+            return await send_json(send, 413, {'error': 'データサイズが大きすぎます'})
+
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            return await send_json(send, 400, {'error': '無効なデータです'})
+
+        payload, error_message = server.check_submission(data, len(body))
+        if error_message:
+            return await send_json(send, 400, {'error': error_message})
+        client_key = dict(scope.get('headers', [])).get(b'idempotency-key')
+        try:
+            key = server.submission_key(data, client_key.decode('latin-1') if client_key is not None else None)
+        except ValueError:
+            return await send_json(send, 400, {'error': '無効な Idempotency-Key です'})
+
+        response_id, error_message, duplicate = await writer.run(server.save_survey_response, data, payload, key)
+        if error_message:
+            return await send_json(send, 400, {'error': error_message})
+        if duplicate:
+            logger.info(f"重複送信のため保存済みの回答IDを返します: {response_id}")
+            return await send_json(send, 200, {
+                'success': True,
+                'response_id': response_id,
+                'duplicate': True,
+                'message': 'この回答は既に保存されています'
+            })
+
+        await asyncio.get_running_loop().run_in_executor(None, server.publish_submission_event, data)
+
+        logger.info(f"調査回答を保存しました: {response_id}")
+        return await send_json(send, 200, {
+            'success': True,
+            'response_id': response_id,
+            'message': '調査回答を正常に保存しました'
+        })
+
+    except Exception as e:
+        logger.error(f"調査回答の保存に失敗しました: {str(e)}")
+        return await send_json(send, 500, {'error': 'サーバーエラーが発生しました'})
+
+
+async def handle_stream(scope, receive, send):
+    """リアルタイム配信（非同期版、スレッドを占有しないため接続数の上限なし）"""
+    loop = asyncio.get_running_loop()
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    headers = dict(scope.get('headers', []))
+    auth_header = headers.get(b'authorization', b'').decode('latin-1')
+    role = query.get('role', ['operator'])[0]
+    ticket = query.get('ticket', [None])[0]
+
+    try:
+        channel, company_id = await loop.run_in_executor(None, server.resolve_stream_request, role, auth_header, ticket)
+        if not channel:
+            return await send_json(send, 401, {'error': '認証が必要です'})
+        version = await loop.run_in_executor(None, server.prepare_stream, channel, company_id)
+    except Exception as e:
+        logger.error(f"リアルタイム配信の開始に失敗しました: {str(e)}")
+        return await send_json(send, 500, {'error': 'サーバーエラーが発生しました'})
+
+    broker = server.event_broker
+    subscription = broker.subscribe(AsyncSubscription([channel], loop))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        await send({'type': 'http.response.body', 'body': format_sse('ready', {'version': version}), 'more_body': True})
+
+        deadline = time.monotonic() + server.STREAM_MAX_SECONDS
+        while not disconnected.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = await subscription.get_async(min(server.STREAM_HEARTBEAT_SECONDS, remaining))
+            await send({'type': 'http.response.body', 'body': message or b': keepalive\n\n', 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def spool_body(receive, limit):
+    """リクエストボディを受信したチャンク毎に一時ファイルへ書き込む（戻り値: (ファイル, サイズ)、上限超過時はNone）"""
+    body = tempfile.SpooledTemporaryFile(max_size=WSGI_BODY_SPOOL_BYTES)
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            body.close()
+            return None
+        body.write(chunk)
+        if not message.get('more_body', False):
+            body.seek(0)
+            return body, size
+
+
+def build_environ(scope, body, content_length):
+    """ASGIスコープからWSGI environを作成（body: 読み込み位置を先頭にしたファイル）"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(content_length)
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def handle_wsgi(scope, receive, send):
+    """Flaskアプリへの委譲（ボディは一時ファイル経由で渡し、レスポンスはチャンク毎に逐次送信）"""
+    # 一括取り込みのみ大きなアップロードを許可（大きなボディはメモリに保持しない）
+    limit = server.IMPORT_MAX_CONTENT_LENGTH if scope['path'] == '/api/company/import' else app.config['MAX_CONTENT_LENGTH']
+    spooled = await spool_body(receive, limit)
+    if spooled is None:
+        return await send_json(send, 413, {'error': 'データサイズが大きすぎます'})
+    body, content_length = spooled
+    try:
+        await run_wsgi(send, build_environ(scope, body, content_length))
+    finally:
+        body.close()
+
+
+async def run_wsgi(send, environ):
+    """WSGIアプリをスレッドプールで実行し、レスポンスを逐次送信"""
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    def call_app():
+        return iter(app(environ, start_response))
+
+    iterator = await loop.run_in_executor(None, call_app)
+    sentinel = object()
+    try:
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        while True:
+            chunk = await loop.run_in_executor(None, next, iterator, sentinel)
+            if chunk is sentinel:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(None, close)
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # 同じデータベースファイルを開くこのプロセスでマイグレーションを実行（ファイルロック下で1回だけ）
+            await asyncio.get_running_loop().run_in_executor(None, server.migrate_database)
+            writer.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            writer.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGIアプリケーション"""
+    if scope['type'] == 'lifespan':
+        return await handle_lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['path'].startswith('/api/') and not server.ensure_database_ready():
+        return await send_json(send, 503, {'error': 'データベースの準備ができていません'})
+
+    if scope['path'] == '/api/submit' and scope['method'] == 'POST':
+        return await handle_submit(scope, receive, send)
+    if scope['path'] == '/api/stream' and scope['method'] == 'GET':
+        return await handle_stream(scope, receive, send)
+    return await handle_wsgi(scope, receive, send)
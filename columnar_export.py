@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 列指向形式のエクスポート
+
+回答を設問毎の型付きの列に分けて出力する。件数の多い企業でもメモリ使用量が
+一定になるよう、chunk_rows 件ずつ列に変換して書き出す。
+
+形式:
+    parquet   Apache Parquet（pyarrowが必要: pip install pyarrow）。チャンク毎に1行グループ
+    columnar  標準ライブラリのみで作成するZIP形式（pyarrowがない環境での代替）
+
+列の型:
+    int8        0〜10点・5段階評価の点数（5段階評価は1〜5点、未回答はnull）
+    float64     数値入力（入社年・年収など）
+    dictionary  部署・役職などの選択項目（値の一覧と番号で保存）
+    string      自由記述・その他の文字列
+
+columnar形式のZIPの構成:
+    schema.json                      形式・列定義・行数・チャンク数
+    chunks/<番号>/<列名>.bin         int8: array('b')（null は -1）、float64: array('d')（null は NaN）、
+                                     dictionary: array('i') の番号（null は -1）
+    chunks/<番号>/<列名>.json        string: 値のJSON配列（null は null）
+    dictionaries/<列名>.json         dictionary列の値の一覧（番号順）
+    数値はリトルエンディアン。read_columnar() で列毎のリストとして読み込める。
+"""
+
+import json
+import math
+import sys
+import zipfile
+from array import array
+
+try:
+    import pyarrow  # 任意依存（Parquet形式で出力する場合のみ）
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNAR_FORMAT = 'survey-columnar'
+COLUMNAR_VERSION = 1
+
+COLUMN_TYPES = ('int8', 'float64', 'dictionary', 'string')
+
+# 形式毎の拡張子とContent-Type
+FORMAT_FILES = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'columnar': ('.zip', 'application/zip')
+}
+
+
+def resolve_format(requested):
+    """出力形式の決定（Parquetはpyarrowがない場合にcolumnarへ切り替え）"""
+    if requested == 'parquet' and pyarrow is None:
+        return 'columnar'
+    return requested
+
+
+def build_converters(columns):
+    """列毎の値の変換関数（変換できない値はNone）"""
+    converters = []
+    for column in columns:
+        column_type = column['type']
+        if column_type == 'int8':
+            # labels がある列は選択肢の番号+1、ない列は値そのもの（文字列の数字も受け付ける）
+            if column.get('labels'):
+                scores = {label: score for score, label in enumerate(column['labels'], 1)}
+            else:
+                scores = {value: value for value in range(128)}
+            scores.update({str(key): score for key, score in list(scores.items())})
+            converters.append(lambda value, scores=scores: scores.get(value) if isinstance(value, (int, str)) else None)
+        elif column_type == 'float64':
+            converters.append(to_float)
+        elif column_type in ('dictionary', 'string'):
+            converters.append(lambda value: None if value is None or value == '' else str(value))
+        else:
+            raise ValueError(f"unknown column type: {column_type}")
+    return converters
+
+
+def to_float(value):
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def iter_chunks(columns, rows, chunk_rows):
+    """回答（dict）を chunk_rows 件ずつ列のリストに変換"""
+    names = [column['name'] for column in columns]
+    converters = build_converters(columns)
+    chunk = [[] for _ in columns]
+    count = 0
+    for row in rows:
+        for values, name, convert in zip(chunk, names, converters):
+            values.append(convert(row.get(name)))
+        count += 1
+        if count == chunk_rows:
+            yield chunk
+            chunk = [[] for _ in columns]
+            count = 0
+    if count:
+        yield chunk
+
+
+def write_columnar_export(path, columns, rows, output_format='parquet', chunk_rows=10000, metadata=None):
+    """列指向形式での書き出し（戻り値: (実際の形式, 行数)）
+
+    columns: [{'name': 列名, 'type': 型, 'labels': 5段階評価の選択肢（任意）}, ...]
+    rows: 列名→値 のdictを返すイテレータ
+    """
+    output_format = resolve_format(output_format)
+    if output_format == 'parquet':
+        return output_format, write_parquet(path, columns, rows, chunk_rows, metadata)
+    if output_format == 'columnar':
+        return output_format, write_columnar_zip(path, columns, rows, chunk_rows, metadata)
+    raise ValueError(f"unknown export format: {output_format}")
+
+
+def write_parquet(path, columns, rows, chunk_rows, metadata=None):
+    arrow_types = {
+        'int8': pyarrow.int8(),
+        'float64': pyarrow.float64(),
+        'dictionary': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+        'string': pyarrow.string()
+    }
+    fields = []
+    for column in columns:
+        field_metadata = {'labels': json.dumps(column['labels'], ensure_ascii=False)} if column.get('labels') else None
+        fields.append(pyarrow.field(column['name'], arrow_types[column['type']], metadata=field_metadata))
+    schema = pyarrow.schema(fields, metadata={
+        'survey_export': json.dumps(metadata or {}, ensure_ascii=False)
+    })
+
+    total = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for chunk in iter_chunks(columns, rows, chunk_rows):
+            arrays = []
+            for column, values in zip(columns, chunk):
+                if column['type'] == 'dictionary':
+                    arrays.append(pyarrow.array(values, type=pyarrow.string()).dictionary_encode())
+                else:
+                    arrays.append(pyarrow.array(values, type=arrow_types[column['type']]))
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            total += len(chunk[0])
+    return total
+
+
+def write_columnar_zip(path, columns, rows, chunk_rows, metadata=None):
+    dictionaries = {column['name']: {} for column in columns if column['type'] == 'dictionary'}
+    total = 0
+    chunk_count = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for chunk in iter_chunks(columns, rows, chunk_rows):
+            prefix = f'chunks/{chunk_count:05d}'
+            for column, values in zip(columns, chunk):
+                name, column_type = column['name'], column['type']
+                if column_type == 'string':
+                    archive.writestr(f'{prefix}/{name}.json', json.dumps(values, ensure_ascii=False))
+                    continue
+                if column_type == 'int8':
+                    encoded = array('b', [-1 if value is None else value for value in values])
+                elif column_type == 'float64':
+                    encoded = array('d', [math.nan if value is None else value for value in values])
+                else:
+                    codes = dictionaries[name]
+                    encoded = array('i', [-1 if value is None else codes.setdefault(value, len(codes))
+                                          for value in values])
+                if sys.byteorder != 'little':
+                    encoded.byteswap()
+                archive.writestr(f'{prefix}/{name}.bin', encoded.tobytes())
+            total += len(chunk[0])
+            chunk_count += 1
+
+        for name, codes in dictionaries.items():
+            archive.writestr(f'dictionaries/{name}.json', json.dumps(list(codes), ensure_ascii=False))
+        archive.writestr('schema.json', json.dumps({
+            'format': COLUMNAR_FORMAT,
+            'version': COLUMNAR_VERSION,
+            'rows': total,
+            'chunks': chunk_count,
+            'chunk_rows': chunk_rows,
+            'columns': columns,
+            'metadata': metadata or {}
+        }, ensure_ascii=False))
+    return total
+
+
+def read_columnar(path):
+    """columnar形式の読み込み（戻り値: (schema, 列名→値のリスト)）"""
+    with zipfile.ZipFile(path) as archive:
+        schema = json.loads(archive.read('schema.json'))
+        if schema.get('format') != COLUMNAR_FORMAT or schema.get('version') != COLUMNAR_VERSION:
+            raise ValueError('unsupported columnar export')
+        dictionaries = {
+            column['name']: json.loads(archive.read(f"dictionaries/{column['name']}.json"))
+            for column in schema['columns'] if column['type'] == 'dictionary'
+        }
+        data = {column['name']: [] for column in schema['columns']}
+        for index in range(schema['chunks']):
+            prefix = f'chunks/{index:05d}'
+            for column in schema['columns']:
+                name, column_type = column['name'], column['type']
+                if column_type == 'string':
+                    data[name].extend(json.loads(archive.read(f'{prefix}/{name}.json')))
+                    continue
+                encoded = array({'int8': 'b', 'float64': 'd', 'dictionary': 'i'}[column_type])
+                encoded.frombytes(archive.read(f'{prefix}/{name}.bin'))
+                if sys.byteorder != 'little':
+                    encoded.byteswap()
+                if column_type == 'int8':
+                    data[name].extend(None if value < 0 else value for value in encoded)
+                elif column_type == 'float64':
+                    data[name].extend(None if math.isnan(value) else value for value in encoded)
+                else:
+                    values = dictionaries[name]
+                    data[name].extend(None if code < 0 else values[code] for code in encoded)
+    return schema, data
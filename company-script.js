@@ -22,8 +22,63 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // データ読み込み
     loadDashboardData();
+    
+    // 回答のリアルタイム反映
+    connectLiveUpdates();
 });
 
+// サーバーからの更新通知の受信
+let liveRefreshTimer = null;
+
+async function connectLiveUpdates() {
+    if (!window.EventSource) return;
+    
+    // アクセストークンはURLに載せず、短時間だけ有効な接続用チケットを取得して接続する
+    const ticket = await fetchStreamTicket();
+    if (!ticket) return;
+    const source = new EventSource(`/api/stream?ticket=${encodeURIComponent(ticket)}`);
+    let opened = false;
+    source.onopen = () => { opened = true; };
+    
+    // 連続した通知はまとめて1回だけ再取得する
+    const scheduleRefresh = () => {
+        clearTimeout(liveRefreshTimer);
+        liveRefreshTimer = setTimeout(loadDashboardData, 1000);
+    };
+    
+    source.addEventListener('response', event => {
+        const delta = JSON.parse(event.data);
+        if (delta.total_responses !== null && delta.total_responses !== undefined) {
+            document.getElementById('totalResponses').textContent = delta.total_responses;
+        }
+        scheduleRefresh();
+    });
+    source.addEventListener('invalidate', scheduleRefresh);
+    
+    // チケットは失効するため自動再接続はせず、新しいチケットで接続し直す（接続できなかった場合は終了）
+    source.onerror = () => {
+        source.close();
+        if (opened) {
+            setTimeout(connectLiveUpdates, 5000);
+        }
+    };
+}
+
+// リアルタイム配信の接続用チケットの取得（失敗時はnull）
+async function fetchStreamTicket() {
+    try {
+        const response = await fetch('/api/stream/ticket', {
+            method: 'POST',
+            headers: getAuthHeaders(),
+            body: JSON.stringify({ role: 'company' })
+        });
+        if (!response.ok) return null;
+        return (await response.json()).ticket;
+    } catch (error) {
+        return null;
+    }
+}
+
 // 認証ヘッダー取得
 function getAuthHeaders() {
     return {
@@ -197,8 +252,8 @@ async function loadAnalyticsData() {
         // 満足度分布表示
         renderSatisfactionBars(data.satisfactionDistribution || []);
         
-        // 最近の回答表示
-        renderRecentResponses(data.recentResponses || []);
+        // 部署・役職別の回答状況表示
+        renderSegments(data.segments || [], data.minCellSize);
         
     } catch (error) {
         console.error('分析データ読み込みエラー:', error);
@@ -212,6 +267,7 @@ function renderSatisfactionBars(distribution) {
     const total = distribution.reduce((a, b) => a + b, 0) || 1;
     
     const bars = labels.map((label, index) => {
+        // 件数が閾値未満の点数（null）は件数を表示しない
         const count = distribution[index] || 0;
         const percentage = (count / total * 100);
         
@@ -221,7 +277,7 @@ function renderSatisfactionBars(distribution) {
                 <div class="bar-fill">
                     <div class="bar-progress ${colors[index]}" style="width: ${percentage}%"></div>
                 </div>
-                <div class="bar-count">${count}</div>
+                <div class="bar-count">${distribution[index] === null ? '-' : count}</div>
             </div>
         `;
     }).join('');
@@ -229,30 +285,43 @@ function renderSatisfactionBars(distribution) {
     document.getElementById('satisfactionBars').innerHTML = bars;
 }
 
-// 最近の回答表示
-function renderRecentResponses(responses) {
-    if (responses.length === 0) {
+// 部署・役職別の回答状況表示（回答者数が閾値未満のグループは数値を表示しない）
+function renderSegments(segments, minCellSize) {
+    if (segments.length === 0) {
         document.getElementById('recentResponses').innerHTML = '<p style="color: #666; text-align: center;">まだ回答がありません</p>';
         return;
     }
     
-    const responseItems = responses.map(response => {
+    const segmentItems = segments.map(segment => {
+        const label = `${segment.department || '部署不明'} - ${segment.position || '役職不明'}`;
+        if (segment.suppressed) {
+            return `
+                <div class="response-item">
+                    <div class="response-header">
+                        <span class="response-time">回答者${minCellSize}名未満等のため非表示</span>
+                    </div>
+                    <div class="response-department">${label}</div>
+                </div>
+            `;
+        }
+        
         let satisfactionClass = 'medium';
-        if (response.satisfaction >= 4) satisfactionClass = 'high';
-        else if (response.satisfaction <= 2) satisfactionClass = 'low';
+        if (segment.mean >= 4) satisfactionClass = 'high';
+        else if (segment.mean <= 2) satisfactionClass = 'low';
+        const satisfaction = segment.mean !== null ? segment.mean.toFixed(1) : '-';
         
         return `
             <div class="response-item">
                 <div class="response-header">
-                    <span class="response-time">${formatDateTime(response.timestamp)}</span>
-                    <span class="response-satisfaction ${satisfactionClass}">満足度 ${response.satisfaction}/5</span>
+                    <span class="response-time">回答者 ${segment.respondents}名</span>
+                    <span class="response-satisfaction ${satisfactionClass}">満足度 ${satisfaction}/5</span>
                 </div>
-                <div class="response-department">${response.department || '部署不明'} - ${response.position || '役職不明'}</div>
+                <div class="response-department">${label}</div>
             </div>
         `;
     }).join('');
     
-    document.getElementById('recentResponses').innerHTML = responseItems;
+    document.getElementById('recentResponses').innerHTML = segmentItems;
 }
 
 // 新規URL作成モーダル表示
@@ -484,6 +553,7 @@ async function refreshData() {
 // 結果エクスポート
 async function exportResults() {
     try {
+        // エクスポートはサーバーのバックグラウンドジョブで作成される
         const response = await fetch('/api/company/export', {
             headers: getAuthHeaders()
         });
@@ -493,10 +563,16 @@ async function exportResults() {
         }
         
         const data = await response.json();
+        await waitForJob(data.status_url, { headers: getAuthHeaders() });
         
         // CSVダウンロード
-        const csvContent = data.csvData;
-        const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
+        const download = await fetch(data.download_url, {
+            headers: getAuthHeaders()
+        });
+        if (!download.ok) {
+            throw new Error('エクスポートファイルの取得に失敗');
+        }
+        const blob = await download.blob();
         const link = document.createElement('a');
         const url = URL.createObjectURL(blob);
         
@@ -515,6 +591,24 @@ async function exportResults() {
     }
 }
 
+// バックグラウンドジョブの完了待ち（完了したジョブの状態を返す）
+async function waitForJob(statusUrl, options = {}) {
+    while (true) {
+        const response = await fetch(statusUrl, options);
+        if (!response.ok) {
+            throw new Error('ジョブの状態を取得できませんでした');
+        }
+        const { job } = await response.json();
+        if (job.status === 'completed') {
+            return job;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'ジョブが失敗しました');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // ログアウト
 function logout() {
     if (confirm('ログアウトしますか？')) {
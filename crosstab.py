@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 部署×役職×設問のクロス集計
+
+回答の保存時に (企業, 部署, 役職, 設問) 毎の回答数・点数の合計・二乗和を crosstab_cells
+テーブルに加算しておき（スキーマは server.py のマイグレーションで作成）、部署別・役職別・
+全体の集計はこのセルの合計だけで返す。回答件数が増えても集計時に回答を走査しない。
+
+    ドリルダウン  group_by=('department',) → department='営業部', group_by=('position',)
+    ロールアップ  group_by=() で企業全体
+
+回答者の特定を防ぐため、回答者数が min_cell_size 未満のグループは数値を返さない（小セル秘匿、
+企業向けAPIではSQLでの除外と補完秘匿を anonymity.py で行う）。
+設問 RESPONDENTS_QUESTION のセルには設問に関係なく回答1件につき1を加算し、グループの回答者数とする。
+"""
+
+from storage import CROSSTAB_DIMENSIONS, RESPONDENTS_QUESTION
+from survey_stats import mean_interval, sample_variance
+
+# 部署・役職が未回答の回答、企業に紐付かない回答（管理者発行のURL・URLなし）のキー
+UNANSWERED = ''
+NO_COMPANY = ''
+
+
+class CellAccumulator:
+    """回答をクロス集計セルの加算分にまとめる（1件の送信・取り込みの1バッチ・移行時の全件）
+
+    score_maps: フィールド→(回答値→点数)（report_engine.build_score_maps）
+    """
+
+    def __init__(self, score_maps):
+        self.score_maps = score_maps
+        self.cells = {}
+
+    def _add(self, key, score):
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = [0, 0, 0]
+        cell[0] += 1
+        cell[1] += score
+        cell[2] += score * score
+
+    def add(self, company_id, data):
+        """1件の回答（展開済みのdict）の加算"""
+        group = (
+            company_id or NO_COMPANY,
+            dimension_value(data.get('department')),
+            dimension_value(data.get('position'))
+        )
+        self._add(group + (RESPONDENTS_QUESTION,), 0)
+        for field, scores in self.score_maps.items():
+            value = data.get(field)
+            if value is None or isinstance(value, bool):
+                continue
+            score = scores.get(value)
+            if score is not None:
+                self._add(group + (field,), score)
+
+    def rows(self):
+        """(企業ID, 部署, 役職, 設問, 回答数, 合計, 二乗和) のリスト"""
+        return [key + tuple(cell) for key, cell in self.cells.items()]
+
+
+class BucketAccumulator:
+    """回答を (企業, 期間, 設問, 点数) 毎の件数にまとめる（信頼区間・期間比較用の度数分布）"""
+
+    def __init__(self, score_maps):
+        self.score_maps = score_maps
+        self.buckets = {}
+
+    def add(self, company_id, period, data):
+        """1件の回答（展開済みのdict）の加算（period は 'YYYY-MM'）"""
+        prefix = (company_id or NO_COMPANY, period)
+        for field, scores in self.score_maps.items():
+            value = data.get(field)
+            if value is None or isinstance(value, bool):
+                continue
+            score = scores.get(value)
+            if score is not None:
+                key = prefix + (field, score)
+                self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def rows(self):
+        """(企業ID, 期間, 設問, 点数, 件数) のリスト"""
+        return [key + (count,) for key, count in self.buckets.items()]
+
+
+def dimension_value(value):
+    if value is None or value == '':
+        return UNANSWERED
+    return str(value)
+
+
+def summarize_cell(count, total, total_sq):
+    """回答数・合計・二乗和から平均・標準偏差（標本）・平均の95%信頼区間"""
+    summary = mean_interval(count, total, total_sq)
+    summary['stddev'] = round(sample_variance(count, total, total_sq) ** 0.5, 3)
+    return summary
+
+
+def build_crosstab(rows, group_by, min_cell_size, suppressed=()):
+    """セルの合計からクロス集計結果を作成
+
+    rows: (グループ列の値..., 設問, 回答数, 合計, 二乗和)（StorageSession.fetch_crosstab の戻り値）
+    回答者数が min_cell_size 未満のグループ・回答数が min_cell_size 未満の設問は秘匿する。
+    suppressed には rows から除いたグループ（anonymity.AnonymousAggregator で秘匿したもの）のキーを渡す。
+    """
+    groups = {key: {'respondents': 0, 'questions': {}} for key in suppressed}
+    for row in rows:
+        key = tuple(row[:len(group_by)])
+        question, count, total, total_sq = row[len(group_by):]
+        group = groups.setdefault(key, {'respondents': 0, 'questions': {}})
+        if question == RESPONDENTS_QUESTION:
+            group['respondents'] = count
+        elif count:
+            group['questions'][question] = (count, total, total_sq)
+
+    result = []
+    for key in sorted(groups):
+        group = groups[key]
+        entry = dict(zip(group_by, key))
+        if group['respondents'] < min_cell_size:
+            entry.update(respondents=None, suppressed=True, questions={})
+        else:
+            entry.update(respondents=group['respondents'], suppressed=False, questions={
+                question: summarize_cell(*cell) if cell[0] >= min_cell_size else None
+                for question, cell in sorted(group['questions'].items())
+            })
+        result.append(entry)
+    return result
+
+
+def parse_dimensions(value):
+    """group_by パラメータ（カンマ区切り）の解析（未対応の列はValueError）"""
+    dimensions = tuple(name for name in (value or '').split(',') if name)
+    if any(name not in CROSSTAB_DIMENSIONS for name in dimensions) or len(set(dimensions)) != len(dimensions):
+        raise ValueError(f'unknown dimension: {value}')
+    return dimensions
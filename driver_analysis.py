@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - キードライバー分析
+
+各項目の満足度（*_satisfaction）が総合満足度・定着意向・推奨度（NPS）にどれだけ影響しているかを、
+企業毎に保持するモーメント行列（回答数・各変数の合計・変数の組毎の積の合計）から求める。
+回答の保存時にモーメント行列へ加算しておくため（スキーマは server.py のマイグレーションで作成）、
+分析時に回答を走査しない。分析対象の全変数に回答した回答のみを集計する（リストワイズ）。
+
+    相関        各項目の満足度と目的変数のピアソン相関係数
+    回帰        全項目の満足度を説明変数とした重回帰の標準化係数と決定係数
+    重要度×満足度  重要度（相関係数）と満足度の平均で4象限に分類し、期待度との差（期待−満足）を併記
+
+変数は数十個のため、行列計算は標準ライブラリのみで行う。
+"""
+
+from array import array
+
+# 目的変数（API上の名前→回答のフィールド）
+DRIVER_TARGETS = {
+    'overall_satisfaction': 'overall_satisfaction',
+    'retention_intention': 'retention_intention',
+    'nps': 'recommendation'
+}
+
+# 重回帰の係数を安定させるための対角成分への加算（相関行列に対して）
+RIDGE = 1e-6
+
+# 重要度×満足度の象限（重要度が高い/低い, 満足度が高い/低い）
+QUADRANTS = {
+    (True, False): ('improve', '重点改善'),
+    (True, True): ('maintain', '強み維持'),
+    (False, False): ('monitor', '現状維持'),
+    (False, True): ('surplus', '過剰品質')
+}
+
+
+def driver_variables(topics):
+    """モーメント行列の変数（説明変数＝各項目の満足度、続けて目的変数）"""
+    return [f'{topic}_satisfaction' for topic in topics] + list(DRIVER_TARGETS.values())
+
+
+def triangle_index(i, j):
+    """上三角（対角を含む）の格納位置（i <= j）"""
+    return j * (j + 1) // 2 + i
+
+
+class MomentAccumulator:
+    """回答を企業毎のモーメント行列の加算分にまとめる"""
+
+    def __init__(self, variables, score_maps):
+        self.variables = variables
+        self.score_maps = [score_maps[name] for name in variables]
+        self.moments = {}
+
+    def add(self, company_id, data):
+        """1件の回答（展開済みのdict）の加算（変数に未回答がある回答は対象外）"""
+        values = []
+        for name, scores in zip(self.variables, self.score_maps):
+            value = data.get(name)
+            score = None if value is None or isinstance(value, bool) else scores.get(value)
+            if score is None:
+                return
+            values.append(score)
+
+        moments = self.moments.get(company_id)
+        if moments is None:
+            moments = self.moments[company_id] = empty_moments(len(self.variables))
+        moments[0] += 1
+        sums, cross = moments[1], moments[2]
+        for j, value_j in enumerate(values):
+            sums[j] += value_j
+            offset = j * (j + 1) // 2
+            for i in range(j + 1):
+                cross[offset + i] += values[i] * value_j
+
+    def items(self):
+        return self.moments.items()
+
+
+def empty_moments(size):
+    return [0, array('d', bytes(8 * size)), array('d', bytes(8 * (size * (size + 1) // 2)))]
+
+
+def merge_moments(stored, added):
+    """保存済みのモーメント（None は空）に加算分を加える"""
+    if stored is None:
+        return added
+    count, sums, cross = stored
+    return [count + added[0],
+            array('d', (a + b for a, b in zip(sums, added[1]))),
+            array('d', (a + b for a, b in zip(cross, added[2])))]
+
+
+def encode_moments(moments):
+    """保存用のバイト列 (回答数, 合計, 積の合計)"""
+    return moments[0], moments[1].tobytes(), moments[2].tobytes()
+
+
+def decode_moments(count, sums, cross):
+    decoded_sums, decoded_cross = array('d'), array('d')
+    decoded_sums.frombytes(bytes(sums))
+    decoded_cross.frombytes(bytes(cross))
+    return [count, decoded_sums, decoded_cross]
+
+
+def correlation_matrix(moments):
+    """モーメントから (平均, 標準偏差, 相関行列)（分散0の変数の相関はNone）"""
+    count, sums, cross = moments
+    size = len(sums)
+    means = [value / count for value in sums]
+    covariance = [[0.0] * size for _ in range(size)]
+    for j in range(size):
+        for i in range(j + 1):
+            value = (cross[triangle_index(i, j)] - sums[i] * sums[j] / count) / (count - 1)
+            covariance[i][j] = covariance[j][i] = value
+    stddevs = [max(covariance[i][i], 0.0) ** 0.5 for i in range(size)]
+    correlation = [
+        [covariance[i][j] / (stddevs[i] * stddevs[j]) if stddevs[i] > 0 and stddevs[j] > 0 else None
+         for j in range(size)]
+        for i in range(size)
+    ]
+    return means, stddevs, correlation
+
+
+def solve(matrix, vector):
+    """連立一次方程式（部分ピボット付きガウスの消去法、特異な場合はNone）"""
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            return None
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, size):
+            factor = rows[row][column] / rows[column][column]
+            if factor:
+                for k in range(column, size + 1):
+                    rows[row][k] -= factor * rows[column][k]
+    solution = [0.0] * size
+    for row in range(size - 1, -1, -1):
+        total = rows[row][size] - sum(rows[row][k] * solution[k] for k in range(row + 1, size))
+        solution[row] = total / rows[row][row]
+    return solution
+
+
+def analyze_drivers(moments, variables, target, performance, min_count):
+    """1つの目的変数に対するキードライバー分析
+
+    moments: 企業のモーメント（decode_moments の戻り値）
+    performance: 説明変数→(満足度の平均, 期待度の平均)（期待度はNone可）
+    回答数が min_count 未満の場合はNone、説明変数の数+2未満の場合は回帰を省略する。
+    """
+    if moments is None or moments[0] < max(min_count, 3):
+        return None
+    count = moments[0]
+    target_index = variables.index(DRIVER_TARGETS[target])
+    driver_count = len(variables) - len(DRIVER_TARGETS)
+    means, _, correlation = correlation_matrix(moments)
+
+    # 分散0（全員が同じ回答）の項目は回帰から除く
+    usable = [i for i in range(driver_count) if correlation[i][target_index] is not None]
+    betas = {}
+    r_squared = None
+    if usable and count >= driver_count + 2:
+        matrix = [[(correlation[i][j] or 0.0) + (RIDGE if i == j else 0.0) for j in usable] for i in usable]
+        solution = solve(matrix, [correlation[i][target_index] for i in usable])
+        if solution is not None:
+            betas = dict(zip(usable, solution))
+            r_squared = sum(betas[i] * correlation[i][target_index] for i in usable)
+
+    drivers = []
+    for i in range(driver_count):
+        name = variables[i]
+        satisfaction_mean, expectation_mean = performance.get(name, (means[i], None))
+        importance = correlation[i][target_index]
+        drivers.append({
+            'question': name,
+            'correlation': None if importance is None else round(importance, 3),
+            'beta': round(betas[i], 3) if i in betas else None,
+            'satisfaction': round(satisfaction_mean, 3),
+            'expectation': None if expectation_mean is None else round(expectation_mean, 3),
+            'gap': None if expectation_mean is None else round(expectation_mean - satisfaction_mean, 3)
+        })
+
+    classify_quadrants(drivers)
+    drivers.sort(key=lambda driver: -(driver['correlation'] or 0.0))
+    return {
+        'target': target,
+        'n': count,
+        'r_squared': None if r_squared is None else round(max(min(r_squared, 1.0), 0.0), 3),
+        'drivers': drivers
+    }
+
+
+def classify_quadrants(drivers):
+    """重要度（相関係数）と満足度のそれぞれ中央値を境に4象限へ分類"""
+    rated = [driver for driver in drivers if driver['correlation'] is not None]
+    if not rated:
+        return
+    importance_median = median([driver['correlation'] for driver in rated])
+    performance_median = median([driver['satisfaction'] for driver in rated])
+    for driver in drivers:
+        if driver['correlation'] is None:
+            driver['quadrant'] = driver['quadrant_label'] = None
+            continue
+        key = (driver['correlation'] >= importance_median, driver['satisfaction'] >= performance_median)
+        driver['quadrant'], driver['quadrant_label'] = QUADRANTS[key]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - リアルタイム配信用のプロセス内Pub/Sub
+
+チャンネル（'global' や 'company:<企業ID>'）単位で購読者にイベントを配信する。
+購読者はスレッド（WSGIのSSE）でもasyncio（ASGIのSSE）でも受信できる。
+"""
+
+import asyncio
+import itertools
+import json
+import queue
+import threading
+
+
+def format_sse(event, data, event_id=None):
+    """Server-Sent Events形式のメッセージを作成"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    for line in json.dumps(data, ensure_ascii=False).splitlines():
+        lines.append(f'data: {line}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscription:
+    """スレッドから待ち受ける購読（キュー上限を超えた古いイベントは破棄）"""
+
+    def __init__(self, channels, max_pending=100):
+        self.channels = tuple(channels)
+        self.queue = queue.Queue(maxsize=max_pending)
+
+    def push(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        """次のメッセージを待つ（タイムアウト時はNone）"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """asyncioのイベントループで待ち受ける購読"""
+
+    def __init__(self, channels, loop, max_pending=100):
+        super().__init__(channels, max_pending)
+        self.loop = loop
+        self.async_queue = asyncio.Queue(maxsize=max_pending)
+
+    def push(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self.async_queue.full():
+            self.async_queue.get_nowait()
+        self.async_queue.put_nowait(message)
+
+    async def get_async(self, timeout):
+        try:
+            return await asyncio.wait_for(self.async_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    """チャンネル単位のプロセス内Pub/Sub"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.sequence = itertools.count(1)
+
+    def subscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                members = self.subscribers.get(channel)
+                if members is not None:
+                    members.discard(subscription)
+                    if not members:
+                        del self.subscribers[channel]
+
+    def channels(self):
+        """購読者が存在するチャンネル一覧"""
+        with self.lock:
+            return list(self.subscribers)
+
+    def has_subscribers(self, channel=None):
+        with self.lock:
+            if channel is None:
+                return bool(self.subscribers)
+            return channel in self.subscribers
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(set().union(*self.subscribers.values())) if self.subscribers else 0
+
+    def publish(self, channel, event, data):
+        """チャンネルの購読者へイベントを配信（シリアライズは1回のみ）"""
+        with self.lock:
+            members = list(self.subscribers.get(channel, ()))
+        if not members:
+            return 0
+        message = format_sse(event, data, next(self.sequence))
+        for subscription in members:
+            subscription.push(message)
+        return len(members)
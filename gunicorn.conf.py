@@ -0,0 +1,70 @@
+"""
+従業員満足度調査システム - 本番用gunicorn設定
+
+起動: gunicorn -c gunicorn.conf.py server:app
+（python3 start_server.py --production でも起動可能）
+
+環境変数で上書き可能:
+    PORT              待ち受けポート（既定: 5000）
+    WEB_CONCURRENCY   ワーカープロセス数（既定: CPU数+1、最大8）
+    GUNICORN_THREADS  ワーカー毎のスレッド数（既定: 4）
+    GUNICORN_PIDFILE  PIDファイルのパス（既定: gunicorn.pid）
+
+グレースフルリロード: kill -HUP $(cat gunicorn.pid)
+（python3 start_server.py --reload でも可）
+"""
+
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{_env_int('PORT', 5000)}"
+
+# ワーカー・スレッド数（SQLiteは単一ライターのためワーカー数には上限を設ける）
+worker_class = 'gthread'
+workers = _env_int('WEB_CONCURRENCY', min(cpu_count + 1, 8))
+threads = _env_int('GUNICORN_THREADS', 4)
+
+# 接続設定
+backlog = 2048
+keepalive = 5
+timeout = 60
+graceful_timeout = 30
+
+# メモリ増加対策としてワーカーを定期的に再起動
+max_requests = 5000
+max_requests_jitter = 500
+
+# アプリをマスターで事前読み込み（静的ファイルの前処理を共有）
+# server.py はimport時にSQLite接続を開かないため、fork後に接続は引き継がれない
+preload_app = True
+
+pidfile = os.environ.get('GUNICORN_PIDFILE', 'gunicorn.pid')
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+
+
+def on_starting(server):
+    """ワーカー起動前にマスターでマイグレーションを実行（ワーカーと同じデータベースファイルに対して1回だけ）"""
+    import server as app_module
+    app_module.migrate_database()
+
+
+def post_fork(server, worker):
+    """fork後のワーカー内状態の初期化"""
+    import server as app_module
+    app_module.reset_after_fork()
+
+
+def on_reload(server):
+    server.log.info("設定を再読み込みし、ワーカーを順次再起動します")
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - バックグラウンドジョブ
+
+エクスポート・バックアップなどの時間のかかる処理をリクエストのスレッドから切り離して実行する。
+ジョブは SQLite の jobs テーブルに保存し（スキーマは server.py のマイグレーションで作成）、
+各プロセスのワーカースレッドが取り出して実行する。複数のgunicornワーカーが同じテーブルを
+参照するため、どのワーカーで登録したジョブでも、どのワーカーからでも状態・結果を取得できる。
+
+状態: queued → running → completed / failed（失敗時は max_attempts 回まで間隔を空けて再実行）
+結果のファイルは artifact_directory に保存し、保存期間を過ぎたジョブと共に削除する。
+
+ハンドラは handler(context) の形式で登録する。context.params で登録時のパラメータを、
+context.artifact(ファイル名, Content-Type) で結果ファイルの書き込み先を取得し、
+context.progress(0〜1) で進捗を記録する。進捗を記録できない長い1回の処理は
+with context.heartbeat(): の中で実行する。戻り値（dict）はジョブの結果として保存される。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+JOB_STATES = ('queued', 'running', 'completed', 'failed')
+
+# 実行中のまま進捗が更新されないジョブを再実行する秒数（ワーカーの異常終了対策）
+STALE_JOB_SECONDS = 600
+
+# heartbeat() で実行中であることを記録する間隔（秒）
+HEARTBEAT_SECONDS = 60
+
+# 再実行までの待ち時間（秒、試行回数に比例）
+RETRY_DELAY_SECONDS = 30
+
+# 保存期間切れのジョブを削除する間隔（ワーカーの待機回数）
+CLEANUP_EVERY = 100
+
+
+class JobContext:
+    """実行中のジョブからキューへの記録"""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.id = job['id']
+        self.kind = job['kind']
+        self.owner = job['owner']
+        self.params = job['params']
+        self.artifact_path = None
+        self.artifact_name = None
+        self.content_type = None
+        self.last_progress_at = 0.0
+
+    def artifact(self, filename, content_type='application/octet-stream'):
+        """結果ファイルの書き込み先パス（ダウンロード時のファイル名と形式を記録）"""
+        os.makedirs(self.queue.artifact_directory, exist_ok=True)
+        extension = os.path.splitext(filename)[1]
+        self.artifact_path = os.path.join(self.queue.artifact_directory, f'{self.id}{extension}')
+        self.artifact_name = filename
+        self.content_type = content_type
+        return self.artifact_path
+
+    def progress(self, fraction):
+        """進捗（0〜1）の記録（書き込みを減らすため1秒に1回まで）"""
+        now = time.time()
+        if now - self.last_progress_at < 1.0:
+            return
+        self.last_progress_at = now
+        self.queue._execute(
+            'UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ? AND status = ?',
+            (min(max(float(fraction), 0.0), 1.0), now, self.id, 'running')
+        )
+
+    @contextmanager
+    def heartbeat(self, interval=HEARTBEAT_SECONDS):
+        """進捗を記録できない長い処理の間、別スレッドで実行中であることを記録（再実行の対象にしない）"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.queue._execute(
+                        'UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?',
+                        (time.time(), self.id, 'running')
+                    )
+                except sqlite3.Error:
+                    pass  # 一時的なロック等は次の間隔で再度記録する
+
+        thread = threading.Thread(target=beat, name=f'job-heartbeat-{self.id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+
+class JobQueue:
+    """SQLiteに保存するジョブキューとワーカースレッド"""
+
+    def __init__(self, database_path, artifact_directory, workers=2, poll_interval=2.0,
+                 max_attempts=3, retention_seconds=24 * 3600):
+        self.database_path = database_path
+        self.artifact_directory = artifact_directory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.handlers = {}
+        self.reset()
+
+    def reset(self):
+        """fork後の初期化（ワーカースレッドは子プロセスに引き継がれないため作り直す）"""
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.threads = []
+        self.worker_name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def _connect(self):
+        return sqlite3.connect(self.database_path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    # ---- 登録・参照 ----
+
+    def submit(self, kind, params=None, owner=None, reuse=False):
+        """ジョブの登録（戻り値: ジョブの状態）
+
+        reuse=True の場合、種類・所有者・パラメータが同じで失敗していないジョブがあれば登録せずにそれを返す。
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'unknown job kind: {kind}')
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        params_json = json.dumps(params or {}, ensure_ascii=False, sort_keys=True)
+        conn = self._connect()
+        try:
+            # 既存ジョブの確認と登録を複数プロセスで競合しないよう書き込みロック下で実行
+            conn.execute('BEGIN IMMEDIATE')
+            if reuse:
+                row = conn.execute('''
+                    SELECT id FROM jobs WHERE kind = ? AND owner IS ? AND params = ? AND status != 'failed'
+                    ORDER BY created_at DESC LIMIT 1
+                ''', (kind, owner, params_json)).fetchone()
+                if row is not None:
+                    conn.commit()
+                    return self.get(row[0])
+            conn.execute('''
+                INSERT INTO jobs (id, kind, owner, params, status, attempts, max_attempts, created_at, run_after)
+                VALUES (?, ?, ?, ?, 'queued', 0, ?, ?, ?)
+            ''', (job_id, kind, owner, params_json, self.max_attempts, now, now))
+            conn.commit()
+        finally:
+            conn.close()
+        self.start()
+        self.wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id, owner=None):
+        """ジョブの状態（owner指定時は所有者が一致する場合のみ、存在しない場合はNone）"""
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or (owner is not None and row['owner'] != owner):
+            return None
+        return self._public(row)
+
+    def artifact(self, job_id, owner=None):
+        """完了したジョブの結果ファイル (パス, ファイル名, Content-Type)（未完了・なしの場合はNone）"""
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT owner, status, artifact_path, artifact_name, content_type FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or (owner is not None and row[0] != owner):
+            return None
+        if row[1] != 'completed' or not row[2] or not os.path.exists(row[2]):
+            return None
+        return row[2], row[3], row[4]
+
+    @staticmethod
+    def _public(row):
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'progress': round(row['progress'] or 0.0, 3),
+            'attempts': row['attempts'],
+            'error': row['error'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'has_artifact': bool(row['artifact_path']),
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+
+    # ---- ワーカー ----
+
+    def start(self):
+        """ワーカースレッドの起動（起動済みの場合は何もしない）"""
+        with self.lock:
+            if self.threads or self.workers <= 0:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        idle_count = 0
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                job = None
+            if job is not None:
+                self._run(job)
+                continue
+
+            idle_count += 1
+            if idle_count % CLEANUP_EVERY == 1:
+                try:
+                    self.cleanup()
+                except (sqlite3.Error, OSError):
+                    pass
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def _claim(self):
+        """実行待ちのジョブを1件取り出して実行中にする（複数プロセスで競合しないよう書き込みロック下で実行）"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute('BEGIN IMMEDIATE')
+            # 進捗が途絶えた実行中のジョブは実行待ちに戻す
+            conn.execute('''
+                UPDATE jobs SET status = 'queued', locked_by = NULL
+                WHERE status = 'running' AND heartbeat_at < ?
+            ''', (now - STALE_JOB_SECONDS,))
+            row = conn.execute('''
+                SELECT * FROM jobs WHERE status = 'queued' AND run_after <= ?
+                ORDER BY created_at LIMIT 1
+            ''', (now,)).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            conn.execute('''
+                UPDATE jobs
+                SET status = 'running', attempts = attempts + 1, locked_by = ?,
+                    started_at = ?, heartbeat_at = ?, progress = 0, error = NULL
+                WHERE id = ?
+            ''', (self.worker_name, now, now, row['id']))
+            conn.commit()
+            job = dict(row)
+            job['attempts'] += 1
+            job['params'] = json.loads(job['params'] or '{}')
+            return job
+        finally:
+            conn.close()
+
+    def _run(self, job):
+        context = JobContext(self, job)
+        try:
+            handler = self.handlers[job['kind']]
+            result = handler(context)
+        except Exception as e:
+            self._fail(job, context, e)
+            return
+        self._execute('''
+            UPDATE jobs
+            SET status = 'completed', progress = 1, finished_at = ?, result = ?,
+                artifact_path = ?, artifact_name = ?, content_type = ?, locked_by = NULL
+            WHERE id = ? AND locked_by = ?
+        ''', (time.time(), json.dumps(result, ensure_ascii=False) if result is not None else None,
+              context.artifact_path, context.artifact_name, context.content_type,
+              job['id'], self.worker_name))
+
+    def _fail(self, job, context, error):
+        if context.artifact_path and os.path.exists(context.artifact_path):
+            os.remove(context.artifact_path)
+        now = time.time()
+        if job['attempts'] < job['max_attempts']:
+            # 間隔を空けて再実行
+            self._execute('''
+                UPDATE jobs SET status = 'queued', error = ?, run_after = ?, locked_by = NULL
+                WHERE id = ? AND locked_by = ?
+            ''', (str(error), now + RETRY_DELAY_SECONDS * job['attempts'], job['id'], self.worker_name))
+        else:
+            self._execute('''
+                UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, locked_by = NULL
+                WHERE id = ? AND locked_by = ?
+            ''', (str(error), now, job['id'], self.worker_name))
+
+    def cleanup(self):
+        """保存期間を過ぎた終了済みジョブと結果ファイルの削除"""
+        threshold = time.time() - self.retention_seconds
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT id, artifact_path FROM jobs
+                WHERE status IN ('completed', 'failed') AND finished_at < ?
+            ''', (threshold,)).fetchall()
+            for job_id, artifact_path in rows:
+                if artifact_path and os.path.exists(artifact_path):
+                    os.remove(artifact_path)
+                conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - JSON配列の逐次出力
+
+一覧APIの結果をPythonのリスト・JSON文字列として組み立てずに、行を読み込んだ順に
+JSON配列として書き出す。件数が増えてもメモリ使用量は buffer_size 程度で一定になる。
+
+保存済みのJSON文字列（回答データなど）は解析・再変換せずにそのまま埋め込む（raw_object）。
+"""
+
+import json
+
+# この大きさ（文字数）まで溜めてから書き出す
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+def raw_object(fields, raw_fields=None):
+    """JSONオブジェクトの文字列（raw_fields の値はJSONの文字列としてそのまま埋め込む）"""
+    parts = [f'{json.dumps(key)}: {json.dumps(value)}' for key, value in fields.items()]
+    if raw_fields:
+        parts.extend(f'{json.dumps(key)}: {value}' for key, value in raw_fields.items())
+    return '{' + ', '.join(parts) + '}'
+
+
+def stream_json_array(items, encode=json.dumps, prefix='[', suffix=']', buffer_size=DEFAULT_BUFFER_SIZE):
+    """items を encode（JSON文字列を返す、Noneは出力しない）で変換し、JSON配列として逐次返す
+
+    prefix・suffix で配列の前後を囲める（例: '{"success": true, "tokens": [' と ']}'）。
+    """
+    buffer = [prefix]
+    size = len(prefix)
+    separator = ''
+    for item in items:
+        encoded = encode(item)
+        if encoded is None:
+            continue
+        buffer.append(separator)
+        buffer.append(encoded)
+        separator = ','
+        size += len(encoded) + 1
+        if size >= buffer_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(suffix)
+    yield ''.join(buffer)
@@ -270,15 +270,16 @@ function renderCompaniesTable(companies) {
     
     tbody.innerHTML = '';
     
+    // 業種・規模・プランは企業テーブルに未登録の場合 null
     companies.forEach(company => {
         const row = document.createElement('tr');
         row.innerHTML = `
             <td>${company.name}</td>
-            <td>${company.industry}</td>
-            <td>${company.size.toLocaleString()}人</td>
-            <td><span class="plan-badge ${company.plan}">${getPlanName(company.plan)}</span></td>
-            <td>${company.responses.toLocaleString()}</td>
-            <td>${formatDate(company.lastUsed)}</td>
+            <td>${company.industry ?? '-'}</td>
+            <td>${company.size != null ? `${company.size.toLocaleString()}人` : '-'}</td>
+            <td>${company.plan ? `<span class="plan-badge ${company.plan}">${getPlanName(company.plan)}</span>` : '-'}</td>
+            <td>${(company.responses || 0).toLocaleString()}</td>
+            <td>${company.lastUsed ? formatDate(company.lastUsed) : '-'}</td>
             <td><span class="status-badge ${company.status}">${getStatusName(company.status)}</span></td>
             <td>
                 <button class="action-btn view" onclick="viewCompany('${company.id}')">詳細</button>
@@ -575,20 +576,92 @@ function logout() {
     }
 }
 
-// 自動更新の設定
+// 自動更新の設定（Server-Sent Events、未対応時はポーリング）
 function setupAutoRefresh() {
-    refreshInterval = setInterval(() => {
-        updateLastUpdated();
-        
-        // アクティブなタブのデータを更新
-        const activeTab = document.querySelector('.tab-content.active');
-        if (activeTab) {
-            const tabId = activeTab.id;
-            if (tabId === 'overview' || tabId === 'security') {
-                loadSystemData();
-            }
+    if (window.EventSource) {
+        connectLiveUpdates();
+    } else {
+        startPollingRefresh();
+    }
+}
+
+// アクティブなタブのデータを更新
+function refreshActiveTab() {
+    updateLastUpdated();
+    
+    const activeTab = document.querySelector('.tab-content.active');
+    if (activeTab) {
+        const tabId = activeTab.id;
+        if (tabId === 'overview' || tabId === 'security') {
+            loadSystemData();
+        }
+    }
+}
+
+// ポーリングによる自動更新
+function startPollingRefresh() {
+    if (refreshInterval) return;
+    refreshInterval = setInterval(refreshActiveTab, 30000); // 30秒ごと
+}
+
+// サーバーからの更新通知の受信
+let liveSource = null;
+let liveRefreshTimer = null;
+
+async function connectLiveUpdates() {
+    // アクセストークンはURLに載せず、短時間だけ有効な接続用チケットを取得して接続する
+    const ticket = await fetchStreamTicket();
+    if (!ticket) {
+        startPollingRefresh();
+        return;
+    }
+    const source = liveSource = new EventSource(`/api/stream?ticket=${encodeURIComponent(ticket)}`);
+    let opened = false;
+    source.onopen = () => { opened = true; };
+    
+    // 連続した通知はまとめて1回だけ再取得する
+    const scheduleRefresh = () => {
+        clearTimeout(liveRefreshTimer);
+        liveRefreshTimer = setTimeout(refreshActiveTab, 1000);
+    };
+    
+    source.addEventListener('response', event => {
+        const delta = JSON.parse(event.data);
+        const kpis = systemData.overview && systemData.overview.kpis;
+        if (kpis) {
+            kpis.totalResponses = (kpis.totalResponses || 0) + delta.new_responses;
+            updateKPIs(kpis);
         }
-    }, 30000); // 30秒ごと
+        scheduleRefresh();
+    });
+    source.addEventListener('invalidate', scheduleRefresh);
+    
+    // チケットは失効するため自動再接続はせず、新しいチケットで接続し直す
+    // 接続できない場合（上限超過・認証エラー等）はポーリングに切り替え
+    source.onerror = () => {
+        source.close();
+        liveSource = null;
+        if (opened) {
+            setTimeout(connectLiveUpdates, 5000);
+        } else {
+            startPollingRefresh();
+        }
+    };
+}
+
+// リアルタイム配信の接続用チケットの取得（失敗時はnull）
+async function fetchStreamTicket() {
+    try {
+        const response = await fetch('/api/stream/ticket', {
+            method: 'POST',
+            headers: getAuthHeaders(),
+            body: JSON.stringify({ role: 'operator' })
+        });
+        if (!response.ok) return null;
+        return (await response.json()).ticket;
+    } catch (error) {
+        return null;
+    }
 }
 
 // 最終更新時刻の更新
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 集計・エクスポート用の読み取り専用接続
+
+ダッシュボードの集計やエクスポートなどの重い読み取りを、回答の書き込みと分離するための
+読み取り専用接続プール。モードは次の3つ。
+
+    off       従来通り、リクエスト毎にデータベースへ通常の接続を開く
+    wal       データベースをWALモードにし、読み取り専用接続（mode=ro, query_only）で読む。
+              WALでは読み取りが書き込みをブロックせず、常に最新のコミット済みデータを返す
+    snapshot  データベースのコピー（スナップショット）を定期的に作成し、そちらを読む。
+              データは最大 max_age 秒古くなるが、集計のI/Oが本体のファイルに一切かからない
+
+スナップショットは一時ファイルにバックアップAPIでコピーした後に置き換える（os.replace）ため、
+読み取り中の接続は置き換え前のファイルを最後まで読める。複数ワーカーで同じファイルを共有し、
+更新はファイルロックを取得できたワーカーのみが行う（他のワーカーは既存のスナップショットを使う）。
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows環境ではファイルロックなし
+    fcntl = None
+
+READ_MODES = ('off', 'wal', 'snapshot')
+
+
+def connect_readonly(path, immutable=False, timeout=30):
+    """読み取り専用のSQLite接続（スレッド間で受け渡すプール用）"""
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    if immutable:
+        # 置き換え後に変更されないスナップショットはロック・変更検知を省略できる
+        uri += '&immutable=1'
+    conn = sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=False)
+    conn.execute('PRAGMA query_only = 1')
+    return conn
+
+
+class SnapshotReader:
+    """集計・エクスポート用の読み取り専用接続プール"""
+
+    def __init__(self, database_path, mode='off', snapshot_path=None, max_age=30, pool_size=4):
+        if mode not in READ_MODES:
+            raise ValueError(f'unknown read mode: {mode}')
+        self.database_path = database_path
+        self.mode = mode
+        self.snapshot_path = snapshot_path or f'{database_path}.snapshot'
+        self.max_age = max_age
+        self.pool_size = pool_size
+        self.reset()
+
+    def reset(self):
+        """fork後の初期化（接続とロックは子プロセスに引き継がない）"""
+        self.pool = queue.LifoQueue(maxsize=self.pool_size)
+        self.refresh_lock = threading.Lock()
+
+    def prepare(self):
+        """読み取りモードに必要なデータベース設定（初期化時に1回実行）"""
+        if self.mode == 'off':
+            return
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            # WALモードはファイルに記録されるため全ての接続に適用される
+            conn.execute('PRAGMA journal_mode = WAL')
+        finally:
+            conn.close()
+        if self.mode == 'snapshot':
+            self.refresh_if_stale()
+
+    # ---- スナップショット ----
+
+    def _snapshot_generation(self):
+        """現在のスナップショットの識別子と作成時刻（未作成の場合は (None, None)）"""
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None, None
+        return (stat.st_ino, stat.st_mtime_ns), stat.st_mtime
+
+    def snapshot_age(self):
+        """スナップショットの経過秒数（未作成の場合はNone）"""
+        _, created_at = self._snapshot_generation()
+        return None if created_at is None else max(time.time() - created_at, 0.0)
+
+    def refresh_if_stale(self):
+        """スナップショットが max_age より古ければ作り直す
+
+        他のスレッド・ワーカーが更新中の場合は待たずに既存のスナップショットを使う
+        （スナップショットが存在しない場合のみ更新の完了を待つ）。
+        """
+        age = self.snapshot_age()
+        if age is not None and age < self.max_age:
+            return
+        wait = age is None
+        if not self.refresh_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._file_lock(wait) as locked:
+                if not locked:
+                    return
+                # ロック待ちの間に他のワーカーが更新済みの場合は何もしない
+                age = self.snapshot_age()
+                if age is None or age >= self.max_age:
+                    self._create_snapshot()
+        finally:
+            self.refresh_lock.release()
+
+    @contextmanager
+    def _file_lock(self, wait):
+        if fcntl is None:
+            yield True
+            return
+        with open(self.snapshot_path + '.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _create_snapshot(self):
+        temp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        source = sqlite3.connect(self.database_path, timeout=30)
+        target = sqlite3.connect(temp_path)
+        try:
+            # WALでは読み取りトランザクション内で一括コピーするため書き込みを止めない
+            source.backup(target)
+            target.execute('PRAGMA journal_mode = DELETE')
+            target.close()
+            os.replace(temp_path, self.snapshot_path)
+        finally:
+            source.close()
+            target.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # ---- 接続 ----
+
+    def _current_source(self):
+        """読み取り先のパス・世代・immutable指定"""
+        if self.mode == 'snapshot':
+            self.refresh_if_stale()
+            generation, _ = self._snapshot_generation()
+            return self.snapshot_path, generation, True
+        return self.database_path, None, False
+
+    @contextmanager
+    def connection(self):
+        """読み取り用の接続（プールから取得し、使用後に返却）"""
+        if self.mode == 'off':
+            conn = sqlite3.connect(self.database_path, timeout=30)
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        path, generation, immutable = self._current_source()
+        conn = None
+        while conn is None:
+            try:
+                pooled_generation, pooled = self.pool.get_nowait()
+            except queue.Empty:
+                conn = connect_readonly(path, immutable=immutable)
+                break
+            if pooled_generation == generation:
+                conn = pooled
+            else:
+                # 置き換え前のスナップショットへの接続は破棄
+                pooled.close()
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self.pool.put_nowait((generation, conn))
+            except queue.Full:
+                conn.close()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 企業別レポートの並列集計
+
+回答数の多い企業の全設問の集計（回答データの展開と点数化）は1スレッドでは
+GILに律速されるため、survey_responses を rowid の範囲で分割し、各範囲の展開と
+部分集計をプロセスプールで並列に実行する。部分集計（件数・合計・二乗和・度数分布、
+部署・役職の件数）は親プロセスで合算して平均・標準偏差を求める。
+
+レポートはバックグラウンドジョブ（job_queue.py）から build() で作成し、状態・進捗は jobs テーブルで管理する。
+企業に返すレポートには匿名性の閾値（anonymity.py）を適用し、回答数が閾値未満の設問・
+度数分布の点数・部署などの値は含めない。
+完成したレポートは (企業ID, データバージョン, 閾値) 単位でファイルに保存し、
+同じバージョンへの要求には再計算せずに返す（ワーカープロセス間でも共有）。
+"""
+
+import glob
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from anonymity import suppress_counts
+from read_snapshot import connect_readonly
+from response_codec import ResponseCodec
+
+# 件数を集計するカテゴリ項目
+CATEGORY_FIELDS = ('department', 'position', 'employment_type', 'job_type')
+
+# レポートのキーの形式（企業IDのハッシュ-データバージョン-閾値、ファイル名に使用するため厳密に確認）
+REPORT_KEY_PATTERN = re.compile(r'[0-9a-f]{16}-\d+-\d+')
+
+# 子プロセス毎のコーデック（レイアウトが同じ間は再利用）
+_worker_codec = None
+
+
+def build_score_maps(layout):
+    """フィールド→(回答値→点数) の対応表（0〜10点はその値、5段階評価は1〜5点）"""
+    score_maps = {}
+    for field, values in layout:
+        scores = {}
+        for index, value in enumerate(values):
+            score = value if isinstance(value, int) else index + 1
+            scores[value] = score
+            scores[str(value)] = score
+        score_maps[field] = scores
+    return score_maps
+
+
+def empty_partial():
+    return {'rows': 0, 'invalid': 0, 'fields': {}, 'categories': {}}
+
+
+def aggregate_partition(task):
+    """1範囲の部分集計（子プロセスで実行）
+
+    task: (データベースのパス, 企業ID（企業別データベースの場合はNone）, rowid下限, rowid上限, レイアウト)
+    """
+    global _worker_codec
+    path, company_id, low, high, layout = task
+    if _worker_codec is None or _worker_codec[0] != layout:
+        _worker_codec = (layout, ResponseCodec(layout), build_score_maps(layout))
+    _, codec, score_maps = _worker_codec
+
+    if company_id is None:
+        sql = 'SELECT response_data FROM survey_responses WHERE rowid BETWEEN ? AND ?'
+        params = (low, high)
+    else:
+        sql = 'SELECT response_data FROM survey_responses WHERE rowid BETWEEN ? AND ? AND company_id = ?'
+        params = (low, high, company_id)
+
+    partial = empty_partial()
+    fields = partial['fields']
+    categories = partial['categories']
+    conn = connect_readonly(path)
+    try:
+        for (response_data,) in conn.execute(sql, params):
+            try:
+                data = codec.decode(response_data)
+            except ValueError:
+                partial['invalid'] += 1
+                continue
+            if not isinstance(data, dict):
+                partial['invalid'] += 1
+                continue
+            partial['rows'] += 1
+
+            for field, scores in score_maps.items():
+                value = data.get(field)
+                if value is None:
+                    continue
+                try:
+                    score = scores.get(value)
+                except TypeError:
+                    score = None
+                if score is None:
+                    continue
+                stats = fields.get(field)
+                if stats is None:
+                    stats = fields[field] = [0, 0, 0, {}]
+                stats[0] += 1
+                stats[1] += score
+                stats[2] += score * score
+                stats[3][score] = stats[3].get(score, 0) + 1
+
+            for field in CATEGORY_FIELDS:
+                value = data.get(field)
+                if value in (None, ''):
+                    continue
+                counts = categories.setdefault(field, {})
+                counts[value] = counts.get(value, 0) + 1
+    finally:
+        conn.close()
+    return partial
+
+
+def merge_partials(partials):
+    """部分集計の合算"""
+    merged = empty_partial()
+    for partial in partials:
+        merged['rows'] += partial['rows']
+        merged['invalid'] += partial['invalid']
+        for field, (count, total, squares, histogram) in partial['fields'].items():
+            stats = merged['fields'].setdefault(field, [0, 0, 0, {}])
+            stats[0] += count
+            stats[1] += total
+            stats[2] += squares
+            for score, frequency in histogram.items():
+                stats[3][score] = stats[3].get(score, 0) + frequency
+        for field, counts in partial['categories'].items():
+            merged_counts = merged['categories'].setdefault(field, {})
+            for value, count in counts.items():
+                merged_counts[value] = merged_counts.get(value, 0) + count
+    return merged
+
+
+def summarize_field(stats, min_cell_size):
+    """件数・合計・二乗和・度数分布から平均・標準偏差（不偏）を計算（件数が閾値未満の点数はNone）"""
+    count, total, squares, histogram = stats
+    mean = total / count
+    variance = (squares - total * total / count) / (count - 1) if count > 1 else 0.0
+    visible, _ = suppress_counts(histogram, min_cell_size)
+    return {
+        'count': count,
+        'mean': round(mean, 3),
+        'stddev': round(math.sqrt(max(variance, 0.0)), 3),
+        'distribution': {str(score): visible.get(score) for score in sorted(histogram)}
+    }
+
+
+def finalize_report(merged, topics, min_cell_size):
+    """合算結果をレポート形式に変換（topics: 5段階評価の項目名、'overall' は満足度なし）
+
+    回答数が min_cell_size 未満の設問は含めず、度数分布・部署などの件数は suppress_counts で秘匿する。
+    回答者数が閾値未満の場合は件数以外を返さない。
+    """
+    if merged['rows'] < min_cell_size:
+        return {
+            'total_responses': merged['rows'],
+            'invalid_responses': merged['invalid'],
+            'min_cell_size': min_cell_size,
+            'suppressed': True,
+            'fields': {},
+            'categories': [],
+            'breakdowns': {},
+            'suppressed_breakdowns': {}
+        }
+    
+    fields = {
+        field: summarize_field(stats, min_cell_size)
+        for field, stats in merged['fields'].items() if stats[0] >= min_cell_size
+    }
+    categories = []
+    for topic in topics:
+        satisfaction = fields.get(f'{topic}_satisfaction')
+        expectation = fields.get(f'{topic}_expectation')
+        if satisfaction is None and expectation is None:
+            continue
+        gap = None
+        if satisfaction is not None and expectation is not None:
+            gap = round(expectation['mean'] - satisfaction['mean'], 3)
+        categories.append({
+            'topic': topic,
+            'satisfaction': satisfaction,
+            'expectation': expectation,
+            'gap': gap
+        })
+    breakdowns = {}
+    suppressed_breakdowns = {}
+    for field, counts in merged['categories'].items():
+        visible, suppressed = suppress_counts(counts, min_cell_size)
+        breakdowns[field] = dict(sorted(visible.items(), key=lambda item: -item[1]))
+        suppressed_breakdowns[field] = len(suppressed)
+    return {
+        'total_responses': merged['rows'],
+        'invalid_responses': merged['invalid'],
+        'min_cell_size': min_cell_size,
+        'suppressed': False,
+        'fields': fields,
+        'categories': categories,
+        'breakdowns': breakdowns,
+        'suppressed_breakdowns': suppressed_breakdowns
+    }
+
+
+class ReportEngine:
+    """レポートの作成と保存（作成の状態は持たない、プロセスプールは初回の並列集計時に起動）"""
+
+    def __init__(self, result_directory, max_workers=None, partition_rows=20000):
+        self.result_directory = result_directory
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.partition_rows = partition_rows
+        self.reset()
+
+    def reset(self):
+        """fork後の初期化（プールは子プロセスに引き継がない）"""
+        self.lock = threading.Lock()
+        self.process_pool = None
+
+    @staticmethod
+    def report_key(company_id, version, min_cell_size):
+        """企業ID・データバージョン・閾値から決まるレポートのキー（同じデータ・閾値のレポートは同じキー）"""
+        return f"{hashlib.sha256(company_id.encode('utf-8')).hexdigest()[:16]}-{int(version)}-{int(min_cell_size)}"
+
+    def result_path(self, key):
+        return os.path.join(self.result_directory, f'report_{key}.json')
+
+    def load_result(self, key, company_id):
+        """保存済みのレポート（他企業のもの・未作成の場合はNone）"""
+        if not REPORT_KEY_PATTERN.fullmatch(key):
+            return None
+        try:
+            with open(self.result_path(key), encoding='utf-8') as f:
+                report = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return report if report.get('company_id') == company_id else None
+
+    def plan(self, sources, layout):
+        """rowid の範囲による分割（企業で絞り込む場合はその企業の回答の rowid の範囲）"""
+        tasks = []
+        for path, company_id in sources:
+            if not os.path.exists(path):
+                continue
+            conn = connect_readonly(path)
+            try:
+                if company_id is None:
+                    low, high = conn.execute('SELECT MIN(rowid), MAX(rowid) FROM survey_responses').fetchone()
+                else:
+                    low, high = conn.execute(
+                        'SELECT MIN(rowid), MAX(rowid) FROM survey_responses WHERE company_id = ?', (company_id,)
+                    ).fetchone()
+            finally:
+                conn.close()
+            if low is None:
+                continue
+            for start in range(low, high + 1, self.partition_rows):
+                tasks.append((path, company_id, start, min(start + self.partition_rows - 1, high), layout))
+        return tasks
+
+    def _get_process_pool(self):
+        with self.lock:
+            if self.process_pool is None:
+                # サーバーのスレッドを引き継がないよう spawn で起動
+                self.process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.process_pool
+
+    def build(self, company_id, version, sources, layout, topics, min_cell_size, progress=None):
+        """レポートの作成と保存（作成済みの場合は保存済みのレポートを返す）
+
+        sources: [(データベースのパス, 絞り込む企業ID または None), ...]、min_cell_size: 匿名性の閾値
+        progress: 処理済みの範囲の割合（0〜1）を受け取る関数
+        """
+        key = self.report_key(company_id, version, min_cell_size)
+        report = self.load_result(key, company_id)
+        if report is not None:
+            return report
+
+        tasks = self.plan(sources, layout)
+        partials = []
+        if len(tasks) <= 1:
+            # 1範囲のみの場合はプロセス間の受け渡しを省略
+            partials = [aggregate_partition(task) for task in tasks]
+        else:
+            pool = self._get_process_pool()
+            try:
+                for future in as_completed([pool.submit(aggregate_partition, task) for task in tasks]):
+                    partials.append(future.result())
+                    if progress is not None:
+                        progress(len(partials) / len(tasks))
+            except BrokenProcessPool:
+                with self.lock:
+                    self.process_pool = None
+                raise
+
+        report = finalize_report(merge_partials(partials), topics, min_cell_size)
+        report.update({
+            'company_id': company_id,
+            'data_version': version,
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'partitions': len(tasks)
+        })
+        self._save_result(key, report)
+        return report
+
+    def _save_result(self, key, report):
+        os.makedirs(self.result_directory, exist_ok=True)
+        path = self.result_path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+        # 同じ企業の古いバージョン・閾値のレポートを削除
+        prefix = key.split('-', 1)[0]
+        for old_path in glob.glob(os.path.join(self.result_directory, f'report_{prefix}-*.json')):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
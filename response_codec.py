@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 回答データのコンパクト保存形式
+
+survey_responses.response_data に保存する回答を、設問番号順の1バイト配列
+（array('b')）と残りの項目のJSON（大きい場合はzlib圧縮）に分けてBLOBで保存する。
+従来のJSON文字列の行もそのまま読めるため、読み出し側は decode() を使うだけでよい。
+
+BLOBの構成:
+    ヘッダー（4バイト）: 形式バージョン, フラグ, 設問数（uint16 LE）
+    設問コード（設問数バイト）: 選択肢の番号（未回答は -1）
+    残りの項目: JSON（UTF-8、FLAG_COMPRESSED の場合はzlib圧縮）
+"""
+
+import json
+import struct
+import zlib
+from array import array
+
+FORMAT_VERSION = 1
+FLAG_COMPRESSED = 0x01
+
+HEADER = struct.Struct('<BBH')
+
+# これより小さい残り項目は圧縮しない（バイト）
+COMPRESS_MIN_BYTES = 128
+COMPRESS_LEVEL = 1
+
+
+class ResponseDecodeError(ValueError):
+    """保存データの破損・未対応形式"""
+
+
+class ResponseCodec:
+    """設問レイアウトに基づく回答データのエンコード・デコード
+
+    layout は (フィールド名, 選択肢の値のリスト) のリスト。
+    保存済みデータは設問番号で参照するため、レイアウトは末尾への追加のみ可能。
+    選択肢と等しい値は選択肢の値として復元される（例: 7.0 は 7 になる）。
+    """
+
+    def __init__(self, layout):
+        self.fields = [field for field, _ in layout]
+        self.choices = [list(values) for _, values in layout]
+        self.codes = {
+            field: (index, {value: code for code, value in enumerate(values)})
+            for index, (field, values) in enumerate(layout)
+        }
+        if len(self.fields) > 0xFFFF or any(len(values) > 127 for values in self.choices):
+            raise ValueError('layout does not fit the binary format')
+
+    def encode(self, data):
+        """回答データ（dict）をBLOBに変換"""
+        codes = array('b', [-1]) * len(self.fields)
+        rest = {}
+        lookup = self.codes.get
+        for field, value in data.items():
+            entry = lookup(field)
+            if entry is not None:
+                try:
+                    code = entry[1].get(value)
+                except TypeError:
+                    code = None
+                # 選択肢に一致しない値（旧形式の文字列の点数など）は残り項目にそのまま保存
+                if code is not None:
+                    codes[entry[0]] = code
+                    continue
+            rest[field] = value
+
+        flags = 0
+        text = json.dumps(rest, ensure_ascii=False, separators=(',', ':')).encode('utf-8') if rest else b''
+        if len(text) >= COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(text, COMPRESS_LEVEL)
+            if len(compressed) < len(text):
+                text = compressed
+                flags |= FLAG_COMPRESSED
+
+        return HEADER.pack(FORMAT_VERSION, flags, len(codes)) + codes.tobytes() + text
+
+    def decode(self, value):
+        """保存データをdictに変換（従来のJSON文字列にも対応）"""
+        if isinstance(value, str):
+            data = json.loads(value)
+            if not isinstance(data, dict):
+                raise ResponseDecodeError('response data is not a JSON object')
+            return data
+
+        value = bytes(value)
+        count, flags = self._read_header(value)
+        codes = array('b')
+        codes.frombytes(value[HEADER.size:HEADER.size + count])
+
+        data = {}
+        for field, choices, code in zip(self.fields, self.choices, codes):
+            if code >= 0:
+                data[field] = choices[code]
+
+        text = value[HEADER.size + count:]
+        if text:
+            try:
+                if flags & FLAG_COMPRESSED:
+                    text = zlib.decompress(text)
+                rest = json.loads(text)
+            except (zlib.error, ValueError) as e:
+                raise ResponseDecodeError(str(e))
+            if not isinstance(rest, dict):
+                raise ResponseDecodeError('response data is not a JSON object')
+            data.update(rest)
+        return data
+
+    def to_json(self, value):
+        """保存データをJSONオブジェクトの文字列に変換（dictを経由しない）
+
+        従来のJSON文字列はそのまま、BLOBは設問コードの項目のJSONに残りの項目のJSONを連結して返す
+        （JSONの解析・再変換はしない）。decode() と同じ内容のJSONになる。
+        BLOBの残りの項目は encode() が出力したJSONのため、オブジェクトの形であることだけを確認する。
+        JSON文字列の行は移行（スキーマv5）で変換できなかった行に限られるため、解析して確認する。
+        """
+        if isinstance(value, str):
+            text = self._check_object(value.strip())
+            try:
+                json.loads(text)
+            except ValueError as e:
+                raise ResponseDecodeError(str(e))
+            return text
+
+        value = bytes(value)
+        count, flags = self._read_header(value)
+        codes = array('b')
+        codes.frombytes(value[HEADER.size:HEADER.size + count])
+        coded = json.dumps({
+            field: choices[code]
+            for field, choices, code in zip(self.fields, self.choices, codes) if code >= 0
+        }, ensure_ascii=False)
+
+        text = value[HEADER.size + count:]
+        if not text:
+            return coded
+        if flags & FLAG_COMPRESSED:
+            try:
+                text = zlib.decompress(text)
+            except zlib.error as e:
+                raise ResponseDecodeError(str(e))
+        try:
+            text = text.decode('utf-8').strip()
+        except UnicodeDecodeError as e:
+            raise ResponseDecodeError(str(e))
+        self._check_object(text)
+        if coded == '{}':
+            return text
+        # 設問コードの項目と残りの項目は重複しない（encode() で振り分け済み）
+        return coded[:-1] + ', ' + text[1:]
+
+    def get(self, value, field):
+        """1項目のみを取得（設問コードの項目はJSONの解析・展開を行わない）"""
+        entry = self.codes.get(field)
+        if entry is None or isinstance(value, str):
+            return self.decode(value).get(field)
+
+        count, _ = self._read_header(value)
+        index = entry[0]
+        if index < count:
+            code = struct.unpack_from('b', value, HEADER.size + index)[0]
+            if code >= 0:
+                return self.choices[index][code]
+        # コード化されていない値（旧形式の文字列など）は残り項目から取得
+        return self.decode(value).get(field)
+
+    @staticmethod
+    def _check_object(text):
+        """JSONオブジェクトの形（{ ... }）でなければ ResponseDecodeError
+
+        出力途中のJSONに途中で切れた行や配列・文字列の行を埋め込まないため（解析はしない）。
+        """
+        if len(text) < 2 or text[0] != '{' or text[-1] != '}':
+            raise ResponseDecodeError('response data is not a JSON object')
+        return text
+
+    @staticmethod
+    def _read_header(value):
+        if len(value) < HEADER.size:
+            raise ResponseDecodeError('response data is truncated')
+        version, flags, count = HEADER.unpack_from(value)
+        if version != FORMAT_VERSION:
+            raise ResponseDecodeError(f'unsupported response format: {version}')
+        if len(value) < HEADER.size + count:
+            raise ResponseDecodeError('response data is truncated')
+        return count, flags
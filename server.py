@@ -3,23 +3,63 @@
 従業員満足度調査システム - Backend API Server
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 import sqlite3
 import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import logging
+import base64
+import binascii
 import hashlib
+import itertools
+import csv
+import io
+import re
 import secrets
+import sys
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from functools import wraps
+from static_assets import AssetPipeline
+from event_stream import EventBroker, Subscription, format_sse
+from response_codec import ResponseCodec
+from shard_router import ShardRouter
+from read_snapshot import SnapshotReader
+from report_engine import ReportEngine, build_score_maps
+from job_queue import JobQueue
+from json_stream import raw_object, stream_json_array
+from columnar_export import FORMAT_FILES, resolve_format, write_columnar_export
+from crosstab import NO_COMPANY, BucketAccumulator, CellAccumulator, parse_dimensions
+from anonymity import AnonymousAggregator
+from driver_analysis import (
+    DRIVER_TARGETS, MomentAccumulator, analyze_drivers, decode_moments, driver_variables, encode_moments,
+    merge_moments
+)
+from storage import CROSSTAB_DIMENSIONS, RESPONSE_COLUMNS, SQLiteStore
+from survey_stats import (
+    DEFAULT_CONFIDENCE, compare_means, compare_nps, mean_interval, moments_from_buckets, nps_interval
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows環境ではファイルロックなし
+    fcntl = None
 
 app = Flask(__name__)
 CORS(app)
 
 # セキュリティ設定
-app.config['SECRET_KEY'] = secrets.token_hex(32)
+# 複数プロセスで配信用チケットを共有するには SECRET_KEY を設定（gunicorn の preload_app では不要）
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB制限
 
 # ログ設定
@@ -27,25 +67,53 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # データベース設定
-DATABASE_PATH = 'survey_database.db'
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'survey_database.db')
+
+# 企業別データベース（シャード）の設定（TENANT_SHARDING=1 で有効化）
+TENANT_SHARDING = os.environ.get('TENANT_SHARDING', '').lower() in ('1', 'true', 'yes')
+SHARD_DIRECTORY = os.environ.get(
+    'SHARD_DIRECTORY', os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), 'shards')
+)
+SHARD_QUERY_WORKERS = int(os.environ.get('SHARD_QUERY_WORKERS', 8))
+
+# 集計・エクスポート用の読み取り設定（off / wal / snapshot、snapshot時は最大経過秒数で再作成）
+READ_SNAPSHOT_MODE = os.environ.get('READ_SNAPSHOT_MODE', 'off').lower()
+READ_SNAPSHOT_PATH = os.environ.get('READ_SNAPSHOT_PATH', f'{DATABASE_PATH}.snapshot')
+READ_SNAPSHOT_MAX_AGE = float(os.environ.get('READ_SNAPSHOT_MAX_AGE', 30))
+READ_POOL_SIZE = int(os.environ.get('READ_POOL_SIZE', 4))
+
+# 企業別レポートの並列集計（結果の保存先・プロセス数・1プロセスが処理する行数）
+REPORT_DIRECTORY = os.environ.get(
+    'REPORT_DIRECTORY', os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), 'reports')
+)
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 0)) or None
+REPORT_PARTITION_ROWS = int(os.environ.get('REPORT_PARTITION_ROWS', 20000))
+
+# バックグラウンドジョブ（結果ファイルの保存先・ワーカースレッド数・保存期間）
+JOB_DIRECTORY = os.environ.get(
+    'JOB_DIRECTORY', os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), 'jobs')
+)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', 24))
+
+# エクスポートで一度に読み込む・列に変換する行数（メモリ使用量の上限）
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 10000))
+
+# クロス集計で数値を返す最小の回答者数（これ未満のグループ・設問は秘匿）
+CROSSTAB_MIN_CELL_SIZE = int(os.environ.get('CROSSTAB_MIN_CELL_SIZE', 5))
+
+# 重複送信の判定に使う送信キーの有効期間（秒）
+# Idempotency-Key ヘッダーのキーは長め、キーがない場合の回答内容の指紋は再送・二重クリックの間だけ
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', 24 * 3600))
+SUBMISSION_FINGERPRINT_TTL_SECONDS = int(os.environ.get('SUBMISSION_FINGERPRINT_TTL_SECONDS', 600))
+# 期限切れの送信キーを削除する間隔（秒）
+SUBMISSION_KEY_PURGE_SECONDS = 3600
 
 # セキュリティ関数
-def validate_request_data(data):
-    """リクエストデータの検証"""
-    if not isinstance(data, dict):
-        return False, "無効なデータ形式です"
-    
-    # 必須フィールドの確認
-    required_fields = ['submission_time']
-    for field in required_fields:
-        if field not in data:
-            return False, f"必須フィールド '{field}' が不足しています"
-    
-    # データサイズの制限
-    if len(json.dumps(data)) > 100000:  # 100KB制限
-        return False, "データサイズが大きすぎます"
-    
-    return True, "OK"
+# 回答データの最大サイズ（バイト）
+SUBMISSION_MAX_BYTES = 100000
+
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
 
 def rate_limit_check(client_ip):
     """レート制限チェック（簡易版）"""
@@ -59,38 +127,561 @@ def sanitize_input(text):
         return str(text)
     
     # HTMLタグの除去など基本的なサニタイズ
-    import re
-    text = re.sub(r'<[^>]+>', '', text)
+    text = HTML_TAG_PATTERN.sub('', text)
     return text[:1000]  # 最大1000文字に制限
 
-def init_database():
-    """データベースの初期化"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+# ====================
+# 回答データのフィールド定義（index.html の設問）
+# ====================
+
+# 5段階評価の項目（出現順）
+SURVEY_TOPICS = [
+    'overall', 'work_time', 'holiday', 'paid_leave', 'flexible_work', 'commute', 'overtime_pay',
+    'workload', 'physical_load', 'mental_load', 'benefits', 'promotion', 'fair_evaluation',
+    'fair_salary', 'professional_skill', 'general_skill', 'education', 'career_path',
+    'career_direction', 'role_model', 'pride', 'social_contribution', 'fulfillment', 'autonomy',
+    'relationship', 'harassment_prevention', 'open_communication', 'company_stability',
+    'compliance', 'work_environment', 'gender_friendly'
+]
+
+# 5段階評価の選択肢（1〜5点の順）
+SATISFACTION_LABELS = [
+    '満足していない', 'どちらかと言えば満足していない', 'どちらとも言えない',
+    'どちらかと言えば満足している', '満足している'
+]
+EXPECTATION_LABELS = [
+    '今の会社には期待していない', '今の会社にはどちらかと言えば期待していない', 'どちらとも言えない',
+    '今の会社にはどちらかと言えば期待している', '今の会社には期待している'
+]
+CONTRIBUTION_LABELS = [
+    '活躍貢献できていない', 'どちらかと言えば活躍貢献できていない', 'どちらとも言えない',
+    'どちらかといえば活躍貢献できていると感じる', '活躍貢献できていると感じる'
+]
+
+# 0〜10点の設問
+SCALE_FIELDS = ['overall_satisfaction', 'recommendation', 'nps_score', 'retention_intention']
+
+# 0〜10点の回答の変換表（文字列・整数のどちらも受け付ける）
+SCALE_VALUES = {**{score: score for score in range(11)}, **{str(score): score for score in range(11)}}
+
+def coerce_scale(value):
+    """0〜10点の回答を整数に変換（True/False は 1/0 と等しいため拒否する）"""
+    if type(value) is float and value.is_integer():
+        value = int(value)
+    elif isinstance(value, bool):
+        raise ValueError
+    return SCALE_VALUES[value]
+
+def likert_coercer(labels):
+    """5段階評価の回答を正規の選択肢ラベルに変換（1〜5の数値も受け付ける）
     
-    # 調査回答テーブル
+    辞書の参照のみで変換するため、未定義の値は KeyError となる
+    （True は 1 と等しく辞書の参照では区別できないため、bool は ValueError とする）
+    """
+    by_label = {label: label for label in labels}
+    for score, label in enumerate(labels, 1):
+        by_label[score] = label
+        by_label[str(score)] = label
+    lookup = by_label.__getitem__
+    def coerce(value):
+        if isinstance(value, bool):
+            raise ValueError
+        return lookup(value)
+    return coerce
+
+def number_coercer(minimum, maximum):
+    """数値入力の回答を範囲内の数値に変換"""
+    def coerce(value):
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not minimum <= number <= maximum:
+            raise ValueError
+        return int(number) if number.is_integer() else number
+    return coerce
+
+def text_coercer(max_length):
+    """文字列の回答を検証（長さ上限あり）"""
+    def coerce(value):
+        if not isinstance(value, str) or len(value) > max_length:
+            raise ValueError
+        return value
+    return coerce
+
+def build_survey_field_spec():
+    """フィールド名→変換関数の対応表を作成（起動時に1回だけ実行）"""
+    spec = {field: coerce_scale for field in SCALE_FIELDS}
+    satisfaction = likert_coercer(SATISFACTION_LABELS)
+    expectation = likert_coercer(EXPECTATION_LABELS)
+    for topic in SURVEY_TOPICS:
+        if topic != 'overall':
+            spec[f'{topic}_satisfaction'] = satisfaction
+        spec[f'{topic}_expectation'] = expectation
+    spec['contribution'] = likert_coercer(CONTRIBUTION_LABELS)
+    
+    spec.update({
+        'joining_year': number_coercer(1950, 2100),
+        'annual_income': number_coercer(0, 100000),
+        'overtime_hours': number_coercer(0, 1000),
+        'paid_leave_rate': number_coercer(0, 100),
+        'page_load_time': number_coercer(0, float('inf'))
+    })
+    
+    short_text = text_coercer(200)
+    for field in ['employment_type', 'joining_type', 'department', 'department_other', 'position',
+                  'job_type', 'job_type_other', 'submission_time', 'survey_token']:
+        spec[field] = short_text
+    for field in FREE_TEXT_FIELDS:
+        spec[field] = text_coercer(10000)
+    spec['user_agent'] = sanitize_input
+    return spec
+
+def build_response_layout():
+    """コンパクト保存形式の設問レイアウト（保存済みデータは設問番号で参照するため末尾への追加のみ可）"""
+    layout = [(field, list(range(11))) for field in SCALE_FIELDS]
+    for topic in SURVEY_TOPICS:
+        if topic != 'overall':
+            layout.append((f'{topic}_satisfaction', SATISFACTION_LABELS))
+        layout.append((f'{topic}_expectation', EXPECTATION_LABELS))
+    layout.append(('contribution', CONTRIBUTION_LABELS))
+    return layout
+
+RESPONSE_LAYOUT = build_response_layout()
+
+# 設問→(回答値→点数) の対応表（クロス集計用）
+RESPONSE_SCORE_MAPS = build_score_maps(RESPONSE_LAYOUT)
+
+# 5段階評価の満足度の設問（企業向けサマリーの平均満足度・満足度分布）
+SATISFACTION_QUESTIONS = [f'{topic}_satisfaction' for topic in SURVEY_TOPICS if topic != 'overall']
+
+# キードライバー分析の変数（各項目の満足度＋目的変数、保存済みの行列との照合用にJSONも保持）
+DRIVER_VARIABLES = driver_variables([topic for topic in SURVEY_TOPICS if topic != 'overall'])
+DRIVER_VARIABLES_KEY = json.dumps(DRIVER_VARIABLES)
+
+response_codec = ResponseCodec(RESPONSE_LAYOUT)
+
+def decode_response_data(value):
+    """survey_responses.response_data の読み出し（コンパクト形式・従来のJSONの両方に対応）"""
+    return response_codec.decode(value)
+
+def validate_submission(data, size=None):
+    """回答データの検証と型変換（データはその場で正規化する）
+    
+    未定義のフィールドはそのまま保持する。空文字は未回答として扱う。
+    戻り値: (保存用データ（コンパクト形式）, エラーメッセージ)
+    """
+    if not isinstance(data, dict):
+        return None, "無効なデータ形式です"
+    
+    if size is not None and size > SUBMISSION_MAX_BYTES:
+        return None, "データサイズが大きすぎます"
+    
+    if 'submission_time' not in data:
+        return None, "必須フィールド 'submission_time' が不足しています"
+    
+    for field, value in data.items():
+        coerce = SURVEY_FIELD_SPEC.get(field)
+        if coerce is None or value is None or value == '':
+            continue
+        try:
+            data[field] = coerce(value)
+        except (ValueError, TypeError, KeyError):
+            return None, f"フィールド '{field}' の値が不正です"
+    
+    payload = response_codec.encode(data)
+    if size is None and len(payload) > SUBMISSION_MAX_BYTES:
+        return None, "データサイズが大きすぎます"
+    return payload, None
+
+# ====================
+# データバージョンとレスポンスキャッシュ
+# ====================
+
+def bump_data_version(cursor, company_id=None):
+    """データ更新時のバージョン更新（書き込みと同じトランザクション内で実行）"""
+    SQLiteStore.session(cursor).bump_data_version(company_id)
+
+def get_data_version(company_id=None, snapshot=False):
+    """現在のデータバージョンの取得（企業指定時はその企業のバージョン）
+    
+    snapshot=True の場合は集計用の読み取り接続（スナップショット）から取得する
+    """
+    scope = f'company:{company_id}' if company_id else 'global'
+    if snapshot:
+        with analytics_session() as session:
+            return session.get_data_version(scope)
+    with catalog_store.read() as session:
+        return session.get_data_version(scope)
+
+class ResponseCache:
+    """シリアライズ済みJSONレスポンスのLRUキャッシュ（件数上限付き）"""
+    
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+    
+    def put(self, key, body):
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+response_cache = ResponseCache()
+
+def versioned_json(tenant_scoped=False, snapshot=False):
+    """データバージョンに基づくETag・条件付きGET・レスポンスキャッシュを付与するデコレータ
+    
+    tenant_scoped=True の場合は企業認証で設定された request.company_id 単位でバージョンを管理する
+    snapshot=True の場合は集計用の読み取り接続のバージョンを使う（スナップショットの内容と一致させる）
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            company_id = getattr(request, 'company_id', None) if tenant_scoped else None
+            try:
+                version = get_data_version(company_id, snapshot=snapshot)
+            except sqlite3.Error as e:
+                logger.error(f"データバージョンの取得に失敗しました: {str(e)}")
+                return f(*args, **kwargs)
+            
+            etag = f'W/"{request.endpoint}-{version}"'
+            headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+            
+            if etag in [value.strip() for value in request.headers.get('If-None-Match', '').split(',')]:
+                return app.response_class(status=304, headers=headers)
+            
+            cache_key = (request.endpoint, request.full_path, company_id, version)
+            body = response_cache.get(cache_key)
+            if body is None:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                response_cache.put(cache_key, body)
+            
+            return app.response_class(body, mimetype='application/json', headers=headers)
+        return decorated_function
+    return decorator
+
+def migrate_data_versions(cursor):
+    """スキーマv4: データバージョン管理テーブルの作成"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS survey_responses (
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+# コンパクト形式への変換を1回の更新で処理する件数
+COMPACT_MIGRATION_BATCH_SIZE = 1000
+
+def migrate_compact_responses(cursor):
+    """スキーマv5: 既存の回答データ（JSON文字列）をコンパクト形式に変換
+    
+    変換後に解放された領域をファイルから削除するには VACUUM を実行する
+    """
+    last_rowid = 0
+    while True:
+        cursor.execute('''
+            SELECT rowid, response_data FROM survey_responses
+            WHERE rowid > ? AND typeof(response_data) = 'text'
+            ORDER BY rowid LIMIT ?
+        ''', (last_rowid, COMPACT_MIGRATION_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        
+        updates = []
+        for rowid, response_data in rows:
+            try:
+                data = json.loads(response_data)
+            except ValueError:
+                continue  # 解析できない行はそのまま残す
+            if isinstance(data, dict):
+                updates.append((response_codec.encode(data), rowid))
+        cursor.executemany('UPDATE survey_responses SET response_data = ? WHERE rowid = ?', updates)
+        last_rowid = rows[-1][0]
+
+def migrate_job_queue(cursor):
+    """スキーマv6: バックグラウンドジョブテーブルの作成（時刻はUNIX時間）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            owner TEXT,
+            params TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            error TEXT,
+            result TEXT,
+            artifact_path TEXT,
+            artifact_name TEXT,
+            content_type TEXT,
+            locked_by TEXT,
+            created_at REAL NOT NULL,
+            run_after REAL NOT NULL,
+            started_at REAL,
+            heartbeat_at REAL,
+            finished_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, run_after, created_at)')
+
+def iter_stored_responses(cursor):
+    """既存の全回答（企業別データベースを含む）を (企業ID, 期間, 展開済みの回答) で返す（マイグレーション用）"""
+    cursor.execute('SELECT token, company_id FROM company_tokens')
+    token_companies = dict(cursor.fetchall())
+    
+    def scan(source_cursor):
+        last_rowid = 0
+        while True:
+            source_cursor.execute('''
+                SELECT rowid, response_data, survey_token, substr(created_at, 1, 7) FROM survey_responses
+                WHERE rowid > ? ORDER BY rowid LIMIT ?
+            ''', (last_rowid, COMPACT_MIGRATION_BATCH_SIZE))
+            rows = source_cursor.fetchall()
+            if not rows:
+                return
+            for _, response_data, survey_token, period in rows:
+                try:
+                    data = decode_response_data(response_data)
+                except ValueError:
+                    continue
+                yield token_companies.get(survey_token), period or current_period(), data
+            last_rowid = rows[-1][0]
+    
+    yield from scan(cursor)
+    for path in response_router.shard_paths():
+        shard_conn = sqlite3.connect(path, timeout=30)
+        try:
+            yield from scan(shard_conn.cursor())
+        finally:
+            shard_conn.close()
+
+def migrate_crosstab_cells(cursor):
+    """スキーマv7: クロス集計セルテーブルの作成と既存の回答（企業別データベースを含む）からの初期化"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crosstab_cells (
+            company_id TEXT NOT NULL,
+            department TEXT NOT NULL,
+            position TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response_count INTEGER NOT NULL DEFAULT 0,
+            score_sum REAL NOT NULL DEFAULT 0,
+            score_sum_sq REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (company_id, question, department, position)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM crosstab_cells')
+    
+    accumulator = CellAccumulator(RESPONSE_SCORE_MAPS)
+    for company_id, _, data in iter_stored_responses(cursor):
+        accumulator.add(company_id, data)
+    SQLiteStore.session(cursor).add_crosstab_cells(accumulator.rows())
+
+def migrate_score_buckets(cursor):
+    """スキーマv8: 期間別の点数毎の件数テーブルの作成と既存の回答からの初期化（期間は作成日時の年月）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS score_buckets (
+            company_id TEXT NOT NULL,
+            period TEXT NOT NULL,
+            question TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            response_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (company_id, question, period, score)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM score_buckets')
+    
+    accumulator = BucketAccumulator(RESPONSE_SCORE_MAPS)
+    for company_id, period, data in iter_stored_responses(cursor):
+        accumulator.add(company_id, period, data)
+    SQLiteStore.session(cursor).add_score_buckets(accumulator.rows())
+
+def migrate_driver_moments(cursor):
+    """スキーマv9: キードライバー分析のモーメント行列テーブルの作成と既存の回答からの初期化"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS driver_moments (
+            company_id TEXT PRIMARY KEY,
+            variables TEXT NOT NULL,
+            response_count INTEGER NOT NULL DEFAULT 0,
+            sums BLOB NOT NULL,
+            cross_products BLOB NOT NULL
+        )
+    ''')
+    cursor.execute('DELETE FROM driver_moments')
+    
+    accumulator = MomentAccumulator(DRIVER_VARIABLES, RESPONSE_SCORE_MAPS)
+    for company_id, _, data in iter_stored_responses(cursor):
+        accumulator.add(company_id or NO_COMPANY, data)
+    add_driver_moments(SQLiteStore.session(cursor), accumulator)
+
+def add_driver_moments(session, accumulator):
+    """モーメント行列への加算（変数の構成が変わった場合は保存済みの値を使わない）"""
+    for company_id, added in accumulator.items():
+        stored = session.get_driver_moments(company_id)
+        if stored is not None and stored[0] == DRIVER_VARIABLES_KEY:
+            added = merge_moments(decode_moments(*stored[1:]), added)
+        session.put_driver_moments(company_id, DRIVER_VARIABLES_KEY, *encode_moments(added))
+
+def create_response_list_index(cursor):
+    """回答一覧の新しい順の読み出し用インデックス（カタログと企業別データベースで共通）"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_survey_responses_created ON survey_responses (created_at, id)')
+
+def migrate_list_indexes(cursor):
+    """スキーマv10: 回答・トークン一覧を作成日時の順にページ送りで読むためのインデックス"""
+    create_response_list_index(cursor)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_survey_tokens_created ON survey_tokens (created_at, token)')
+
+def add_company_column(cursor, table):
+    """企業IDの列の追加（追加済みの場合は何もしない）"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if 'company_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN company_id TEXT')
+
+def create_free_text_company_indexes(cursor):
+    """自由記述回答の企業IDの列と企業別の一覧・集計用インデックス（カタログと企業別データベースで共通）"""
+    add_company_column(cursor, 'free_text_responses')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_free_text_company_time ON free_text_responses (company_id, response_time, id)')
+    # 設問別の集計が表を読まずに済むよう文字数まで含める
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_free_text_company_question
+        ON free_text_responses (company_id, question_type, response_time, id, character_count)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_free_text_time ON free_text_responses (response_time)')
+
+def migrate_free_text_company(cursor):
+    """スキーマv11: 自由記述回答に企業IDを追加し、既存の回答（企業別データベースを含む）に設定"""
+    add_company_column(cursor, 'free_text_responses')
+    cursor.execute('''
+        UPDATE free_text_responses SET company_id = (
+            SELECT ct.company_id FROM survey_responses sr
+            JOIN company_tokens ct ON ct.token = sr.survey_token
+            WHERE sr.id = free_text_responses.response_id
+        )
+    ''')
+    create_free_text_company_indexes(cursor)
+    backfill_shard_company_ids(cursor, 'free_text_responses')
+
+def backfill_shard_company_ids(cursor, table):
+    """企業別データベースの table の企業IDの設定（列の追加は企業別データベースのマイグレーションで行う）
+    
+    企業別データベースは全件が1企業の回答のため、回答のトークンの1つから企業を求める。
+    """
+    response_router.prepare_all()
+    for path in response_router.shard_paths():
+        shard_conn = sqlite3.connect(path, timeout=30)
+        try:
+            shard_cursor = shard_conn.cursor()
+            shard_cursor.execute('SELECT survey_token FROM survey_responses WHERE survey_token IS NOT NULL LIMIT 1')
+            row = shard_cursor.fetchone()
+            if row is None:
+                continue
+            cursor.execute('SELECT company_id FROM company_tokens WHERE token = ?', (row[0],))
+            company = cursor.fetchone()
+            if company is not None:
+                shard_cursor.execute(f'UPDATE {table} SET company_id = ? WHERE company_id IS NULL', company)
+                shard_conn.commit()
+        finally:
+            shard_conn.close()
+
+def create_response_company_index(cursor):
+    """回答の企業IDの列と企業別の範囲検索用インデックス（カタログと企業別データベースで共通）"""
+    add_company_column(cursor, 'survey_responses')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_survey_responses_company ON survey_responses (company_id, created_at)')
+
+def migrate_response_company(cursor):
+    """スキーマv12: 回答に企業IDを追加し、既存の回答（企業別データベースを含む）に設定
+    
+    企業の回答の検索・集計はトークン（company_tokens）を経由せずにこの列で絞り込む。
+    """
+    add_company_column(cursor, 'survey_responses')
+    cursor.execute('''
+        UPDATE survey_responses SET company_id = (
+            SELECT company_id FROM company_tokens WHERE token = survey_responses.survey_token
+        )
+        WHERE survey_token IS NOT NULL
+    ''')
+    create_response_company_index(cursor)
+    backfill_shard_company_ids(cursor, 'survey_responses')
+
+def migrate_submission_keys(cursor):
+    """スキーマv14: 重複送信の判定用の送信キー（キーのみで参照するため WITHOUT ROWID）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submission_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            response_id TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submission_keys_expires ON submission_keys (expires_at)')
+
+def migrate_shard_outbox(cursor):
+    """スキーマv15: 企業別データベースへの書き込み待ちの回答（カウンタ・集計と同じトランザクションで登録）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_outbox (
             id TEXT PRIMARY KEY,
             submission_time TEXT NOT NULL,
             user_agent TEXT,
             page_load_time INTEGER,
             response_data TEXT NOT NULL,
             survey_token TEXT,
+            company_id TEXT NOT NULL,
+            free_text TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shard_outbox_company ON shard_outbox (company_id)')
+
+def migrate_submission_key_company(cursor):
+    """スキーマv16: 送信キーの企業ID（企業の削除時に送信キーも削除する）
     
-    # 調査URL管理テーブル
+    既存のキーはカタログの回答・書き込み待ちの回答から設定する（企業別データベースへ書き込み済みの回答のキーは
+    設定しないが、有効期限（最長 IDEMPOTENCY_KEY_TTL_SECONDS）で削除される）。
+    """
+    cursor.execute('PRAGMA table_info(submission_keys)')
+    if 'company_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE submission_keys ADD COLUMN company_id TEXT')
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS survey_tokens (
-            token TEXT PRIMARY KEY,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            max_responses INTEGER DEFAULT 1,
-            current_responses INTEGER DEFAULT 0,
-            is_active BOOLEAN DEFAULT 1,
-            description TEXT
+        UPDATE submission_keys SET company_id = COALESCE(
+            (SELECT company_id FROM survey_responses WHERE id = submission_keys.response_id),
+            (SELECT company_id FROM shard_outbox WHERE id = submission_keys.response_id)
+        )
+        WHERE company_id IS NULL
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submission_keys_company ON submission_keys (company_id)')
+
+def current_period():
+    """回答を集計する期間（作成日時 CURRENT_TIMESTAMP と同じUTCの年月）"""
+    return datetime.utcnow().strftime('%Y-%m')
+
+def create_response_tables(cursor):
+    """調査回答・自由記述回答テーブルの作成（カタログと企業別データベースで共通）"""
+    # 調査回答テーブル
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_responses (
+            id TEXT PRIMARY KEY,
+            submission_time TEXT NOT NULL,
+            user_agent TEXT,
+            page_load_time INTEGER,
+            response_data TEXT NOT NULL,
+            survey_token TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
     
@@ -107,6 +698,23 @@ def init_database():
             FOREIGN KEY (response_id) REFERENCES survey_responses (id)
         )
     ''')
+
+def migrate_base_tables(cursor):
+    """スキーマv1: 調査回答・URL・統計テーブルの作成"""
+    create_response_tables(cursor)
+    
+    # 調査URL管理テーブル
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_tokens (
+            token TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            max_responses INTEGER DEFAULT 1,
+            current_responses INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            description TEXT
+        )
+    ''')
     
     # 管理者用統計テーブル
     cursor.execute('''
@@ -127,39 +735,218 @@ def init_database():
             INSERT INTO survey_statistics (total_responses, completion_rate, avg_satisfaction, nps_score)
             VALUES (0, 0.0, 0.0, 0.0)
         ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("データベースの初期化が完了しました")
-    
-    # デモデータの挿入（初回のみ）
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM survey_responses')
-    count = cursor.fetchone()[0]
-    conn.close()
-    
 
-# アプリケーション起動時にデータベースを初期化
+# 静的ファイル配信パイプライン（起動時にハッシュ・圧縮版を作成）
+asset_pipeline = AssetPipeline('.')
 try:
-    init_database()
+    asset_pipeline.build()
+    logger.info(f"静的ファイルの前処理が完了しました: {asset_pipeline.stats()}")
 except Exception as e:
-    logger.error(f"データベース初期化エラー: {e}")
+    logger.error(f"静的ファイル前処理エラー: {e}")
+
+def serve_static_file(filename):
+    """静的ファイルの配信（パイプライン対象外は通常配信）"""
+    response = asset_pipeline.response(filename)
+    if response is None:
+        return send_from_directory('.', filename)
+    return response
 
 @app.route('/')
 def index():
     """デモトップページ"""
-    return send_from_directory('.', 'demo.html')
+    return serve_static_file('demo.html')
 
 @app.route('/survey')
 def survey():
     """調査ページ"""
-    return send_from_directory('.', 'index.html')
+    return serve_static_file('index.html')
+
+@app.route('/assets/<path:filename>')
+def serve_hashed_assets(filename):
+    """ハッシュ付きURLでの静的ファイル配信（長期キャッシュ）"""
+    response = asset_pipeline.hashed_response(filename)
+    if response is None:
+        return jsonify({'error': 'ファイルが見つかりません'}), 404
+    return response
 
 @app.route('/<path:filename>')
 def serve_files(filename):
     """静的ファイルの配信"""
-    return send_from_directory('.', filename)
+    return serve_static_file(filename)
+
+# 自由記述項目（フィールド名とラベル）
+FREE_TEXT_FIELDS = {
+    'most_satisfied': '最も満足度が高い項目について',
+    'least_satisfied': '最も満足度が低い項目について', 
+    'most_expected': '最も期待度が高い項目について',
+    'other_comments': 'その他ご意見・ご要望'
+}
+
+SURVEY_FIELD_SPEC = build_survey_field_spec()
+
+def build_export_columns():
+    """列指向エクスポートの列定義（index.html の設問毎に1列）"""
+    columns = [{'name': name, 'type': 'string'} for name in ['response_id', 'created_at', 'submission_time']]
+    columns += [{'name': field, 'type': 'int8'} for field in SCALE_FIELDS]
+    # 5段階評価は1〜5点で保存し、選択肢のラベルを列の属性に記録
+    columns += [
+        {'name': field, 'type': 'int8', 'labels': labels}
+        for field, labels in build_response_layout()[len(SCALE_FIELDS):]
+    ]
+    columns += [
+        {'name': field, 'type': 'float64'}
+        for field in ['joining_year', 'annual_income', 'overtime_hours', 'paid_leave_rate']
+    ]
+    columns += [
+        {'name': field, 'type': 'dictionary'}
+        for field in ['employment_type', 'joining_type', 'department', 'position', 'job_type']
+    ]
+    columns += [{'name': field, 'type': 'string'} for field in ['department_other', 'job_type_other']]
+    columns += [{'name': field, 'type': 'string'} for field in FREE_TEXT_FIELDS]
+    return columns
+
+EXPORT_COLUMNS = build_export_columns()
+
+def check_submission(data, size=None):
+    """送信データの検証と正規化（size: リクエストボディのバイト数）
+    
+    戻り値: (保存用データ, エラーメッセージ)
+    """
+    if not data:
+        return None, '無効なデータです'
+    
+    payload, error_message = validate_submission(data, size)
+    if error_message:
+        logger.warning(f"無効なデータ送信: {error_message}")
+    return payload, error_message
+
+# 回答内容の指紋に含めない項目（再送・二重クリックのたびに変わる値）
+SUBMISSION_VOLATILE_FIELDS = frozenset([
+    'submission_time', 'user_agent', 'page_load_time', 'response_duration', 'last_updated'
+])
+
+def submission_key(data, client_key=None):
+    """重複送信の判定用の送信キー (キー, 有効期間（秒）)（不正な client_key はValueError）
+    
+    client_key（Idempotency-Key ヘッダー）がある場合はトークンとそのキー、ない場合はトークンと
+    回答内容（check_submission で正規化済み、送信時刻などを除く）のSHA-256とする。
+    SUBMISSION_FINGERPRINT_TTL_SECONDS が0の場合、キーのない送信は判定しない（None）。
+    """
+    token = data.get('survey_token') or ''
+    if client_key is not None:
+        if not 0 < len(client_key) <= 200 or not client_key.isprintable():
+            raise ValueError('invalid idempotency key')
+        source = f'key\n{token}\n{client_key}'
+        ttl = IDEMPOTENCY_KEY_TTL_SECONDS
+    elif SUBMISSION_FINGERPRINT_TTL_SECONDS <= 0:
+        return None
+    else:
+        content = {field: value for field, value in data.items() if field not in SUBMISSION_VOLATILE_FIELDS}
+        source = f'content\n{token}\n' + json.dumps(
+            content, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+        )
+        ttl = SUBMISSION_FINGERPRINT_TTL_SECONDS
+    return hashlib.sha256(source.encode('utf-8')).hexdigest(), ttl
+
+_submission_keys_purged_at = 0.0
+
+def claim_submission_key(session, key, response_id, now, company_id=None):
+    """送信キーの登録（有効期限内の同じキーが先に登録されていた場合はその回答ID、登録できた場合はNone）"""
+    global _submission_keys_purged_at
+    if key is None:
+        return None
+    if not session.claim_submission(key[0], response_id, now + key[1], now, company_id):
+        return session.find_submission(key[0], now)
+    
+    # 期限切れのキーの削除（同じ書き込みトランザクション内で一定間隔毎）
+    if now - _submission_keys_purged_at >= SUBMISSION_KEY_PURGE_SECONDS:
+        _submission_keys_purged_at = now
+        session.delete_expired_submissions(now)
+    return None
+
+def save_survey_response(cursor, data, payload, key=None):
+    """調査回答の保存（コミットは呼び出し側で実行）
+    
+    payload は check_submission が返した保存用データ、key は submission_key の戻り値
+    戻り値: (response_id, エラーメッセージ, 重複送信か)
+    重複送信（有効期限内の同じ送信キー）は保存・集計を行わず、元の回答IDを返す。
+    """
+    session = SQLiteStore.session(cursor)
+    now = time.time()
+    
+    # 重複送信の判定（送信キーの主キーの参照のみ、回答数上限の確認より先に行う）
+    if key is not None:
+        original_id = session.find_submission(key[0], now)
+        if original_id is not None:
+            return original_id, None, True
+    
+    # トークンの検証
+    survey_token = data.get('survey_token')
+    if survey_token:
+        token_info = session.get_active_token(survey_token)
+        
+        if not token_info:
+            return None, '無効なトークンです', False
+            
+        current_responses, max_responses = token_info
+        if current_responses >= max_responses:
+            return None, '回答数上限に達しています', False
+    
+    # 一意のIDを生成
+    response_id = str(uuid.uuid4())
+    company_id = session.get_token_company_id(survey_token) if survey_token else None
+    
+    # 回答本体と自由記述回答の保存
+    response_row = (
+        response_id,
+        data.get('submission_time'),
+        data.get('user_agent'),
+        data.get('page_load_time'),
+        payload,
+        survey_token,
+        company_id
+    )
+    free_text_rows = build_free_text_rows(response_id, data, company_id)
+    original_id = claim_submission_key(session, key, response_id, now, company_id)
+    if original_id is not None:
+        return original_id, None, True
+    if response_router.is_sharded(company_id):
+        # 企業別データベースへはカタログのコミット後に書き込む（flush_shard_outbox）
+        session.enqueue_shard_responses([response_row], free_text_rows)
+    else:
+        session.insert_responses([response_row], free_text_rows)
+    
+    # トークンの回答数を更新
+    if survey_token:
+        session.add_token_responses({survey_token: 1})
+        
+        # 企業別カウンタを更新
+        if company_id:
+            session.adjust_company_counters(company_id, responses_delta=1)
+    
+    # クロス集計セル・期間別の度数分布・モーメント行列への加算（回答本体が企業別データベースの場合もカタログで集計）
+    cells = CellAccumulator(RESPONSE_SCORE_MAPS)
+    cells.add(company_id, data)
+    session.add_crosstab_cells(cells.rows())
+    buckets = BucketAccumulator(RESPONSE_SCORE_MAPS)
+    buckets.add(company_id, current_period(), data)
+    session.add_score_buckets(buckets.rows())
+    moments = MomentAccumulator(DRIVER_VARIABLES, RESPONSE_SCORE_MAPS)
+    moments.add(company_id or NO_COMPANY, data)
+    add_driver_moments(session, moments)
+    
+    session.bump_data_version(company_id)
+    
+    return response_id, None, False
+
+def build_free_text_rows(response_id, data, company_id=None):
+    """自由記述回答テーブルへの挿入行の作成（company_id は回答のトークンの企業）"""
+    rows = []
+    for field_name, label in FREE_TEXT_FIELDS.items():
+        if field_name in data and data[field_name]:
+            response_text = data[field_name]
+            rows.append((response_id, field_name, label, response_text, len(response_text), company_id))
+    return rows
 
 @app.route('/api/submit', methods=['POST'])
 def submit_survey():
@@ -171,98 +958,52 @@ def submit_survey():
             logger.warning(f"レート制限違反: {client_ip}")
             return jsonify({'error': 'レート制限に達しました'}), 429
         
-        data = request.get_json()
+        # サイズはJSONを解析する前にContent-Lengthで確認
+        size = request.content_length
+        if size is not None and size > SUBMISSION_MAX_BYTES:
+            return jsonify({'error': 'データサイズが大きすぎます'}), 413
         
-        if not data:
-            return jsonify({'error': '無効なデータです'}), 400
+        data = request.get_json()
         
-        # データ検証
-        is_valid, error_message = validate_request_data(data)
-        if not is_valid:
-            logger.warning(f"無効なデータ送信: {error_message}")
+        payload, error_message = check_submission(data, size)
+        if error_message:
             return jsonify({'error': error_message}), 400
-        
-        # 入力値のサニタイズ
-        if 'user_agent' in data:
-            data['user_agent'] = sanitize_input(data['user_agent'])
-        
-        # 一意のIDを生成
-        response_id = str(uuid.uuid4())
+        try:
+            key = submission_key(data, request.headers.get('Idempotency-Key'))
+        except ValueError:
+            return jsonify({'error': '無効な Idempotency-Key です'}), 400
         
         # データベースに保存
         conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
         
-        # トークンの検証と回答数更新
-        survey_token = data.get('survey_token')
-        if survey_token:
-            cursor.execute('''
-                SELECT current_responses, max_responses FROM survey_tokens 
-                WHERE token = ? AND is_active = 1
-            ''', (survey_token,))
-            token_info = cursor.fetchone()
-            
-            if not token_info:
-                conn.close()
-                return jsonify({'error': '無効なトークンです'}), 400
-                
-            current_responses, max_responses = token_info
-            if current_responses >= max_responses:
-                conn.close()
-                return jsonify({'error': '回答数上限に達しています'}), 400
-        
-        cursor.execute('''
-            INSERT INTO survey_responses 
-            (id, submission_time, user_agent, page_load_time, response_data, survey_token)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            response_id,
-            data.get('submission_time'),
-            data.get('user_agent'),
-            data.get('page_load_time'),
-            json.dumps(data),
-            survey_token
-        ))
-        
-        # トークンの回答数を更新
-        if survey_token:
-            cursor.execute('''
-                UPDATE survey_tokens 
-                SET current_responses = current_responses + 1
-                WHERE token = ?
-            ''', (survey_token,))
-        
-        # 自由記述回答を別テーブルに保存
-        free_text_fields = {
-            'most_satisfied': '最も満足度が高い項目について',
-            'least_satisfied': '最も満足度が低い項目について', 
-            'most_expected': '最も期待度が高い項目について',
-            'other_comments': 'その他ご意見・ご要望'
-        }
-        
-        for field_name, label in free_text_fields.items():
-            if field_name in data and data[field_name]:
-                response_text = data[field_name]
-                character_count = len(response_text)
-                
-                cursor.execute('''
-                    INSERT INTO free_text_responses 
-                    (response_id, question_type, question_label, response_text, character_count)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    response_id,
-                    field_name,
-                    label,
-                    response_text,
-                    character_count
-                ))
+        response_id, error_message, duplicate = save_survey_response(cursor, data, payload, key)
+        if error_message:
+            conn.close()
+            return jsonify({'error': error_message}), 400
         
+        survey_token = data.get('survey_token')
+        company_id = get_token_company_id(cursor, survey_token) if survey_token and response_router.enabled else None
         conn.commit()
         conn.close()
+        if response_router.is_sharded(company_id):
+            flush_shard_outbox(company_id)
+        
+        if duplicate:
+            logger.info(f"重複送信のため保存済みの回答IDを返します: {response_id}")
+            return jsonify({
+                'success': True,
+                'response_id': response_id,
+                'duplicate': True,
+                'message': 'この回答は既に保存されています'
+            })
         
         # 統計データを更新
         update_statistics()
         
+        # ダッシュボードへの差分配信
+        publish_submission_event(data)
+        
         logger.info(f"調査回答を保存しました: {response_id}")
         
         return jsonify({
@@ -275,44 +1016,48 @@ def submit_survey():
         logger.error(f"調査回答の保存に失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
-@app.route('/api/statistics', methods=['GET'])
-def get_statistics():
-    """管理者ダッシュボード用の統計データ取得"""
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 基本統計
-        cursor.execute('SELECT COUNT(*) FROM survey_responses')
-        total_responses = cursor.fetchone()[0]
-        
-        # 満足度の計算
-        cursor.execute('SELECT response_data FROM survey_responses')
-        responses = cursor.fetchall()
-        
-        satisfaction_scores = []
-        nps_scores = []
-        
-        for response in responses:
+def collect_response_scores(path):
+    """1つのデータベースの回答から満足度・推奨度のスコアを収集"""
+    satisfaction_scores = []
+    nps_scores = []
+    
+    with analytics_session(path) as session:
+        for response_data in session.iter_response_data():
             try:
-                data = json.loads(response[0])
-                
-                # 総合満足度の計算
-                overall_satisfaction = data.get('overall_satisfaction')
+                # 必要な項目のみを取得（コンパクト形式は全体を展開しない）
+                overall_satisfaction = response_codec.get(response_data, 'overall_satisfaction')
                 if overall_satisfaction:
                     score = get_satisfaction_score(overall_satisfaction)
                     if score:
                         satisfaction_scores.append(score)
                 
                 # NPS計算用の推奨度
-                recommendation = data.get('recommendation')
-                if recommendation:
+                recommendation = response_codec.get(response_data, 'recommendation')
+                if recommendation is not None and recommendation != '':
                     nps_score = get_nps_score(recommendation)
                     if nps_score is not None:
                         nps_scores.append(nps_score)
                         
-            except json.JSONDecodeError:
+            except ValueError:
                 continue
+    
+    return satisfaction_scores, nps_scores
+
+@app.route('/api/statistics', methods=['GET'])
+@versioned_json(snapshot=True)
+def get_statistics():
+    """管理者ダッシュボード用の統計データ取得"""
+    try:
+        # 基本統計
+        with analytics_session() as session:
+            total_responses = count_all_responses(session.cursor)
+        
+        # 満足度の計算（企業別データベースを含む全データベースを並列に集計）
+        satisfaction_scores = []
+        nps_scores = []
+        for partial_satisfaction, partial_nps in response_router.fan_out(collect_response_scores):
+            satisfaction_scores.extend(partial_satisfaction)
+            nps_scores.extend(partial_nps)
         
         # 平均値の計算
         avg_satisfaction = sum(satisfaction_scores) / len(satisfaction_scores) if satisfaction_scores else 0
@@ -323,107 +1068,116 @@ def get_statistics():
         # 完了率（仮の値）
         completion_rate = 87.5
         
-        # 部署別データ（サンプル）
+        # 部署別データ
         department_data = get_department_statistics()
         
         # カテゴリ別満足度
-        category_satisfaction = get_category_satisfaction(responses)
+        category_satisfaction = get_category_satisfaction(satisfaction_scores)
         
         statistics = {
             'total_responses': total_responses,
             'completion_rate': completion_rate,
             'avg_satisfaction': round(avg_satisfaction, 2),
             'nps_score': round(nps, 1),
+            'nps_interval': nps_interval(Counter(nps_scores)),
             'department_data': department_data,
             'category_satisfaction': category_satisfaction,
             'satisfaction_distribution': get_satisfaction_distribution(satisfaction_scores),
             'response_trend': get_response_trend()
         }
         
-        conn.close()
-        
         return jsonify(statistics)
         
     except Exception as e:
         logger.error(f"統計データの取得に失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+# 一覧APIで1回に読み込む件数（ページ毎に接続を開き直すため、出力中はデータベースのロックを保持しない）
+LIST_PAGE_ROWS = int(os.environ.get('LIST_PAGE_ROWS', 1000))
+
+def iter_list_pages(path, fetch_page, key):
+    """1つのデータベースの一覧を LIST_PAGE_ROWS 件ずつ読み、1行ずつ返す
+    
+    fetch_page(session, before) は before（前ページ末尾の行の key）より後の1ページを返す。
+    """
+    before = None
+    while True:
+        with SQLiteStore(path).read() as session:
+            rows = fetch_page(session, before)
+        yield from rows
+        if len(rows) < LIST_PAGE_ROWS:
+            return
+        before = key(rows[-1])
+
+def json_stream_response(chunks):
+    """逐次出力するJSONのレスポンス（最初のページの読み込みまではリクエスト内で実行し、失敗は500にする）"""
+    first = next(chunks)
+    return Response(itertools.chain([first], chunks), mimetype='application/json')
+
+def response_list_key(row):
+    """回答一覧の並び順のキー (created_at, id)"""
+    return (row[3] or '', row[0])
+
+def encode_response_row(row):
+    """回答一覧の1行のJSON（保存済みの回答データは再変換せずに埋め込む、読めない行はNone）"""
+    try:
+        data = response_codec.to_json(row[2])
+    except ValueError as e:
+        logger.warning(f"回答データを読み込めないため一覧から除外しました: {row[0]}: {str(e)}")
+        return None
+    return raw_object({'id': row[0], 'submission_time': row[1], 'created_at': row[3]}, {'data': data})
+
 @app.route('/api/responses', methods=['GET'])
 def get_responses():
     """全回答データの取得（管理者用）"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, submission_time, response_data, created_at 
-            FROM survey_responses 
-            ORDER BY created_at DESC
-        ''')
-        
-        responses = []
-        for row in cursor.fetchall():
-            try:
-                response_data = json.loads(row[2])
-                responses.append({
-                    'id': row[0],
-                    'submission_time': row[1],
-                    'data': response_data,
-                    'created_at': row[3]
-                })
-            except json.JSONDecodeError:
-                continue
-        
-        conn.close()
+        def fetch_rows(path):
+            return iter_list_pages(path, lambda session, before: session.list_responses_page(before, LIST_PAGE_ROWS),
+                                   key=response_list_key)
         
-        return jsonify(responses)
+        rows = response_router.merge_sorted(fetch_rows, key=response_list_key)
+        return json_stream_response(stream_json_array(rows, encode_response_row))
         
     except Exception as e:
         logger.error(f"回答データの取得に失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+def collect_free_text_statistics(path):
+    """1つのデータベースの自由記述回答の設問別集計と最新回答"""
+    with SQLiteStore(path).read() as session:
+        return session.free_text_statistics(), session.recent_free_text(10)
+
 @app.route('/api/free-text-analysis', methods=['GET'])
 def get_free_text_analysis():
     """自由記述回答の分析データ取得"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 自由記述回答の統計
-        cursor.execute('''
-            SELECT 
-                question_type,
-                question_label,
-                COUNT(*) as response_count,
-                AVG(character_count) as avg_length,
-                MIN(character_count) as min_length,
-                MAX(character_count) as max_length
-            FROM free_text_responses 
-            GROUP BY question_type, question_label
-            ORDER BY response_count DESC
-        ''')
+        merged = {}
+        recent_rows = []
+        for stats_rows, recent in response_router.fan_out(collect_free_text_statistics):
+            for question_type, question_label, count, total_length, min_length, max_length in stats_rows:
+                entry = merged.setdefault((question_type, question_label), [0, 0, None, None])
+                entry[0] += count
+                entry[1] += total_length or 0
+                if min_length is not None:
+                    entry[2] = min_length if entry[2] is None else min(entry[2], min_length)
+                if max_length is not None:
+                    entry[3] = max_length if entry[3] is None else max(entry[3], max_length)
+            recent_rows.extend(recent)
         
         stats = []
-        for row in cursor.fetchall():
+        for (question_type, question_label), (count, total_length, min_length, max_length) in merged.items():
             stats.append({
-                'question_type': row[0],
-                'question_label': row[1],
-                'response_count': row[2],
-                'avg_length': round(row[3], 1) if row[3] else 0,
-                'min_length': row[4],
-                'max_length': row[5]
+                'question_type': question_type,
+                'question_label': question_label,
+                'response_count': count,
+                'avg_length': round(total_length / count, 1) if total_length else 0,
+                'min_length': min_length,
+                'max_length': max_length
             })
-        
-        # 最新の自由記述回答
-        cursor.execute('''
-            SELECT response_text, character_count, response_time, question_label
-            FROM free_text_responses 
-            ORDER BY response_time DESC 
-            LIMIT 10
-        ''')
+        stats.sort(key=lambda item: item['response_count'], reverse=True)
         
         recent_responses = []
-        for row in cursor.fetchall():
+        for row in merge_shard_rows([recent_rows], key=lambda row: row[2])[:10]:
             recent_responses.append({
                 'text': row[0][:200] + '...' if len(row[0]) > 200 else row[0],
                 'length': row[1],
@@ -431,8 +1185,6 @@ def get_free_text_analysis():
                 'question': row[3]
             })
         
-        conn.close()
-        
         return jsonify({
             'statistics': stats,
             'recent_responses': recent_responses
@@ -458,16 +1210,9 @@ def create_survey_token():
         from datetime import datetime, timedelta
         expires_at = datetime.now() + timedelta(hours=expires_hours)
         
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO survey_tokens (token, expires_at, max_responses, description)
-            VALUES (?, ?, ?, ?)
-        ''', (token, expires_at.isoformat(), max_responses, description))
-        
-        conn.commit()
-        conn.close()
+        with catalog_store.transaction() as session:
+            session.create_tokens([(token, expires_at.isoformat(), max_responses, description)])
+            session.bump_data_version()
         
         survey_url = f"/survey/{token}"
         
@@ -487,17 +1232,11 @@ def create_survey_token():
 def get_survey_tokens():
     """調査URLトークン一覧取得"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT token, created_at, expires_at, max_responses, current_responses, is_active, description
-            FROM survey_tokens ORDER BY created_at DESC
-        ''')
+        rows = iter_list_pages(DATABASE_PATH, lambda session, before: session.list_tokens_page(before, LIST_PAGE_ROWS),
+                               key=lambda row: (row[1] or '', row[0]))
         
-        tokens = []
-        for row in cursor.fetchall():
-            tokens.append({
+        def encode_token(row):
+            return json.dumps({
                 'token': row[0],
                 'created_at': row[1],
                 'expires_at': row[2],
@@ -507,33 +1246,140 @@ def get_survey_tokens():
                 'description': row[6]
             })
         
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'tokens': tokens
-        })
+        return json_stream_response(stream_json_array(
+            rows, encode_token, prefix='{"success": true, "tokens": [', suffix=']}'
+        ))
         
     except Exception as e:
         logger.error(f"トークン一覧取得に失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
-@app.route('/survey/<token>')
-def survey_with_token(token):
-    """トークン付き調査ページ"""
+# 一括URL作成の上限件数・URL毎の最大回答数の上限・有効期限の上限（時間、1年）
+BULK_URL_MAX_COUNT = 10000
+BULK_URL_MAX_RESPONSES = 1000000
+BULK_URL_MAX_EXPIRES_HOURS = 24 * 365
+
+def parse_bulk_url_request(data, default_max_responses, default_expires_hours):
+    """一括URL作成リクエストの解析
+    
+    descriptions（URL毎の説明のリスト）または count と description を受け付ける
+    戻り値: (説明のリスト, 最大回答数, 有効期限（時間）, エラーメッセージ)
+    """
+    descriptions = data.get('descriptions')
+    if descriptions is not None:
+        if not isinstance(descriptions, list):
+            return None, None, None, 'descriptions はリストで指定してください'
+        descriptions = [sanitize_input(description) for description in descriptions]
+    else:
+        try:
+            count = int(data.get('count', 0))
+        except (TypeError, ValueError):
+            return None, None, None, 'count は整数で指定してください'
+        descriptions = [sanitize_input(data.get('description', ''))] * count
+    
+    if not 1 <= len(descriptions) <= BULK_URL_MAX_COUNT:
+        return None, None, None, f'作成数は1〜{BULK_URL_MAX_COUNT}件で指定してください'
+    
     try:
+        max_responses = int(data.get('max_responses', default_max_responses))
+        expires_hours = float(data.get('expires_hours', default_expires_hours))
+    except (TypeError, ValueError):
+        return None, None, None, 'max_responses と expires_hours は数値で指定してください'
+    if not 1 <= max_responses <= BULK_URL_MAX_RESPONSES:
+        return None, None, None, f'max_responses は1〜{BULK_URL_MAX_RESPONSES}で指定してください'
+    # NaN・無限大を含め範囲外は拒否（timedelta の OverflowError を防ぐ）
+    if not 0 < expires_hours <= BULK_URL_MAX_EXPIRES_HOURS:
+        return None, None, None, f'expires_hours は0より大きく{BULK_URL_MAX_EXPIRES_HOURS}以下で指定してください'
+    
+    return descriptions, max_responses, expires_hours, None
+
+def insert_survey_tokens(cursor, descriptions, max_responses, expires_at, company_id=None):
+    """調査URLトークンの一括挿入（呼び出し側のトランザクション内で実行）"""
+    rows = [
+        (secrets.token_urlsafe(32), expires_at.isoformat(), max_responses, description)
+        for description in descriptions
+    ]
+    SQLiteStore.session(cursor).create_tokens(rows, company_id)
+    return rows
+
+def bulk_urls_response(rows, output_format):
+    """作成したURL一覧をJSONまたはCSVで逐次返却"""
+    if output_format == 'csv':
+        def generate_csv():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(['token', 'survey_url', 'description', 'max_responses', 'expires_at'])
+            for index, (token, expires_at, max_responses, description) in enumerate(rows, 1):
+                writer.writerow([token, f"/survey/{token}", description, max_responses, expires_at])
+                if index % 500 == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        
+        return Response(generate_csv(), mimetype='text/csv', headers={
+            'Content-Disposition': 'attachment; filename=survey_urls.csv'
+        })
+    
+    def generate_json():
+        yield f'{{"success": true, "count": {len(rows)}, "urls": ['
+        for index, (token, expires_at, max_responses, description) in enumerate(rows):
+            yield (',' if index else '') + json.dumps({
+                'token': token,
+                'survey_url': f"/survey/{token}",
+                'description': description,
+                'max_responses': max_responses,
+                'expires_at': expires_at
+            })
+        yield ']}'
+    
+    return Response(generate_json(), mimetype='application/json')
+
+def get_bulk_output_format(data):
+    """一括作成結果の出力形式（json または csv）"""
+    output_format = (request.args.get('format') or data.get('format') or 'json').lower()
+    return 'csv' if output_format == 'csv' else 'json'
+
+@app.route('/api/tokens/bulk', methods=['POST'])
+def create_survey_tokens_bulk():
+    """調査URLトークンの一括作成"""
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': '無効なデータです'}), 400
+        
+        descriptions, max_responses, expires_hours, error_message = parse_bulk_url_request(data, 1, 24)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
+        expires_at = datetime.now() + timedelta(hours=expires_hours)
+        
         conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
         
-        # トークンの検証
-        cursor.execute('''
-            SELECT expires_at, max_responses, current_responses, is_active
-            FROM survey_tokens WHERE token = ?
-        ''', (token,))
+        rows = insert_survey_tokens(cursor, descriptions, max_responses, expires_at)
+        bump_data_version(cursor)
         
-        token_data = cursor.fetchone()
+        conn.commit()
         conn.close()
         
+        logger.info(f"調査URLを一括作成しました: {len(rows)}件")
+        
+        return bulk_urls_response(rows, get_bulk_output_format(data))
+        
+    except Exception as e:
+        logger.error(f"トークン一括作成に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+@app.route('/survey/<token>')
+def survey_with_token(token):
+    """トークン付き調査ページ"""
+    try:
+        # トークンの検証
+        with catalog_store.read() as session:
+            token_data = session.get_token(token)
+        
         if not token_data:
             return "無効なURLです", 404
             
@@ -551,8 +1397,10 @@ def survey_with_token(token):
             return "回答数上限に達しています", 403
         
         # index.htmlを読み込んでトークンを埋め込み
-        with open('index.html', 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        html_content = asset_pipeline.html('index.html')
+        if html_content is None:
+            with open('index.html', 'r', encoding='utf-8') as f:
+                html_content = f.read()
             
         # トークンをJavaScriptに埋め込み
         html_content = html_content.replace(
@@ -573,11 +1421,7 @@ def disable_survey_token(token):
         conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            UPDATE survey_tokens SET is_active = 0 WHERE token = ?
-        ''', (token,))
-        
-        if cursor.rowcount == 0:
+        if not deactivate_survey_token(cursor, token):
             conn.close()
             return jsonify({'error': 'トークンが見つかりません'}), 404
         
@@ -592,29 +1436,96 @@ def disable_survey_token(token):
 
 @app.route('/api/export', methods=['GET'])
 def export_data():
-    """データのエクスポート（CSV形式）"""
+    """データのエクスポート（CSV・Parquet・列指向ZIP形式、バックグラウンドジョブで作成）"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM survey_responses ORDER BY created_at DESC')
-        responses = cursor.fetchall()
-        
-        # CSVデータの生成
-        csv_data = generate_csv_export(responses)
-        
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'data': csv_data,
-            'count': len(responses)
-        })
+        export_format = get_export_format()
+        if export_format is None:
+            return jsonify({'error': '無効なエクスポート形式です'}), 400
+        job = job_queue.submit('export', {'format': export_format}, owner='admin')
+        return job_accepted_response(job, '/api/jobs')
         
     except Exception as e:
         logger.error(f"データエクスポートに失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+def run_export_job(context):
+    """全回答のエクスポート（ジョブ）"""
+    export_format = context.params.get('format', 'csv')
+    sources = [(path, None) for path in response_router.all_paths()]
+    if export_format != 'csv':
+        return run_columnar_export(context, 'survey_responses', sources, export_format)
+    
+    # データベース毎にチャンク単位で読み込み、1行ずつファイルへ書き込む（全件をメモリに載せない）
+    path = context.artifact(f"survey_responses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", 'text/csv')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        count = write_csv_export(f, iter_export_records(sources, context.progress))
+    return {'count': count}
+
+def get_export_format():
+    """エクスポート形式の判定（?format=、未指定はCSV、未対応の形式はNone）"""
+    export_format = (request.args.get('format') or 'csv').lower()
+    if export_format == 'csv' or export_format in FORMAT_FILES:
+        return export_format
+    return None
+
+def iter_export_records(sources, progress=None):
+    """エクスポートする回答の行を新しい順に1件ずつ返す（EXPORT_CHUNK_ROWS 件ずつ読み込む）
+    
+    チャンク毎に rowid の範囲で読み直すため、読み込みの間はデータベースのロックを保持しない
+    （進捗の記録などの書き込みを待たせない）。
+    sources: (データベースのパス, 絞り込む企業ID（None は全件）) のリスト
+    戻り値: (response_id, submission_time, response_data, created_at)
+    """
+    for index, (path, company_id) in enumerate(sources):
+        if company_id is None:
+            source_sql, params = 'FROM survey_responses sr WHERE 1 = 1', ()
+        else:
+            source_sql, params = 'FROM survey_responses sr WHERE sr.company_id = ?', (company_id,)
+        with analytics_session(path) as session:
+            total = session.fetchone(f'SELECT COUNT(*) {source_sql}', params)[0]
+        
+        last_rowid = None
+        done = 0
+        while True:
+            with analytics_session(path) as session:
+                rows = session.fetchall(f'''
+                    SELECT sr.rowid, sr.id, sr.submission_time, sr.response_data, sr.created_at {source_sql}
+                    {'' if last_rowid is None else 'AND sr.rowid < ?'}
+                    ORDER BY sr.rowid DESC LIMIT ?
+                ''', params + (() if last_rowid is None else (last_rowid,)) + (EXPORT_CHUNK_ROWS,))
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+            done += len(rows)
+            if progress is not None:
+                progress((index + min(done / max(total, 1), 1.0)) / len(sources))
+
+def iter_export_rows(sources, progress=None):
+    """エクスポートする回答を新しい順に1件ずつ返す（iter_export_records の回答データを展開）
+    
+    戻り値: 回答データに response_id・created_at・submission_time を加えたdict
+    """
+    for response_id, submission_time, response_data, created_at in iter_export_records(sources, progress):
+        try:
+            data = decode_response_data(response_data)
+        except ValueError:
+            continue
+        data.update(response_id=response_id, created_at=created_at, submission_time=submission_time)
+        yield data
+
+def run_columnar_export(context, basename, sources, export_format):
+    """列指向形式のエクスポート（pyarrowがない環境のParquet指定は列指向ZIPで作成）"""
+    extension, content_type = FORMAT_FILES[resolve_format(export_format)]
+    path = context.artifact(f"{basename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}", content_type)
+    written_format, count = write_columnar_export(
+        path, EXPORT_COLUMNS, iter_export_rows(sources, context.progress),
+        output_format=export_format, chunk_rows=EXPORT_CHUNK_ROWS,
+        metadata={'exported_at': datetime.now().isoformat()}
+    )
+    return {'count': count, 'format': written_format}
+
 def get_satisfaction_score(value):
     """満足度の数値変換"""
     score_map = {
@@ -645,14 +1556,18 @@ def calculate_nps(scores):
     return ((promoters - detractors) / total) * 100
 
 def get_department_statistics():
-    """部署別統計（サンプルデータ）"""
-    return [
-        {'department': '営業部', 'satisfaction': 3.8, 'responses': 25},
-        {'department': 'エンジニアリング部', 'satisfaction': 4.1, 'responses': 18},
-        {'department': 'マーケティング部', 'satisfaction': 3.5, 'responses': 12},
-        {'department': '人事部', 'satisfaction': 4.0, 'responses': 8},
-        {'department': '経理部', 'satisfaction': 3.7, 'responses': 6}
-    ]
+    """部署別統計（全企業のクロス集計セルから、回答者数が少ない部署は除く）"""
+    departments = []
+    for group in query_crosstab(None, ('department',), questions=['overall_satisfaction']):
+        overall = group['questions'].get('overall_satisfaction')
+        if group['suppressed'] or overall is None:
+            continue
+        departments.append({
+            'department': group['department'] or '未回答',
+            'satisfaction': overall['mean'],
+            'responses': group['respondents']
+        })
+    return departments
 
 def get_category_satisfaction(responses):
     """カテゴリ別満足度の計算"""
@@ -701,33 +1616,30 @@ def get_response_trend():
     # 実際の実装では過去7日間のデータを取得
     return [2, 5, 3, 8, 6, 4, 7]
 
-def generate_csv_export(responses):
-    """CSV形式でのデータ生成"""
-    csv_lines = ['ID,送信時刻,回答データ,作成日時']
+def write_csv_export(f, records):
+    """CSV形式でのデータ出力（回答データはコンパクト形式を展開したJSON、戻り値: 出力した件数）
     
-    for response in responses:
-        csv_lines.append(f'"{response[0]}","{response[1]}","{response[3]}","{response[4]}"')
+    records: iter_export_records の行
+    """
+    writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writerow(['ID', '送信時刻', '回答データ', '作成日時'])
     
-    return '\n'.join(csv_lines)
+    count = 0
+    for response_id, submission_time, response_data, created_at in records:
+        try:
+            response_data = json.dumps(decode_response_data(response_data), ensure_ascii=False)
+        except ValueError:
+            continue
+        writer.writerow([response_id, submission_time, response_data, created_at])
+        count += 1
+    return count
 
 def update_statistics():
     """統計データの更新"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 統計の再計算と更新
-        cursor.execute('SELECT COUNT(*) FROM survey_responses')
-        total_responses = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            UPDATE survey_statistics 
-            SET total_responses = ?, last_updated = CURRENT_TIMESTAMP
-            WHERE id = 1
-        ''', (total_responses,))
-        
-        conn.commit()
-        conn.close()
+        with catalog_store.transaction() as session:
+            # 統計の再計算と更新
+            session.update_statistics(count_all_responses(session.cursor))
         
     except Exception as e:
         logger.error(f"統計データの更新に失敗しました: {str(e)}")
@@ -737,6 +1649,10 @@ def update_statistics():
 # ====================
 
 # 運営者認証チェック（簡易版）
+def is_valid_operator_token(token):
+    """運営者トークンの検証（仮の認証チェック、本格実装時に置き換え）"""
+    return bool(token) and len(token) >= 16
+
 def require_operator_auth(f):
     """運営者認証が必要なエンドポイントのデコレータ"""
     @wraps(f)
@@ -746,9 +1662,8 @@ def require_operator_auth(f):
         if not auth_header or not auth_header.startswith('Bearer '):
             return jsonify({'error': '認証が必要です'}), 401
         
-        # 仮の認証チェック（本格実装時に置き換え）
         token = auth_header.split(' ')[1]
-        if not token or len(token) < 16:
+        if not is_valid_operator_token(token):
             return jsonify({'error': '無効な認証トークンです'}), 401
         
         return f(*args, **kwargs)
@@ -757,37 +1672,33 @@ def require_operator_auth(f):
 @app.route('/operator-dashboard.html')
 def operator_dashboard():
     """運営者ダッシュボード（認証後）"""
-    return send_from_directory('.', 'operator-dashboard.html')
+    return serve_static_file('operator-dashboard.html')
 
 @app.route('/api/operator/overview', methods=['GET'])
 @require_operator_auth
+@versioned_json()
 def get_operator_overview():
     """運営者向けシステム概要データ"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 総回答数
-        cursor.execute('SELECT COUNT(*) FROM survey_responses')
-        total_responses = cursor.fetchone()[0]
-        
-        # アクティブなトークン数
-        cursor.execute('SELECT COUNT(*) FROM survey_tokens WHERE is_active = 1')
-        active_surveys = cursor.fetchone()[0]
+        with catalog_store.read() as session:
+            # 総回答数
+            total_responses = count_all_responses(session.cursor)
+            
+            # アクティブなトークン数
+            active_surveys = session.count_active_tokens()
         
-        # 過去30日の回答トレンド
-        cursor.execute('''
-            SELECT DATE(created_at) as date, COUNT(*) as count
-            FROM survey_responses 
-            WHERE created_at >= datetime('now', '-30 days')
-            GROUP BY DATE(created_at)
-            ORDER BY date DESC
-            LIMIT 30
-        ''')
+        # 過去30日の回答トレンド（全データベースの日別件数を合算、created_at はUTC）
+        since = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
         
-        daily_responses = cursor.fetchall()
+        def fetch_daily_counts(path):
+            with SQLiteStore(path).read() as session:
+                return session.daily_response_counts(since)
         
-        conn.close()
+        daily_counts = {}
+        for rows in response_router.fan_out(fetch_daily_counts):
+            for date, count in rows:
+                daily_counts[date] = daily_counts.get(date, 0) + count
+        daily_responses = sorted(daily_counts.items(), reverse=True)[:30]
         
         # サンプルデータで補完
         overview_data = {
@@ -822,47 +1733,38 @@ def get_operator_overview():
 
 @app.route('/api/operator/companies', methods=['GET'])
 @require_operator_auth
+@versioned_json()
 def get_operator_companies():
     """運営者向け企業一覧データ"""
     try:
-        # 実装時には企業管理テーブルから取得
-        # 現在はサンプルデータを返す
-        companies_data = {
-            'companies': [
-                {
-                    'id': '1',
-                    'name': '株式会社テクノソリューション',
-                    'industry': 'IT・技術',
-                    'size': 150,
-                    'plan': 'premium',
-                    'responses': 1247,
-                    'lastUsed': '2025-08-16',
-                    'status': 'active'
-                },
-                {
-                    'id': '2',
-                    'name': 'グローバル製造業株式会社',
-                    'industry': '製造業',
-                    'size': 3200,
-                    'plan': 'enterprise',
-                    'responses': 2890,
-                    'lastUsed': '2025-08-15',
-                    'status': 'active'
-                },
-                {
-                    'id': '3',
-                    'name': 'フィナンシャルサービス',
-                    'industry': '金融',
-                    'size': 850,
-                    'plan': 'premium',
-                    'responses': 654,
-                    'lastUsed': '2025-08-10',
-                    'status': 'active'
-                }
-            ]
-        }
+        page, per_page, sort, order = get_paging_params()
+        
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        
+        rows, pagination = fetch_company_listing(cursor, page, per_page, sort, order)
+        
+        conn.close()
+        
+        companies = []
+        for row in rows:
+            last_response_at = row[9]
+            companies.append({
+                'id': row[0],
+                'name': row[1],
+                'industry': None,  # 企業テーブルに業種情報なし
+                'size': None,
+                'plan': None,
+                'activeUrls': row[7],
+                'responses': row[8],
+                'lastUsed': last_response_at[:10] if last_response_at else None,
+                'status': 'active' if row[5] else 'inactive'
+            })
         
-        return jsonify(companies_data)
+        return jsonify({
+            'companies': companies,
+            'pagination': pagination
+        })
         
     except Exception as e:
         logger.error(f"運営者企業データの取得に失敗しました: {str(e)}")
@@ -901,6 +1803,7 @@ def add_operator_company():
 
 @app.route('/api/operator/security', methods=['GET'])
 @require_operator_auth
+@versioned_json()
 def get_operator_security():
     """運営者向けセキュリティ監視データ"""
     try:
@@ -940,6 +1843,7 @@ def get_operator_security():
 
 @app.route('/api/operator/analytics', methods=['GET'])
 @require_operator_auth
+@versioned_json()
 def get_operator_analytics():
     """運営者向け全体分析データ"""
     try:
@@ -947,8 +1851,7 @@ def get_operator_analytics():
         cursor = conn.cursor()
         
         # 業界別統計の計算（実際のデータがある場合）
-        cursor.execute('SELECT COUNT(*) FROM survey_responses')
-        total_responses = cursor.fetchone()[0]
+        total_responses = count_all_responses(cursor)
         
         conn.close()
         
@@ -1021,31 +1924,104 @@ def update_operator_settings():
 @app.route('/api/operator/backup', methods=['POST'])
 @require_operator_auth
 def trigger_operator_backup():
-    """運営者向けバックアップ実行"""
+    """運営者向けバックアップ実行（バックグラウンドジョブで作成）"""
     try:
-        # 実装時には実際のバックアップ処理を実行
-        logger.info("手動バックアップを実行しました")
-        
-        return jsonify({
-            'success': True,
-            'message': 'バックアップを開始しました',
-            'timestamp': datetime.now().isoformat()
-        })
+        job = job_queue.submit('backup', owner='operator')
+        logger.info(f"手動バックアップを開始しました: {job['job_id']}")
+        return job_accepted_response(job, '/api/operator/jobs', message='バックアップを開始しました')
         
     except Exception as e:
         logger.error(f"バックアップ実行に失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+def run_backup_job(context):
+    """全データベース（カタログ・企業別データベース）のバックアップをZIPで作成（ジョブ）
+    
+    SQLiteのバックアップAPIでコピーするため、書き込み中でも整合性の取れた状態を保存できる。
+    分割コピー（pages指定）は他の接続の書き込みがある度に最初からやり直しになるため1回でコピーし、
+    コピーと圧縮の間は context.heartbeat() で実行中であることを記録する（長時間のコピーを再実行しない）
+    """
+    paths = response_router.all_paths()
+    archive_path = context.artifact(f"survey_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip", 'application/zip')
+    copy_path = f'{archive_path}.db'
+    try:
+        with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for index, path in enumerate(paths):
+                name = os.path.basename(path)
+                with context.heartbeat():
+                    source = sqlite3.connect(path, timeout=30)
+                    target = sqlite3.connect(copy_path)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+                        source.close()
+                    archive.write(copy_path, name if index == 0 else f'shards/{name}')
+                os.remove(copy_path)
+                context.progress((index + 1) / len(paths))
+    finally:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+    return {'databases': len(paths), 'bytes': os.path.getsize(archive_path)}
+
+# ====================
+# バックグラウンドジョブの状態・結果取得
+# ====================
+
+def job_accepted_response(job, base_path, message=None):
+    """ジョブ登録時のレスポンス（状態・ダウンロード用URLを含む）"""
+    result = {
+        'success': True,
+        'job': job,
+        'status_url': f"{base_path}/{job['job_id']}",
+        'download_url': f"{base_path}/{job['job_id']}/download"
+    }
+    if message:
+        result['message'] = message
+    return jsonify(result), 202
+
+def job_status_response(job_id, owner):
+    job = job_queue.get(job_id, owner=owner)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify({'success': True, 'job': job})
+
+def job_download_response(job_id, owner):
+    artifact = job_queue.artifact(job_id, owner=owner)
+    if artifact is None:
+        return jsonify({'error': 'ダウンロードできる結果がありません'}), 404
+    path, filename, content_type = artifact
+    return send_file(path, mimetype=content_type, as_attachment=True, download_name=filename)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_admin_job(job_id):
+    """管理者のジョブの状態"""
+    return job_status_response(job_id, 'admin')
+
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def download_admin_job(job_id):
+    """管理者のジョブの結果ファイル"""
+    return job_download_response(job_id, 'admin')
+
+@app.route('/api/operator/jobs/<job_id>', methods=['GET'])
+@require_operator_auth
+def get_operator_job(job_id):
+    """運営者のジョブの状態"""
+    return job_status_response(job_id, 'operator')
+
+@app.route('/api/operator/jobs/<job_id>/download', methods=['GET'])
+@require_operator_auth
+def download_operator_job(job_id):
+    """運営者のジョブの結果ファイル"""
+    return job_download_response(job_id, 'operator')
+
 # ====================
 # 企業管理用APIエンドポイント
 # ====================
 
 # 企業管理用テーブルの初期化
-def init_company_tables():
-    """企業管理用テーブルの作成"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
+def init_company_tables(cursor):
+    """スキーマv2: 企業管理用テーブルの作成"""
     # 企業アカウントテーブル
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS company_accounts (
@@ -1071,18 +2047,466 @@ def init_company_tables():
     ''')
     
     # 初期企業アカウントは管理者が作成する
+
+def migrate_company_counters(cursor):
+    """スキーマv3: 企業別集計カウンタテーブルの作成と既存データからの初期化"""
+    # トークン→企業の逆引き用インデックス
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_company_tokens_token ON company_tokens (token)')
+    
+    # 企業別集計カウンタテーブル（一覧表示用に書き込み時に更新）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS company_counters (
+            company_id TEXT PRIMARY KEY,
+            active_urls INTEGER NOT NULL DEFAULT 0,
+            total_responses INTEGER NOT NULL DEFAULT 0,
+            last_response_at TIMESTAMP,
+            FOREIGN KEY (company_id) REFERENCES company_accounts (company_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_company_counters_responses ON company_counters (total_responses)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_company_counters_last_response ON company_counters (last_response_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_company_accounts_created ON company_accounts (created_at)')
     
-    conn.commit()
-    conn.close()
+    # 既存データからのカウンタ初期化
+    cursor.execute('''
+        INSERT OR REPLACE INTO company_counters (company_id, active_urls, total_responses, last_response_at)
+        SELECT 
+            ca.company_id,
+            (SELECT COUNT(*) FROM company_tokens ct
+             JOIN survey_tokens st ON ct.token = st.token
+             WHERE ct.company_id = ca.company_id AND st.is_active = 1),
+            (SELECT COUNT(*) FROM company_tokens ct
+             JOIN survey_responses sr ON sr.survey_token = ct.token
+             WHERE ct.company_id = ca.company_id),
+            (SELECT MAX(sr.created_at) FROM company_tokens ct
+             JOIN survey_responses sr ON sr.survey_token = ct.token
+             WHERE ct.company_id = ca.company_id)
+        FROM company_accounts ca
+    ''')
 
-# 企業管理用テーブル初期化実行
-try:
-    init_company_tables()
-    logger.info("企業管理用テーブルの初期化が完了しました")
-except Exception as e:
-    logger.error(f"企業管理用テーブル初期化エラー: {e}")
+def migrate_company_min_cell_size(cursor):
+    """スキーマv13: 企業毎の匿名性の閾値（NULLは CROSSTAB_MIN_CELL_SIZE）"""
+    cursor.execute('PRAGMA table_info(company_accounts)')
+    if 'min_cell_size' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE company_accounts ADD COLUMN min_cell_size INTEGER')
+
+def parse_min_cell_size(value):
+    """企業の匿名性の閾値の検証（None は既定値、CROSSTAB_MIN_CELL_SIZE 未満・不正な値はValueError）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or int(value) != value or not CROSSTAB_MIN_CELL_SIZE <= value <= 1000:
+        raise ValueError('invalid min_cell_size')
+    return int(value)
+
+def company_min_cell_size(session, company_id):
+    """企業の匿名性の閾値 k（企業毎の設定は CROSSTAB_MIN_CELL_SIZE より大きい値のみ有効）"""
+    if company_id is None:
+        return CROSSTAB_MIN_CELL_SIZE
+    row = session.fetchone('SELECT min_cell_size FROM company_accounts WHERE company_id = ?', (company_id,))
+    return max(CROSSTAB_MIN_CELL_SIZE, row[0] or 0) if row else CROSSTAB_MIN_CELL_SIZE
+
+@contextmanager
+def company_aggregator(company_id):
+    """企業向け分析APIの集計（閾値を適用する AnonymousAggregator、company_id が None の場合は全企業）"""
+    with analytics_session() as session:
+        yield AnonymousAggregator(session, company_id, company_min_cell_size(session, company_id))
+
+def get_token_company_id(cursor, token):
+    """トークンを所有する企業IDの取得（企業に紐付かない場合はNone）"""
+    return SQLiteStore.session(cursor).get_token_company_id(token)
+
+def adjust_company_counters(cursor, company_id, active_urls_delta=0, responses_delta=0):
+    """企業別カウンタの更新（呼び出し側のトランザクション内で実行）"""
+    SQLiteStore.session(cursor).adjust_company_counters(company_id, active_urls_delta, responses_delta)
+
+def deactivate_survey_token(cursor, token):
+    """調査URLトークンの無効化（存在しない場合はFalse）"""
+    session = SQLiteStore.session(cursor)
+    is_active = session.get_token_state(token)
+    if is_active is None:
+        return False
+    
+    if is_active:
+        session.deactivate_token(token)
+        
+        company_id = session.get_token_company_id(token)
+        if company_id:
+            session.adjust_company_counters(company_id, active_urls_delta=-1)
+        session.bump_data_version(company_id)
+    
+    return True
+
+# 企業一覧のソート可能カラム
+COMPANY_LIST_SORT_COLUMNS = {
+    'created_at': 'ca.created_at',
+    'company_id': 'ca.company_id',
+    'company_name': 'ca.company_name',
+    'active_urls': 'COALESCE(cc.active_urls, 0)',
+    'total_responses': 'COALESCE(cc.total_responses, 0)',
+    'last_response_at': 'cc.last_response_at'
+}
+
+def get_paging_params(default_per_page=None, max_per_page=200):
+    """ページング・ソート用クエリパラメータの取得
+    
+    per_page の指定がない場合は default_per_page（None は全件、ページングに未対応の画面のため）。
+    """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    
+    per_page = default_per_page
+    if request.args.get('per_page'):
+        try:
+            per_page = min(max(int(request.args['per_page']), 1), max_per_page)
+        except ValueError:
+            pass
+    if per_page is None:
+        page = 1
+    
+    sort = request.args.get('sort', 'created_at')
+    if sort not in COMPANY_LIST_SORT_COLUMNS:
+        sort = 'created_at'
+    
+    order = request.args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        order = 'desc'
+    
+    return page, per_page, sort, order
+
+def fetch_company_listing(cursor, page, per_page, sort, order):
+    """企業一覧の取得（集計カウンタを使用し表示件数分のみ読み込む）"""
+    cursor.execute('SELECT COUNT(*) FROM company_accounts')
+    total = cursor.fetchone()[0]
+    
+    sort_column = COMPANY_LIST_SORT_COLUMNS[sort]
+    cursor.execute(f'''
+        SELECT 
+            ca.company_id,
+            ca.company_name,
+            ca.access_key,
+            ca.max_urls,
+            ca.max_responses_per_url,
+            ca.is_active,
+            ca.created_at,
+            COALESCE(cc.active_urls, 0),
+            COALESCE(cc.total_responses, 0),
+            cc.last_response_at,
+            ca.min_cell_size
+        FROM company_accounts ca
+        LEFT JOIN company_counters cc ON ca.company_id = cc.company_id
+        ORDER BY {sort_column} {order.upper()}, ca.company_id
+        LIMIT ? OFFSET ?
+    ''', (per_page, (page - 1) * per_page) if per_page else (-1, 0))
+    
+    rows = cursor.fetchall()
+    pagination = {
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'sort': sort,
+        'order': order
+    }
+    return rows, pagination
+
+# ====================
+# スキーマ管理
+# ====================
+
+# スキーマバージョンと適用するマイグレーション（追加のみ・順序固定）
+SCHEMA_MIGRATIONS = [
+    (1, migrate_base_tables),
+    (2, init_company_tables),
+    (3, migrate_company_counters),
+    (4, migrate_data_versions),
+    (5, migrate_compact_responses),
+    (6, migrate_job_queue),
+    (7, migrate_crosstab_cells),
+    (8, migrate_score_buckets),
+    (9, migrate_driver_moments),
+    (10, migrate_list_indexes),
+    (11, migrate_free_text_company),
+    (12, migrate_response_company),
+    (13, migrate_company_min_cell_size),
+    (14, migrate_submission_keys),
+    (15, migrate_shard_outbox),
+    (16, migrate_submission_key_company)
+]
+
+# 企業別データベースのスキーマ（PRAGMA user_version で管理、追加のみ・順序固定）
+SHARD_MIGRATIONS = [
+    (1, create_response_tables),
+    (2, create_response_list_index),
+    (3, create_free_text_company_indexes),
+    (4, create_response_company_index)
+]
+
+catalog_store = SQLiteStore(DATABASE_PATH)
+
+response_router = ShardRouter(
+    DATABASE_PATH, SHARD_DIRECTORY, enabled=TENANT_SHARDING,
+    migrations=SHARD_MIGRATIONS, max_workers=SHARD_QUERY_WORKERS
+)
+
+analytics_reader = SnapshotReader(
+    DATABASE_PATH, mode=READ_SNAPSHOT_MODE, snapshot_path=READ_SNAPSHOT_PATH,
+    max_age=READ_SNAPSHOT_MAX_AGE, pool_size=READ_POOL_SIZE
+)
+
+report_engine = ReportEngine(REPORT_DIRECTORY, max_workers=REPORT_WORKERS, partition_rows=REPORT_PARTITION_ROWS)
+
+job_queue = JobQueue(
+    DATABASE_PATH, JOB_DIRECTORY, workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_HOURS * 3600
+)
+
+@contextmanager
+def analytics_session(path=DATABASE_PATH):
+    """集計・エクスポート用の読み取りセッション
+    
+    カタログは READ_SNAPSHOT_MODE に従い読み取り専用接続（WAL・スナップショット）から読む。
+    企業別データベースは企業毎に書き込みが分かれているため従来通り直接読む。
+    """
+    if path != DATABASE_PATH:
+        with SQLiteStore(path).read() as session:
+            yield session
+        return
+    with analytics_reader.connection() as conn:
+        yield SQLiteStore.session(conn.cursor())
+
+def count_all_responses(cursor):
+    """全体の回答数（企業別データベース有効時はカタログの回答数＋企業別カウンタの合計）"""
+    session = SQLiteStore.session(cursor)
+    total = session.count_responses()
+    if response_router.enabled:
+        total += session.sum_company_responses()
+    return total
+
+def merge_shard_rows(parts, key):
+    """データベース毎の結果を結合し、キーの降順に並べ替え"""
+    rows = [row for part in parts for row in part]
+    if len(parts) > 1:
+        rows.sort(key=lambda row: key(row) or '', reverse=True)
+    return rows
+
+def move_responses_to_shards():
+    """カタログに残っている企業の回答を企業別データベースへ移動（有効化時・起動時に実行）"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT company_id FROM survey_responses WHERE company_id IS NOT NULL')
+        company_ids = [row[0] for row in cursor.fetchall()]
+        
+        for company_id in company_ids:
+            response_router.connect(company_id).close()  # スキーマ作成
+            cursor.execute('ATTACH DATABASE ? AS shard', (response_router.shard_path(company_id),))
+            try:
+                company_responses = 'SELECT id FROM survey_responses WHERE company_id = ?'
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO shard.free_text_responses
+                    (response_id, question_type, question_label, response_text, character_count, response_time, company_id)
+                    SELECT response_id, question_type, question_label, response_text, character_count, response_time, company_id
+                    FROM main.free_text_responses WHERE response_id IN ({company_responses})
+                ''', (company_id,))
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO shard.survey_responses
+                    (id, submission_time, user_agent, page_load_time, response_data, survey_token, created_at, company_id)
+                    SELECT id, submission_time, user_agent, page_load_time, response_data, survey_token, created_at, company_id
+                    FROM main.survey_responses WHERE id IN ({company_responses})
+                ''', (company_id,))
+                moved = cursor.rowcount
+                cursor.execute(f'DELETE FROM main.free_text_responses WHERE response_id IN ({company_responses})', (company_id,))
+                cursor.execute(f'DELETE FROM main.survey_responses WHERE id IN ({company_responses})', (company_id,))
+                conn.commit()
+                logger.info(f"回答を企業別データベースへ移動しました: {company_id} ({moved}件)")
+            finally:
+                cursor.execute('DETACH DATABASE shard')
+    finally:
+        conn.close()
+
+# 企業別データベースへ1回に書き込む回答の件数
+SHARD_OUTBOX_BATCH_ROWS = 1000
+
+def flush_shard_outbox(company_id=None):
+    """カタログの shard_outbox に登録された回答を企業別データベースへ書き込む（戻り値は書き込んだ件数）
+    
+    回答はカウンタ・集計と同じカタログのトランザクションで登録されるため、カタログのコミットに失敗した回答が
+    企業別データベースにだけ残ることはない。保存・一括取り込みのコミット後にその企業の分を、起動時に全企業の分を
+    書き込む。失敗した場合も登録は残るため次の呼び出しで書き込む。挿入済みの回答は除くため
+    複数プロセスから同時に呼んでもよい。
+    """
+    if not response_router.enabled:
+        return 0
+    
+    flushed = 0
+    try:
+        while True:
+            with catalog_store.read() as session:
+                rows = session.pending_shard_responses(company_id, SHARD_OUTBOX_BATCH_ROWS)
+            if not rows:
+                break
+            
+            companies = {}
+            for row in rows:
+                companies.setdefault(row[RESPONSE_COLUMNS.index('company_id')], []).append(row)
+            # 削除済みの企業の回答は企業別データベースを作り直さずに登録のみ削除する
+            with catalog_store.read() as session:
+                known = {row_company_id for row_company_id in companies if session.company_exists(row_company_id)}
+            for row_company_id, company_rows in companies.items():
+                if row_company_id not in known:
+                    logger.warning(f"削除済みの企業の書き込み待ちの回答を破棄しました: {row_company_id} ({len(company_rows)}件)")
+                    continue
+                with response_router.transaction(row_company_id) as shard_cursor:
+                    SQLiteStore.session(shard_cursor).apply_shard_responses(company_rows)
+            with catalog_store.transaction() as session:
+                session.delete_shard_responses([row[0] for row in rows])
+            
+            flushed += len(rows)
+            if len(rows) < SHARD_OUTBOX_BATCH_ROWS:
+                break
+    except Exception as e:
+        logger.error(f"企業別データベースへの回答の書き込みに失敗しました: {str(e)}")
+    return flushed
+
+def get_schema_version(cursor):
+    """適用済みスキーマバージョンの取得"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+@contextmanager
+def migration_lock():
+    """マイグレーション用ファイルロック（複数ワーカーの同時実行を防止）"""
+    with open(DATABASE_PATH + '.migrate.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def init_database():
+    """データベースの初期化（未適用のマイグレーションのみ一度だけ実行）"""
+    latest_version = SCHEMA_MIGRATIONS[-1][0]
+    
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        cursor = conn.cursor()
+        if get_schema_version(cursor) >= latest_version:
+            return
+        conn.commit()
+        
+        with migration_lock():
+            # ロック取得中に他ワーカーが適用済みの場合は何もしない
+            current_version = get_schema_version(cursor)
+            for version, migrate in SCHEMA_MIGRATIONS:
+                if version <= current_version:
+                    continue
+                migrate(cursor)
+                cursor.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+                conn.commit()
+                logger.info(f"スキーマv{version}を適用しました: {migrate.__name__}")
+    finally:
+        conn.close()
+
+_database_ready = False
+_database_ready_lock = threading.Lock()
+
+def schema_is_current():
+    """適用済みスキーマが最新か（リクエスト処理前の確認用、読み取りのみ）"""
+    try:
+        conn = sqlite3.connect(DATABASE_PATH)
+        try:
+            version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return (version or 0) >= SCHEMA_MIGRATIONS[-1][0]
+
+def migrate_database():
+    """起動前のマイグレーション（gunicorn の on_starting・ASGI の lifespan・python3 server.py migrate で実行）
+    
+    スキーマ・既存の企業別データベースのマイグレーションと、企業別データベースへの回答の移動・
+    書き込み待ちの反映を行う。データ移行をリクエストの処理中（gunicorn の timeout の範囲内）に
+    実行しないよう、ワーカーの起動前に1回だけ実行する。
+    """
+    init_database()
+    if response_router.enabled:
+        with migration_lock():
+            response_router.prepare_all()
+            move_responses_to_shards()
+        flush_shard_outbox()
+    logger.info("データベースのマイグレーションが完了しました")
+
+def ensure_database_ready():
+    """リクエスト処理の準備（戻り値: 準備できたか）
+    
+    マイグレーションは起動前に migrate_database() で実行しておく。ここではスキーマが最新かのみを確認し、
+    未実行の場合はFalseを返す（実行後の最初のリクエストで準備する）。
+    """
+    global _database_ready
+    if _database_ready:
+        return True
+    
+    with _database_ready_lock:
+        if _database_ready:
+            return True
+        if not schema_is_current():
+            logger.error("データベースのマイグレーションが未実行です（python3 server.py migrate を実行してください）")
+            return False
+        try:
+            analytics_reader.prepare()
+            job_queue.start()
+            _database_ready = True
+            logger.info("データベースの準備が完了しました")
+        except Exception as e:
+            logger.error(f"データベース準備エラー: {e}")
+    return _database_ready
+
+def reset_after_fork():
+    """fork後のワーカーでプロセス内の状態を初期化（gunicornのpost_forkから呼び出し）"""
+    global _database_ready, _database_ready_lock, event_broker, version_watcher
+    _database_ready = False
+    _database_ready_lock = threading.Lock()
+    event_broker = EventBroker()
+    version_watcher = DataVersionWatcher(event_broker)
+    response_router.reset()
+    analytics_reader.reset()
+    report_engine.reset()
+    job_queue.reset()
+
+@app.before_request
+def prepare_database():
+    """リクエスト処理前のデータベース準備（マイグレーション未実行の場合、APIは503、静的ファイルはそのまま返す）"""
+    if not ensure_database_ready() and request.path.startswith('/api/'):
+        return jsonify({'error': 'データベースの準備ができていません'}), 503
 
 # 企業認証チェック
+def get_company_id_from_token(token):
+    """企業トークンから有効な企業IDを取得（無効な場合はNone）"""
+    # 簡易トークン検証（実際の運用では JWT などを使用）
+    if not token or not token.startswith('company_'):
+        return None
+    
+    # トークンから企業IDを取得（簡易実装）
+    try:
+        company_id = token.split('_')[1]
+    except IndexError:
+        return None
+    
+    # 企業の存在確認
+    with catalog_store.read() as session:
+        found = session.is_active_company(company_id)
+    
+    return company_id if found else None
+
 def require_company_auth(f):
     """企業認証が必要なエンドポイントのデコレータ"""
     @wraps(f)
@@ -1091,42 +2515,255 @@ def require_company_auth(f):
         if not auth_header or not auth_header.startswith('Bearer '):
             return jsonify({'error': '認証が必要です'}), 401
         
-        token = auth_header.split(' ')[1]
-        
-        # 簡易トークン検証（実際の運用では JWT などを使用）
-        if not token.startswith('company_'):
+        company_id = get_company_id_from_token(auth_header.split(' ')[1])
+        if not company_id:
             return jsonify({'error': '無効な認証トークンです'}), 401
         
-        # トークンから企業IDを取得（簡易実装）
-        try:
-            company_id = token.split('_')[1]
-            # 企業の存在確認
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-            cursor.execute('SELECT company_id FROM company_accounts WHERE company_id = ? AND is_active = 1', (company_id,))
-            if not cursor.fetchone():
-                conn.close()
-                return jsonify({'error': '無効な認証トークンです'}), 401
-            conn.close()
-            
-            # リクエストに企業IDを追加
-            request.company_id = company_id
-            
-        except (IndexError, ValueError):
-            return jsonify({'error': '無効な認証トークンです'}), 401
+        # リクエストに企業IDを追加
+        request.company_id = company_id
         
         return f(*args, **kwargs)
     return decorated_function
 
+# ====================
+# リアルタイム配信（Server-Sent Events）
+# ====================
+
+# ハートビート間隔・1接続の最大継続時間（秒）・WSGIでの同時接続上限・接続用チケットの有効期間（秒）
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', 300))
+STREAM_MAX_CLIENTS = int(os.environ.get('STREAM_MAX_CLIENTS', 32))
+STREAM_TICKET_SECONDS = 60
+
+# WSGIでは1接続が1スレッドを占有するため、プロセス毎の接続数はワーカーのスレッド数
+# （gunicorn.conf.py と同じ GUNICORN_THREADS）から API用に残すスレッド数（1以上）を除いた数までとする
+WSGI_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+STREAM_RESERVED_THREADS = max(int(os.environ.get('STREAM_RESERVED_THREADS', 2)), 1)
+STREAM_WSGI_MAX_CLIENTS = max(min(STREAM_MAX_CLIENTS, WSGI_THREADS - STREAM_RESERVED_THREADS), 0)
+# 上限到達時に再接続を待つよう返す秒数（Retry-After）
+STREAM_RETRY_AFTER_SECONDS = 30
+
+# 他プロセスでの書き込みを検知する間隔（秒）
+VERSION_WATCH_INTERVAL = 2
+
+class DataVersionWatcher:
+    """データバージョンを監視し、他ワーカーでの更新を購読中チャンネルへ通知する
+    
+    プロセス毎に1スレッドのみが data_versions を参照するため、
+    ダッシュボードの接続数に関わらずポーリングは1本で済む
+    """
+    
+    def __init__(self, broker, interval=VERSION_WATCH_INTERVAL):
+        self.broker = broker
+        self.interval = interval
+        self.known = {}
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def mark_seen(self, scope, version):
+        """配信済み（または接続時点）のバージョンを記録"""
+        with self.lock:
+            if version > self.known.get(scope, -1):
+                self.known[scope] = version
+    
+    def ensure_started(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='data-version-watcher', daemon=True)
+                self.thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            channels = self.broker.channels()
+            if not channels:
+                continue
+            try:
+                with catalog_store.read() as session:
+                    versions = session.get_data_versions(channels)
+            except Exception as e:
+                logger.error(f"データバージョンの監視に失敗しました: {str(e)}")
+                continue
+            
+            for scope, version in versions.items():
+                with self.lock:
+                    changed = version > self.known.get(scope, -1)
+                    if changed:
+                        self.known[scope] = version
+                if changed:
+                    self.broker.publish(scope, 'invalidate', {'version': version})
+
+event_broker = EventBroker()
+version_watcher = DataVersionWatcher(event_broker)
+
+# WSGIでのSSE接続の枠（プロセス毎）
+stream_slots = threading.BoundedSemaphore(STREAM_WSGI_MAX_CLIENTS)
+
+def stream_channel(company_id=None):
+    """配信チャンネル名（data_versions のスコープと同じ）"""
+    return f'company:{company_id}' if company_id else 'global'
+
+def resolve_stream_channel(role, token):
+    """ロールとトークンから購読チャンネルを決定（認証失敗時は (None, None)）"""
+    if role == 'operator' and is_valid_operator_token(token):
+        return stream_channel(), None
+    if role == 'company':
+        company_id = get_company_id_from_token(token)
+        if company_id:
+            return stream_channel(company_id), company_id
+    return None, None
+
+def prepare_stream(channel, company_id):
+    """購読開始時点のバージョンを記録し、監視スレッドを起動"""
+    version = get_data_version(company_id)
+    version_watcher.mark_seen(channel, version)
+    version_watcher.ensure_started()
+    return version
+
+def publish_submission_event(data):
+    """回答保存後の差分イベント配信（購読者がいない場合は何もしない）
+    
+    個々の回答の内容（点数・自由記述・回答ID）は配信せず、回答数の増分とデータバージョンのみを送る。
+    ダッシュボードは通知を受けて匿名性の閾値を適用した集計APIを再取得する。
+    """
+    if not event_broker.has_subscribers():
+        return
+    
+    try:
+        with catalog_store.read() as session:
+            company_id = None
+            counters = None
+            survey_token = data.get('survey_token')
+            if survey_token:
+                company_id = session.get_token_company_id(survey_token)
+            if company_id:
+                counters = session.get_company_counters(company_id)
+            
+            scopes = [stream_channel()] + ([stream_channel(company_id)] if company_id else [])
+            versions = session.get_data_versions(scopes)
+    except Exception as e:
+        logger.error(f"配信イベントの作成に失敗しました: {str(e)}")
+        return
+    
+    # 運営者向け: 回答数の増分
+    version_watcher.mark_seen(stream_channel(), versions.get(stream_channel(), 0))
+    event_broker.publish(stream_channel(), 'response', {
+        'new_responses': 1,
+        'company_id': company_id,
+        'version': versions.get(stream_channel(), 0)
+    })
+    
+    # 企業向け: 最新のカウンタ
+    if company_id:
+        channel = stream_channel(company_id)
+        version_watcher.mark_seen(channel, versions.get(channel, 0))
+        event_broker.publish(channel, 'response', {
+            'new_responses': 1,
+            'total_responses': counters[1] if counters else None,
+            'active_urls': counters[0] if counters else None,
+            'version': versions.get(channel, 0)
+        })
+
+# 配信用チケットの署名（用途毎の salt で他の署名と区別）
+stream_ticket_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='stream-ticket')
+
+def issue_stream_ticket(role, token):
+    """購読用の短期チケットの発行（認証失敗時はNone）
+    
+    EventSource はヘッダーを送れないため、アクセストークンの代わりにチケットをURLに付けて接続する。
+    チケットは購読チャンネルのみを含み、発行から STREAM_TICKET_SECONDS 秒以内の接続開始にのみ使える
+    （アクセスログにURLが残ってもAPIの認証には使えない）。
+    """
+    channel, company_id = resolve_stream_channel(role, token)
+    if not channel:
+        return None
+    return stream_ticket_serializer.dumps([channel, company_id])
+
+def resolve_stream_ticket(ticket):
+    """チケットから購読チャンネルを取得（無効・期限切れの場合は (None, None)）"""
+    if not ticket:
+        return None, None
+    try:
+        channel, company_id = stream_ticket_serializer.loads(ticket, max_age=STREAM_TICKET_SECONDS)
+    except (BadSignature, TypeError, ValueError):
+        return None, None
+    return channel, company_id
+
+def resolve_stream_request(role, auth_header, ticket):
+    """Authorizationヘッダー（EventSource以外のクライアント）またはチケットから購読チャンネルを決定"""
+    if auth_header and auth_header.startswith('Bearer '):
+        return resolve_stream_channel(role, auth_header.split(' ')[1])
+    return resolve_stream_ticket(ticket)
+
+@app.route('/api/stream/ticket', methods=['POST'])
+def create_stream_ticket():
+    """リアルタイム配信の接続用チケットの発行（Authorizationヘッダーで認証）"""
+    auth_header = request.headers.get('Authorization') or ''
+    token = auth_header.split(' ')[1] if auth_header.startswith('Bearer ') else None
+    role = (request.get_json(silent=True) or {}).get('role', 'operator')
+    ticket = issue_stream_ticket(role, token)
+    if ticket is None:
+        return jsonify({'error': '認証が必要です'}), 401
+    return jsonify({'success': True, 'ticket': ticket, 'expires_in': STREAM_TICKET_SECONDS})
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """ダッシュボード向けリアルタイム配信（Server-Sent Events）"""
+    try:
+        channel, company_id = resolve_stream_request(
+            request.args.get('role', 'operator'), request.headers.get('Authorization'), request.args.get('ticket')
+        )
+        if not channel:
+            return jsonify({'error': '認証が必要です'}), 401
+        
+        # WSGIでは1接続が1スレッドを占有するため、API用のスレッドを残して接続数を制限
+        if not stream_slots.acquire(blocking=False):
+            return jsonify({'error': '同時接続数の上限に達しています'}), 503, {
+                'Retry-After': str(STREAM_RETRY_AFTER_SECONDS)
+            }
+        
+        try:
+            version = prepare_stream(channel, company_id)
+            subscription = event_broker.subscribe(Subscription([channel]))
+        except Exception:
+            stream_slots.release()
+            raise
+        
+    except Exception as e:
+        logger.error(f"リアルタイム配信の開始に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+    
+    def generate():
+        try:
+            yield b'retry: 5000\n\n'
+            yield format_sse('ready', {'version': version})
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                message = subscription.get(min(STREAM_HEARTBEAT_SECONDS, remaining))
+                yield message if message else b': keepalive\n\n'
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # 接続の終了時（WSGIサーバーがレスポンスを閉じた時）に枠を返す
+    response.call_on_close(stream_slots.release)
+    return response
+
 @app.route('/company-login.html')
 def company_login():
     """企業ログインページ"""
-    return send_from_directory('.', 'company-login.html')
+    return serve_static_file('company-login.html')
 
 @app.route('/company-dashboard.html')
 def company_dashboard():
     """企業ダッシュボードページ"""
-    return send_from_directory('.', 'company-dashboard.html')
+    return serve_static_file('company-dashboard.html')
 
 @app.route('/api/company/login', methods=['POST'])
 def company_login_api():
@@ -1143,16 +2780,8 @@ def company_login_api():
         if not company_id or not access_key:
             return jsonify({'error': '企業IDとアクセスキーが必要です'}), 400
         
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT company_id, company_name FROM company_accounts 
-            WHERE company_id = ? AND access_key = ? AND is_active = 1
-        ''', (company_id, access_key))
-        
-        company = cursor.fetchone()
-        conn.close()
+        with catalog_store.read() as session:
+            company = session.authenticate_company(company_id, access_key)
         
         if not company:
             return jsonify({'error': 'ログイン情報が正しくありません'}), 401
@@ -1173,43 +2802,30 @@ def company_login_api():
 
 @app.route('/api/company/summary', methods=['GET'])
 @require_company_auth
+@versioned_json(tenant_scoped=True, snapshot=True)
 def get_company_summary():
-    """企業管理用サマリーデータ取得"""
+    """企業管理用サマリーデータ取得（満足度は匿名性の閾値を適用して集計）"""
     try:
         company_id = request.company_id
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 企業のURL数取得
-        cursor.execute('''
-            SELECT COUNT(*) FROM company_tokens ct
-            JOIN survey_tokens st ON ct.token = st.token
-            WHERE ct.company_id = ? AND st.is_active = 1
-        ''', (company_id,))
-        total_urls = cursor.fetchone()[0]
-        
-        # 企業の総回答数取得
-        cursor.execute('''
-            SELECT SUM(st.current_responses) FROM company_tokens ct
-            JOIN survey_tokens st ON ct.token = st.token
-            WHERE ct.company_id = ?
-        ''', (company_id,))
-        result = cursor.fetchone()
-        total_responses = result[0] if result[0] else 0
-        
-        # 平均満足度計算（サンプル）
-        avg_satisfaction = 3.7  # 実際の計算は省略
-        
-        # 完了率計算（サンプル）
-        completion_rate = 78.5  # 実際の計算は省略
-        
-        conn.close()
+        with company_aggregator(company_id) as aggregator:
+            # 企業のURL数・総回答数・回答枠（回答上限の合計）
+            total_urls, total_responses, total_quota = aggregator.session.fetchone('''
+                SELECT COALESCE(SUM(st.is_active), 0), COALESCE(SUM(st.current_responses), 0),
+                       COALESCE(SUM(st.max_responses), 0)
+                FROM company_tokens ct
+                JOIN survey_tokens st ON ct.token = st.token
+                WHERE ct.company_id = ?
+            ''', (company_id,))
+            
+            # 平均満足度（5段階評価の全項目、回答者数が閾値未満の場合はNone）
+            overall = aggregator.pooled_means((), SATISFACTION_QUESTIONS)
         
         return jsonify({
             'totalUrls': total_urls,
             'totalResponses': total_responses,
-            'avgSatisfaction': avg_satisfaction,
-            'completionRate': completion_rate
+            'avgSatisfaction': overall[0]['mean'] if overall else None,
+            'completionRate': round(total_responses / total_quota * 100, 1) if total_quota else None,
+            'minCellSize': aggregator.min_cell_size
         })
         
     except Exception as e:
@@ -1218,24 +2834,16 @@ def get_company_summary():
 
 @app.route('/api/company/urls', methods=['GET'])
 @require_company_auth
+@versioned_json(tenant_scoped=True)
 def get_company_urls():
     """企業の調査URL一覧取得"""
-    try:
-        company_id = request.company_id
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT st.token, st.created_at, st.expires_at, st.max_responses, 
-                   st.current_responses, st.is_active, st.description
-            FROM company_tokens ct
-            JOIN survey_tokens st ON ct.token = st.token
-            WHERE ct.company_id = ?
-            ORDER BY st.created_at DESC
-        ''', (company_id,))
+    try:
+        company_id = request.company_id
+        with catalog_store.read() as session:
+            rows = session.list_company_tokens(company_id)
         
         urls = []
-        for row in cursor.fetchall():
+        for row in rows:
             urls.append({
                 'token': row[0],
                 'created_at': row[1],
@@ -1246,8 +2854,6 @@ def get_company_urls():
                 'description': row[6]
             })
         
-        conn.close()
-        
         return jsonify({
             'success': True,
             'urls': urls
@@ -1272,10 +2878,70 @@ def create_company_url():
         max_responses = data.get('max_responses', 50)
         expires_hours = data.get('expires_hours', 720)
         
-        # 企業の制限確認
+        with catalog_store.transaction() as session:
+            # 企業の制限確認
+            limits = session.get_company_limits(company_id)
+            if not limits:
+                return jsonify({'error': '企業情報が見つかりません'}), 404
+            
+            max_urls, max_responses_per_url = limits
+            
+            # 現在のURL数確認
+            counters = session.get_company_counters(company_id)
+            current_url_count = counters[0] if counters else 0
+            
+            if current_url_count >= max_urls:
+                return jsonify({'error': f'URL作成数の上限（{max_urls}個）に達しています'}), 400
+            
+            if max_responses > max_responses_per_url:
+                max_responses = max_responses_per_url
+            
+            # トークン生成
+            token = secrets.token_urlsafe(32)
+            
+            # 有効期限計算
+            expires_at = datetime.now() + timedelta(hours=expires_hours)
+            
+            # survey_tokens に挿入し company_tokens で企業に関連付け
+            session.create_tokens([(token, expires_at.isoformat(), max_responses, description)], company_id)
+            session.adjust_company_counters(company_id, active_urls_delta=1)
+            session.bump_data_version(company_id)
+        
+        survey_url = f"/survey/{token}"
+        
+        return jsonify({
+            'success': True,
+            'token': token,
+            'survey_url': survey_url,
+            'max_responses': max_responses,
+            'expires_at': expires_at.isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"企業URL作成エラー: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+@app.route('/api/company/urls/bulk', methods=['POST'])
+@require_company_auth
+def create_company_urls_bulk():
+    """企業用調査URL一括作成（部署別・従業員別URLの一括発行）"""
+    try:
+        company_id = request.company_id
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': '無効なデータです'}), 400
+        
+        descriptions, max_responses, expires_hours, error_message = parse_bulk_url_request(data, 50, 720)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
         conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
         
+        # 上限確認から挿入までを1トランザクションで実行（同時実行による上限超過を防止）
+        cursor.execute('BEGIN IMMEDIATE')
+        
         cursor.execute('''
             SELECT max_urls, max_responses_per_url FROM company_accounts 
             WHERE company_id = ?
@@ -1288,55 +2954,36 @@ def create_company_url():
         
         max_urls, max_responses_per_url = limits
         
-        # 現在のURL数確認
+        # 現在のURL数確認（上限チェックは一括で1回のみ）
         cursor.execute('''
-            SELECT COUNT(*) FROM company_tokens ct
-            JOIN survey_tokens st ON ct.token = st.token
-            WHERE ct.company_id = ? AND st.is_active = 1
+            SELECT active_urls FROM company_counters WHERE company_id = ?
         ''', (company_id,))
-        current_url_count = cursor.fetchone()[0]
+        row = cursor.fetchone()
+        current_url_count = row[0] if row else 0
         
-        if current_url_count >= max_urls:
+        if current_url_count + len(descriptions) > max_urls:
             conn.close()
-            return jsonify({'error': f'URL作成数の上限（{max_urls}個）に達しています'}), 400
+            remaining = max(max_urls - current_url_count, 0)
+            return jsonify({'error': f'URL作成数の上限（{max_urls}個）を超えます（残り{remaining}個）'}), 400
         
         if max_responses > max_responses_per_url:
             max_responses = max_responses_per_url
         
-        # トークン生成
-        token = secrets.token_urlsafe(32)
-        
-        # 有効期限計算
-        from datetime import datetime, timedelta
         expires_at = datetime.now() + timedelta(hours=expires_hours)
         
-        # survey_tokensテーブルに挿入
-        cursor.execute('''
-            INSERT INTO survey_tokens (token, expires_at, max_responses, description)
-            VALUES (?, ?, ?, ?)
-        ''', (token, expires_at.isoformat(), max_responses, description))
-        
-        # company_tokensテーブルに関連付け
-        cursor.execute('''
-            INSERT INTO company_tokens (company_id, token)
-            VALUES (?, ?)
-        ''', (company_id, token))
+        rows = insert_survey_tokens(cursor, descriptions, max_responses, expires_at, company_id)
+        adjust_company_counters(cursor, company_id, active_urls_delta=len(rows))
+        bump_data_version(cursor, company_id)
         
         conn.commit()
         conn.close()
         
-        survey_url = f"/survey/{token}"
+        logger.info(f"企業用調査URLを一括作成しました: {company_id} ({len(rows)}件)")
         
-        return jsonify({
-            'success': True,
-            'token': token,
-            'survey_url': survey_url,
-            'max_responses': max_responses,
-            'expires_at': expires_at.isoformat()
-        })
+        return bulk_urls_response(rows, get_bulk_output_format(data))
         
     except Exception as e:
-        logger.error(f"企業URL作成エラー: {str(e)}")
+        logger.error(f"企業URL一括作成エラー: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
 @app.route('/api/company/urls/<token>', methods=['DELETE'])
@@ -1360,11 +3007,7 @@ def disable_company_url(token):
             return jsonify({'error': 'URLが見つかりません'}), 404
         
         # URL無効化
-        cursor.execute('''
-            UPDATE survey_tokens SET is_active = 0 WHERE token = ?
-        ''', (token,))
-        
-        if cursor.rowcount == 0:
+        if not deactivate_survey_token(cursor, token):
             conn.close()
             return jsonify({'error': 'URLの無効化に失敗しました'}), 400
         
@@ -1379,90 +3022,632 @@ def disable_company_url(token):
 
 @app.route('/api/company/analytics', methods=['GET'])
 @require_company_auth
+@versioned_json(tenant_scoped=True, snapshot=True)
 def get_company_analytics():
-    """企業用分析データ取得"""
+    """企業用分析データ取得（満足度分布と部署×役職別の回答状況、匿名性の閾値を適用）"""
+    try:
+        with company_aggregator(request.company_id) as aggregator:
+            distribution = aggregator.score_distribution(SATISFACTION_QUESTIONS)
+            segments = aggregator.pooled_means(('department', 'position'), SATISFACTION_QUESTIONS)
+        
+        return jsonify({
+            # 「とても満足」（5点）から順、閾値未満の点数はNone
+            'satisfactionDistribution': [distribution.get(score) for score in range(5, 0, -1)] if distribution else [],
+            'segments': segments,
+            'minCellSize': aggregator.min_cell_size
+        })
+        
+    except Exception as e:
+        logger.error(f"企業分析データ取得エラー: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+def parse_crosstab_query():
+    """クロス集計のクエリ（group_by・部署/役職の絞り込み・設問）の解析（不正な値はValueError）"""
+    group_by = parse_dimensions(request.args.get('group_by', 'department'))
+    filters = {name: request.args[name] for name in CROSSTAB_DIMENSIONS if name in request.args}
+    questions = [name for name in request.args.get('questions', '').split(',') if name]
+    if any(name not in RESPONSE_SCORE_MAPS for name in questions):
+        raise ValueError('unknown question')
+    return group_by, filters, questions
+
+def query_crosstab(company_id, group_by, filters=None, questions=None):
+    """クロス集計セルからの集計（company_id が None の場合は全企業、小セルは秘匿）"""
+    with company_aggregator(company_id) as aggregator:
+        return aggregator.crosstab(group_by, filters, questions)
+
+@app.route('/api/company/crosstab', methods=['GET'])
+@require_company_auth
+@versioned_json(tenant_scoped=True, snapshot=True)
+def get_company_crosstab():
+    """部署×役職×設問のクロス集計
+    
+    ?group_by=department,position（空でロールアップ）、?department= ?position= で絞り込み（ドリルダウン）、
+    ?questions= で設問を指定（カンマ区切り、省略時は全設問）
+    """
+    try:
+        try:
+            group_by, filters, questions = parse_crosstab_query()
+        except ValueError:
+            return jsonify({'error': '無効な集計条件です'}), 400
+        
+        with company_aggregator(request.company_id) as aggregator:
+            groups = aggregator.crosstab(group_by, filters, questions)
+        
+        return jsonify({
+            'success': True,
+            'group_by': list(group_by),
+            'filters': filters,
+            'min_cell_size': aggregator.min_cell_size,
+            'groups': groups
+        })
+        
+    except Exception as e:
+        logger.error(f"クロス集計の取得に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+# 期間比較で返す期間数の上限
+TREND_MAX_PERIODS = 36
+
+def build_trends(rows, questions, confidence, min_cell_size=CROSSTAB_MIN_CELL_SIZE):
+    """期間別の度数分布から設問毎の平均・NPSの信頼区間と前期間との差の検定
+
+    rows: (期間, 設問, 点数, 件数)（StorageSession.fetch_score_buckets の戻り値）
+    回答数が min_cell_size 未満の期間は秘匿し、比較の対象にもしない。
+    """
+    buckets = {}
+    for period, question, score, count in rows:
+        buckets.setdefault(question, {}).setdefault(period, {})[score] = count
+    periods = sorted({period for by_period in buckets.values() for period in by_period})
+    
+    def series(question, summarize, compare):
+        result = []
+        previous = None
+        for period in periods:
+            period_buckets = buckets.get(question, {}).get(period, {})
+            if sum(period_buckets.values()) < min_cell_size:
+                result.append({'period': period, 'suppressed': True})
+                continue
+            entry = {'period': period, 'suppressed': False, **summarize(period_buckets)}
+            entry['change'] = compare(period_buckets, previous) if previous is not None else None
+            previous = period_buckets
+            result.append(entry)
+        return result
+    
+    return periods, {
+        'questions': {
+            question: series(
+                question,
+                lambda period_buckets: mean_interval(*moments_from_buckets(period_buckets), confidence),
+                lambda current, previous: compare_means(moments_from_buckets(current), moments_from_buckets(previous))
+            )
+            for question in questions
+        },
+        'nps': series(
+            'recommendation',
+            lambda period_buckets: nps_interval(period_buckets, confidence),
+            compare_nps
+        )
+    }
+
+@app.route('/api/company/trends', methods=['GET'])
+@require_company_auth
+@versioned_json(tenant_scoped=True, snapshot=True)
+def get_company_trends():
+    """月別の平均・NPSの信頼区間と前月との差の検定
+    
+    ?questions=（カンマ区切り、省略時は0〜10点の設問）、?periods=（直近の月数、既定12）、?confidence=（既定0.95）
+    """
+    try:
+        try:
+            questions = [name for name in request.args.get('questions', '').split(',') if name] or SCALE_FIELDS
+            if any(name not in RESPONSE_SCORE_MAPS for name in questions):
+                raise ValueError('unknown question')
+            period_count = int(request.args.get('periods', 12))
+            confidence = float(request.args.get('confidence', DEFAULT_CONFIDENCE))
+            if not 1 <= period_count <= TREND_MAX_PERIODS or not 0.5 <= confidence < 1:
+                raise ValueError('out of range')
+        except ValueError:
+            return jsonify({'error': '無効な集計条件です'}), 400
+        
+        today = datetime.utcnow()
+        month_index = today.year * 12 + today.month - 1 - (period_count - 1)
+        since = f'{month_index // 12:04d}-{month_index % 12 + 1:02d}'
+        with company_aggregator(request.company_id) as aggregator:
+            rows = aggregator.session.fetch_score_buckets(
+                request.company_id, list(dict.fromkeys(list(questions) + ['recommendation'])), since
+            )
+        periods, trends = build_trends(rows, questions, confidence, aggregator.min_cell_size)
+        
+        return jsonify({
+            'success': True,
+            'confidence': confidence,
+            'min_cell_size': aggregator.min_cell_size,
+            'periods': periods,
+            **trends
+        })
+        
+    except Exception as e:
+        logger.error(f"期間比較の取得に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+@app.route('/api/company/drivers', methods=['GET'])
+@require_company_auth
+@versioned_json(tenant_scoped=True, snapshot=True)
+def get_company_drivers():
+    """キードライバー分析（?target=overall_satisfaction|retention_intention|nps、省略時は全て）
+    
+    各項目の満足度と目的変数の相関・重回帰の標準化係数、重要度×満足度の象限と期待度との差を返す
+    """
     try:
+        targets = [name for name in request.args.get('target', '').split(',') if name] or list(DRIVER_TARGETS)
+        if any(name not in DRIVER_TARGETS for name in targets):
+            return jsonify({'error': '無効な目的変数です'}), 400
+        
         company_id = request.company_id
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
+        satisfaction_fields = DRIVER_VARIABLES[:-len(DRIVER_TARGETS)]
+        expectation_fields = [field[:-len('_satisfaction')] + '_expectation' for field in satisfaction_fields]
+        with company_aggregator(company_id) as aggregator:
+            min_cell_size = aggregator.min_cell_size
+            stored = aggregator.session.get_driver_moments(company_id)
+            cells = aggregator.session.fetch_crosstab(
+                company_id, (), questions=satisfaction_fields + expectation_fields, min_count=min_cell_size
+            )
         
-        # 企業の回答データから満足度分布を計算（サンプル）
-        satisfaction_distribution = [5, 8, 3, 2, 1]  # 実際は計算が必要
+        moments = None
+        if stored is not None and stored[0] == DRIVER_VARIABLES_KEY:
+            moments = decode_moments(*stored[1:])
         
-        # 最近の回答データ（サンプル）
-        recent_responses = [
-            {
-                'timestamp': datetime.now().isoformat(),
-                'satisfaction': 4,
-                'department': '営業部',
-                'position': '主任'
-            },
-            {
-                'timestamp': (datetime.now() - timedelta(hours=2)).isoformat(),
-                'satisfaction': 3,
-                'department': '開発部',
-                'position': '一般社員'
-            }
-        ]
+        # 満足度・期待度の平均は全回答から（相関・回帰は全変数に回答した回答のみ）
+        means = {question: total / count for question, count, total, _ in cells if count}
+        performance = {
+            field: (means[field], means.get(expectation))
+            for field, expectation in zip(satisfaction_fields, expectation_fields) if field in means
+        }
         
-        conn.close()
+        analyses = {
+            target: analyze_drivers(moments, DRIVER_VARIABLES, target, performance, min_cell_size)
+            for target in targets
+        }
+        return jsonify({
+            'success': True,
+            'min_cell_size': min_cell_size,
+            'n': moments[0] if moments is not None and moments[0] >= min_cell_size else None,
+            'analyses': analyses
+        })
+        
+    except Exception as e:
+        logger.error(f"キードライバー分析に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+# 企業用の自由記述回答一覧の本文の先頭の文字数・1ページの件数
+FREE_TEXT_PREVIEW_CHARS = 200
+FREE_TEXT_PAGE_SIZE = 50
+FREE_TEXT_MAX_PAGE_SIZE = 200
+
+def encode_page_cursor(values):
+    """キーセットのページ送りの続きの位置（前ページ末尾の行のキー）を文字列に変換"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_page_cursor(cursor, size):
+    """encode_page_cursor の逆変換（不正な値はValueError）"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (UnicodeError, binascii.Error, json.JSONDecodeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('invalid cursor')
+    return values
+
+def parse_free_text_query():
+    """自由記述回答の絞り込み条件（?question_type= ?since= ?until=（YYYY-MM-DD、until を含む））の解析"""
+    question_type = request.args.get('question_type') or None
+    if question_type is not None and question_type not in FREE_TEXT_FIELDS:
+        raise ValueError('unknown question type')
+    since = until = None
+    if request.args.get('since'):
+        since = datetime.strptime(request.args['since'], '%Y-%m-%d').strftime('%Y-%m-%d')
+    if request.args.get('until'):
+        until = (datetime.strptime(request.args['until'], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    return question_type, since, until
+
+def company_response_path(company_id):
+    """企業の回答・自由記述回答を保持するデータベース"""
+    return company_report_sources(company_id)[0][0]
+
+@app.route('/api/company/free-text', methods=['GET'])
+@require_company_auth
+@versioned_json(tenant_scoped=True, snapshot=True)
+def get_company_free_text():
+    """自社の自由記述回答の一覧（新しい順）
+    
+    ?question_type= ?since= ?until= で絞り込み、?limit=（既定50）件ずつ返す。続きは next_cursor を ?cursor= に指定。
+    本文は先頭 FREE_TEXT_PREVIEW_CHARS 文字のみ返し、全文は /api/company/free-text/<id> で取得する。
+    1ページ目（cursor なし）には絞り込み条件での設問別の件数・文字数を含める。
+    """
+    try:
+        try:
+            question_type, since, until = parse_free_text_query()
+            limit = int(request.args.get('limit', FREE_TEXT_PAGE_SIZE))
+            if not 1 <= limit <= FREE_TEXT_MAX_PAGE_SIZE:
+                raise ValueError('out of range')
+            before = decode_page_cursor(request.args['cursor'], 2) if request.args.get('cursor') else None
+        except ValueError:
+            return jsonify({'error': '無効な検索条件です'}), 400
+        
+        company_id = request.company_id
+        with analytics_session(company_response_path(company_id)) as session:
+            rows = session.list_company_free_text(
+                company_id, since, until, question_type, before, limit + 1, FREE_TEXT_PREVIEW_CHARS
+            )
+            stats_rows = None
+            if before is None:
+                stats_rows = session.company_free_text_statistics(company_id, since, until, question_type)
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        result = {
+            'success': True,
+            'items': [{
+                'id': text_id,
+                'question_type': row_question_type,
+                'question': FREE_TEXT_FIELDS.get(row_question_type),
+                'preview': preview,
+                'length': length,
+                'truncated': (length or 0) > FREE_TEXT_PREVIEW_CHARS,
+                'time': str(response_time)
+            } for text_id, row_question_type, preview, length, response_time in rows],
+            'next_cursor': encode_page_cursor([str(rows[-1][4]), rows[-1][0]]) if has_more else None
+        }
+        if stats_rows is not None:
+            result['statistics'] = [{
+                'question_type': row_question_type,
+                'question_label': FREE_TEXT_FIELDS.get(row_question_type),
+                'response_count': count,
+                'avg_length': round(total_length / count, 1) if total_length else 0,
+                'min_length': min_length,
+                'max_length': max_length
+            } for row_question_type, count, total_length, min_length, max_length
+                in sorted(stats_rows, key=lambda row: row[1], reverse=True)]
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"自由記述回答一覧の取得に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+@app.route('/api/company/free-text/<int:text_id>', methods=['GET'])
+@require_company_auth
+def get_company_free_text_detail(text_id):
+    """自社の自由記述回答1件の全文"""
+    try:
+        company_id = request.company_id
+        with SQLiteStore(company_response_path(company_id)).read() as session:
+            row = session.get_company_free_text(company_id, text_id)
+        if row is None:
+            return jsonify({'error': '回答が見つかりません'}), 404
         
         return jsonify({
-            'satisfactionDistribution': satisfaction_distribution,
-            'recentResponses': recent_responses
+            'success': True,
+            'id': row[0],
+            'question_type': row[1],
+            'question': row[2],
+            'text': row[3],
+            'length': row[4],
+            'time': str(row[5])
         })
         
     except Exception as e:
-        logger.error(f"企業分析データ取得エラー: {str(e)}")
+        logger.error(f"自由記述回答の取得に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+def company_report_sources(company_id):
+    """企業の回答を保持するデータベースと絞り込み条件（企業別データベースは全件が自社の回答）"""
+    if response_router.is_sharded(company_id):
+        response_router.connect(company_id).close()  # 未作成のシャードを初期化
+        return [(response_router.shard_path(company_id), None)]
+    return [(DATABASE_PATH, company_id)]
+
+@app.route('/api/company/reports', methods=['POST'])
+@require_company_auth
+def create_company_report():
+    """全設問の集計レポートの作成開始（同じデータのレポートは作成済みの結果を返す）"""
+    try:
+        company_id = request.company_id
+        with company_aggregator(company_id) as aggregator:
+            min_cell_size = aggregator.min_cell_size
+        params = {'company_id': company_id, 'version': get_data_version(company_id), 'min_cell_size': min_cell_size}
+        job = job_queue.submit('company_report', params, owner=f'company:{company_id}', reuse=True)
+        return jsonify({'success': True, 'job': job}), 200 if job['status'] == 'completed' else 202
+        
+    except Exception as e:
+        logger.error(f"レポート作成の開始に失敗しました: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+@app.route('/api/company/reports/<job_id>', methods=['GET'])
+@require_company_auth
+def get_company_report(job_id):
+    """レポート作成の進捗（完了時はレポート本体を含む）"""
+    try:
+        company_id = request.company_id
+        job = job_queue.get(job_id, owner=f'company:{company_id}')
+        if job is None or job['kind'] != 'company_report':
+            return jsonify({'error': 'レポートが見つかりません'}), 404
+        
+        result = {'success': True, 'job': job}
+        if job['status'] == 'completed':
+            result['report'] = report_engine.load_result(job['result']['report_key'], company_id)
+            if result['report'] is None:
+                return jsonify({'error': 'レポートが見つかりません'}), 404
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"レポートの取得に失敗しました: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+def run_company_report_job(context):
+    """企業の全設問の集計レポートの作成（ジョブ、範囲毎の集計は report_engine のプロセスプールで実行）"""
+    company_id = context.params['company_id']
+    version = context.params['version']
+    min_cell_size = context.params['min_cell_size']
+    report = report_engine.build(
+        company_id, version, company_report_sources(company_id), build_response_layout(),
+        [topic for topic in SURVEY_TOPICS if topic != 'overall'], min_cell_size, context.progress
+    )
+    return {
+        'report_key': report_engine.report_key(company_id, version, min_cell_size),
+        'total_responses': report['total_responses'],
+        'partitions': report['partitions']
+    }
+
+@app.route('/api/company/jobs/<job_id>', methods=['GET'])
+@require_company_auth
+def get_company_job(job_id):
+    """企業のジョブの状態"""
+    return job_status_response(job_id, f'company:{request.company_id}')
+
+@app.route('/api/company/jobs/<job_id>/download', methods=['GET'])
+@require_company_auth
+def download_company_job(job_id):
+    """企業のジョブの結果ファイル"""
+    return job_download_response(job_id, f'company:{request.company_id}')
+
 @app.route('/api/company/export', methods=['GET'])
 @require_company_auth
 def export_company_data():
-    """企業用データエクスポート"""
+    """企業用データエクスポート（CSV・Parquet・列指向ZIP形式、バックグラウンドジョブで作成）"""
     try:
         company_id = request.company_id
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
+        export_format = get_export_format()
+        if export_format is None:
+            return jsonify({'error': '無効なエクスポート形式です'}), 400
+        job = job_queue.submit('company_export', {'company_id': company_id, 'format': export_format},
+                               owner=f'company:{company_id}')
+        return job_accepted_response(job, '/api/company/jobs')
         
-        # 企業の回答データ取得
-        cursor.execute('''
-            SELECT sr.response_data, sr.created_at
-            FROM company_tokens ct
-            JOIN survey_tokens st ON ct.token = st.token
-            JOIN survey_responses sr ON sr.survey_token = st.token
-            WHERE ct.company_id = ?
-            ORDER BY sr.created_at DESC
-        ''', (company_id,))
+    except Exception as e:
+        logger.error(f"企業データエクスポートエラー: {str(e)}")
+        return jsonify({'error': 'サーバーエラーが発生しました'}), 500
+
+def run_company_export_job(context):
+    """企業の回答のエクスポート（ジョブ）"""
+    company_id = context.params['company_id']
+    export_format = context.params.get('format', 'csv')
+    
+    # 企業別データベースには自社の回答のみが保存されている
+    sources = company_report_sources(company_id)
+    if export_format != 'csv':
+        return run_columnar_export(context, 'survey_results', sources, export_format)
+    
+    # CSV生成（1行ずつファイルへ書き込む、部署名などのカンマ・改行は引用符で囲む）
+    path = context.artifact(f"survey_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", 'text/csv')
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['回答ID', '回答日時', '満足度', '部署', '役職'])
+        for count, data in enumerate(iter_export_rows(sources, context.progress), 1):
+            writer.writerow([
+                count, data['created_at'], data.get('overall_satisfaction', 'N/A'),
+                data.get('department', 'N/A'), data.get('position', 'N/A')
+            ])
+    
+    return {'count': count}
+
+# 一括取り込みの設定（バッチ件数・アップロード上限・エラー報告の上限件数）
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_CONTENT_LENGTH = 256 * 1024 * 1024
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+def iter_import_rows(stream, import_format):
+    """アップロードされたNDJSON/CSVを1行ずつ解析（戻り値: (行番号, データ, エラー)）"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    
+    if import_format == 'csv':
+        reader = csv.DictReader(text)
+        for row_number, row in enumerate(reader, 1):
+            # 空欄は未回答として扱う
+            yield row_number, {key: value for key, value in row.items() if key and value not in (None, '')}, None
+        return
+    
+    for row_number, line in enumerate(text, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield row_number, json.loads(line), None
+        except ValueError:
+            yield row_number, None, 'JSONとして解析できません'
+
+def get_import_format():
+    """取り込み形式の判定（?format= または Content-Type）"""
+    requested = (request.args.get('format') or '').lower()
+    if requested in ('csv', 'ndjson'):
+        return requested
+    return 'csv' if 'csv' in (request.content_type or '') else 'ndjson'
+
+class ImportBatchWriter:
+    """検証済みの行をバッチ単位でまとめて書き込む"""
+    
+    def __init__(self, conn, company_id):
+        self.conn = conn
+        self.session = SQLiteStore.session(conn.cursor())
+        self.company_id = company_id
+        self.imported = 0
+    
+    def write(self, batch, errors):
+        """1バッチ分の検証・挿入（1トランザクション）
+        
+        トークンの残り回答数はバッチ毎にトランザクション内で確認する（同時の回答送信・他の取り込みと
+        書き込みロック下で順に確認するため、残数をバッチ間で持ち越さない）。
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        token_remaining = self.session.get_company_token_quotas(
+            self.company_id, {data.get('survey_token') for _, data, _ in batch}
+        )
+        
+        response_rows = []
+        free_text_rows = []
+        token_counts = {}
+        cells = CellAccumulator(RESPONSE_SCORE_MAPS)
+        buckets = BucketAccumulator(RESPONSE_SCORE_MAPS)
+        moments = MomentAccumulator(DRIVER_VARIABLES, RESPONSE_SCORE_MAPS)
+        period = current_period()
+        for row_number, data, payload in batch:
+            survey_token = data.get('survey_token')
+            remaining = token_remaining.get(survey_token)
+            if remaining is None:
+                errors.append({'row': row_number, 'error': '無効なトークンです'})
+                continue
+            if remaining <= 0:
+                errors.append({'row': row_number, 'error': '回答数上限に達しています'})
+                continue
+            token_remaining[survey_token] = remaining - 1
+            token_counts[survey_token] = token_counts.get(survey_token, 0) + 1
+            
+            response_id = str(uuid.uuid4())
+            response_rows.append((
+                response_id,
+                data.get('submission_time'),
+                data.get('user_agent'),
+                data.get('page_load_time'),
+                payload,
+                survey_token,
+                self.company_id
+            ))
+            free_text_rows.extend(build_free_text_rows(response_id, data, self.company_id))
+            cells.add(self.company_id, data)
+            buckets.add(self.company_id, period, data)
+            moments.add(self.company_id, data)
+        
+        if not response_rows:
+            self.conn.rollback()
+            return
+        
+        # 残数の確認と同じトランザクションで上限を超えない場合のみ加算（超える場合はバッチ全体を取り消す）
+        rejected = self.session.reserve_token_responses(token_counts)
+        if rejected:
+            raise RuntimeError(f'回答数上限を超えるため取り込めません: {rejected[0]}')
+        
+        # 企業別データベースへはカタログのコミット後に書き込む（flush_shard_outbox）
+        if response_router.is_sharded(self.company_id):
+            self.session.enqueue_shard_responses(response_rows, free_text_rows)
+        else:
+            self.session.insert_responses(response_rows, free_text_rows)
+        
+        # 企業カウンタ・集計用のセル・度数分布・モーメント行列とデータバージョンはバッチ毎に1回だけ更新
+        self.session.adjust_company_counters(self.company_id, responses_delta=len(response_rows))
+        self.session.add_crosstab_cells(cells.rows())
+        self.session.add_score_buckets(buckets.rows())
+        add_driver_moments(self.session, moments)
+        self.session.bump_data_version(self.company_id)
+        
+        self.conn.commit()
+        self.imported += len(response_rows)
+        flush_shard_outbox(self.company_id)
+
+@app.route('/api/company/import', methods=['POST'])
+@require_company_auth
+def import_company_responses():
+    """紙・キオスク回答の一括取り込み（NDJSON/CSV）
+    
+    リクエストボディにファイル内容をそのまま送信する（?format=csv|ndjson、
+    行に survey_token がない場合は ?survey_token= の値を使用）
+    """
+    try:
+        company_id = request.company_id
+        import_format = get_import_format()
+        default_token = request.args.get('survey_token')
+        imported_at = datetime.now().isoformat()
         
-        responses = cursor.fetchall()
+        stream = get_input_stream(request.environ, max_content_length=IMPORT_MAX_CONTENT_LENGTH)
         
-        # CSV生成
-        csv_lines = ['回答ID,回答日時,満足度,部署,役職']
+        conn = sqlite3.connect(DATABASE_PATH)
+        writer = ImportBatchWriter(conn, company_id)
+        errors = []
+        batch = []
+        total_rows = 0
         
-        for i, (response_data, created_at) in enumerate(responses):
-            try:
-                data = json.loads(response_data)
-                satisfaction = data.get('overall_satisfaction', 'N/A')
-                department = data.get('department', 'N/A')
-                position = data.get('position', 'N/A')
+        try:
+            for row_number, data, error_message in iter_import_rows(stream, import_format):
+                total_rows += 1
+                if error_message is None and not isinstance(data, dict):
+                    error_message = '無効なデータ形式です'
+                if error_message is None:
+                    data.setdefault('submission_time', imported_at)
+                    data.setdefault('user_agent', 'import')
+                    if not data.get('survey_token'):
+                        data['survey_token'] = default_token
+                    payload, error_message = check_submission(data)
+                if error_message:
+                    errors.append({'row': row_number, 'error': error_message})
+                    continue
                 
-                csv_lines.append(f'{i+1},{created_at},{satisfaction},{department},{position}')
-            except json.JSONDecodeError:
-                continue
+                batch.append((row_number, data, payload))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    writer.write(batch, errors)
+                    batch = []
+            
+            if batch:
+                writer.write(batch, errors)
+                batch = []
+        except Exception as e:
+            # 途中で失敗した場合もコミット済みのバッチは取り込まれているため、件数と再開する行を返す
+            if conn.in_transaction:
+                conn.rollback()
+            failed_row = batch[0][0] if batch else total_rows + 1
+            if writer.imported:
+                update_statistics()
+            logger.error(f"回答一括取り込みエラー: {company_id} ({writer.imported}件取り込み済み、{failed_row}行目以降は未取り込み): {str(e)}")
+            if isinstance(e, UnicodeDecodeError):
+                status, message = 400, 'ファイルはUTF-8で送信してください'
+            elif isinstance(e, RequestEntityTooLarge):
+                status, message = 413, 'ファイルサイズが大きすぎます'
+            else:
+                status, message = 500, 'サーバーエラーが発生しました'
+            return jsonify({
+                'error': message,
+                'imported': writer.imported,
+                'failed_row': failed_row
+            }), status
+        finally:
+            conn.close()
         
-        csv_data = '\n'.join(csv_lines)
+        # 統計データは取り込み全体で1回だけ更新
+        if writer.imported:
+            update_statistics()
         
-        conn.close()
+        logger.info(f"回答を一括取り込みしました: {company_id} ({writer.imported}/{total_rows}件)")
         
+        errors.sort(key=lambda error: error['row'])
         return jsonify({
             'success': True,
-            'csvData': csv_data,
-            'count': len(responses)
+            'total_rows': total_rows,
+            'imported': writer.imported,
+            'failed': len(errors),
+            'errors': errors[:IMPORT_MAX_REPORTED_ERRORS],
+            'errors_truncated': len(errors) > IMPORT_MAX_REPORTED_ERRORS
         })
         
     except Exception as e:
-        logger.error(f"企業データエクスポートエラー: {str(e)}")
+        logger.error(f"回答一括取り込みエラー: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
 # ====================
@@ -1470,32 +3655,18 @@ def export_company_data():
 # ====================
 
 @app.route('/api/admin/companies', methods=['GET'])
+@versioned_json(snapshot=True)
 def get_admin_companies():
     """管理者用企業一覧取得"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
+        page, per_page, sort, order = get_paging_params()
         
-        # 企業一覧と現在のURL数を取得
-        cursor.execute('''
-            SELECT 
-                ca.company_id,
-                ca.company_name,
-                ca.access_key,
-                ca.max_urls,
-                ca.max_responses_per_url,
-                ca.is_active,
-                ca.created_at,
-                COUNT(ct.token) as current_urls
-            FROM company_accounts ca
-            LEFT JOIN company_tokens ct ON ca.company_id = ct.company_id
-            LEFT JOIN survey_tokens st ON ct.token = st.token AND st.is_active = 1
-            GROUP BY ca.company_id
-            ORDER BY ca.created_at DESC
-        ''')
+        # 企業一覧と集計カウンタを取得
+        with analytics_session() as session:
+            rows, pagination = fetch_company_listing(session.cursor, page, per_page, sort, order)
         
         companies = []
-        for row in cursor.fetchall():
+        for row in rows:
             companies.append({
                 'company_id': row[0],
                 'company_name': row[1],
@@ -1504,14 +3675,16 @@ def get_admin_companies():
                 'max_responses_per_url': row[4],
                 'is_active': bool(row[5]),
                 'created_at': row[6],
-                'current_urls': row[7]
+                'current_urls': row[7],
+                'total_responses': row[8],
+                'last_response_at': row[9],
+                'min_cell_size': row[10]
             })
         
-        conn.close()
-        
         return jsonify({
             'success': True,
-            'companies': companies
+            'companies': companies,
+            'pagination': pagination
         })
         
     except Exception as e:
@@ -1536,25 +3709,17 @@ def create_admin_company():
         # バリデーション
         if not company_id or not company_name or not access_key:
             return jsonify({'error': '必須項目が不足しています'}), 400
+        try:
+            min_cell_size = parse_min_cell_size(data.get('min_cell_size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': f'匿名性の閾値は{CROSSTAB_MIN_CELL_SIZE}以上の整数で指定してください'}), 400
         
-        # 企業ID重複チェック
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT company_id FROM company_accounts WHERE company_id = ?', (company_id,))
-        if cursor.fetchone():
-            conn.close()
-            return jsonify({'error': 'この企業IDは既に使用されています'}), 400
-        
-        # 企業アカウント作成
-        cursor.execute('''
-            INSERT INTO company_accounts 
-            (company_id, company_name, access_key, max_urls, max_responses_per_url)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (company_id, company_name, access_key, max_urls, max_responses_per_url))
-        
-        conn.commit()
-        conn.close()
+        # 企業アカウント作成（企業IDが重複する場合は作成しない）
+        with catalog_store.transaction() as session:
+            if not session.create_company(company_id, company_name, access_key, max_urls, max_responses_per_url,
+                                          min_cell_size):
+                return jsonify({'error': 'この企業IDは既に使用されています'}), 400
+            session.bump_data_version(company_id)
         
         logger.info(f"管理者が企業アカウントを作成しました: {company_id}")
         
@@ -1585,26 +3750,17 @@ def update_admin_company(company_id):
         
         if not company_name or not access_key:
             return jsonify({'error': '必須項目が不足しています'}), 400
+        try:
+            min_cell_size = parse_min_cell_size(data.get('min_cell_size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': f'匿名性の閾値は{CROSSTAB_MIN_CELL_SIZE}以上の整数で指定してください'}), 400
         
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 企業存在確認
-        cursor.execute('SELECT company_id FROM company_accounts WHERE company_id = ?', (company_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({'error': '企業が見つかりません'}), 404
-        
-        # 企業情報更新
-        cursor.execute('''
-            UPDATE company_accounts 
-            SET company_name = ?, access_key = ?, max_urls = ?, 
-                max_responses_per_url = ?, is_active = ?
-            WHERE company_id = ?
-        ''', (company_name, access_key, max_urls, max_responses_per_url, is_active, company_id))
-        
-        conn.commit()
-        conn.close()
+        # 企業情報更新（存在しない場合は404）
+        with catalog_store.transaction() as session:
+            if not session.update_company(company_id, company_name, access_key, max_urls, max_responses_per_url,
+                                          is_active, min_cell_size):
+                return jsonify({'error': '企業が見つかりません'}), 404
+            session.bump_data_version(company_id)
         
         logger.info(f"管理者が企業情報を更新しました: {company_id}")
         
@@ -1621,37 +3777,14 @@ def update_admin_company(company_id):
 def delete_admin_company(company_id):
     """管理者用企業削除"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 企業存在確認
-        cursor.execute('SELECT company_id FROM company_accounts WHERE company_id = ?', (company_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({'error': '企業が見つかりません'}), 404
-        
-        # 関連するトークンと回答を削除
-        cursor.execute('''
-            DELETE FROM survey_responses 
-            WHERE survey_token IN (
-                SELECT st.token FROM company_tokens ct 
-                JOIN survey_tokens st ON ct.token = st.token 
-                WHERE ct.company_id = ?
-            )
-        ''', (company_id,))
-        
-        cursor.execute('''
-            DELETE FROM survey_tokens 
-            WHERE token IN (
-                SELECT token FROM company_tokens WHERE company_id = ?
-            )
-        ''', (company_id,))
-        
-        cursor.execute('DELETE FROM company_tokens WHERE company_id = ?', (company_id,))
-        cursor.execute('DELETE FROM company_accounts WHERE company_id = ?', (company_id,))
+        # 企業と関連するトークン・回答・集計を削除（存在しない場合は404）
+        with catalog_store.transaction() as session:
+            if not session.delete_company(company_id):
+                return jsonify({'error': '企業が見つかりません'}), 404
+            session.bump_data_version(company_id)
         
-        conn.commit()
-        conn.close()
+        # 企業別データベースの削除
+        response_router.remove(company_id)
         
         logger.info(f"管理者が企業を削除しました: {company_id}")
         
@@ -1664,10 +3797,24 @@ def delete_admin_company(company_id):
         logger.error(f"管理者用企業削除エラー: {str(e)}")
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+# バックグラウンドジョブの種類
+job_queue.register('export', run_export_job)
+job_queue.register('company_export', run_company_export_job)
+job_queue.register('company_report', run_company_report_job)
+job_queue.register('backup', run_backup_job)
+
 if __name__ == '__main__':
     # 本番環境の設定
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
     
+    if sys.argv[1:] == ['migrate']:
+        # マイグレーションのみ実行（メンテナンス用、通常はサーバーの起動時に実行される）
+        migrate_database()
+        sys.exit(0)
+    
     logger.info("従業員満足度調査システム サーバーを起動しています...")
+    # 開発サーバーは起動時にマイグレーションも実行
+    migrate_database()
+    ensure_database_ready()
     app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
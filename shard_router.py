@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 企業別データベース（シャード）のルーティング
+
+企業アカウント・調査URLなどの共通データは従来のデータベース（カタログ）に置き、
+企業に紐付く回答データは企業毎のSQLiteファイルに保存する。
+企業毎にファイルが分かれるため、ある企業のエクスポートや一括取り込み・削除が
+他企業の回答書き込みと同じ書き込みロックを取り合わない。
+
+企業に紐付かない回答（企業なしのトークン・トークンなし）は従来通りカタログに保存する。
+全体集計は全シャードに対してスレッドプールで並列に実行する。
+"""
+
+import glob
+import hashlib
+import heapq
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+SHARD_FILE_PREFIX = 'company_'
+SHARD_FILE_SUFFIX = '.db'
+
+
+class ShardRouter:
+    """企業ID→データベースファイルの対応付けとシャードへの並列クエリ
+
+    migrations は (バージョン, func(cursor)) のリストで、各シャードを初めて開く際に
+    未適用のものを実行する（適用済みバージョンは PRAGMA user_version に記録）。
+    """
+
+    def __init__(self, catalog_path, shard_directory, enabled=False, migrations=(), max_workers=8):
+        self.catalog_path = catalog_path
+        self.shard_directory = shard_directory
+        self.enabled = enabled
+        self.migrations = list(migrations)
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.prepared = set()
+        self.executor = None
+
+    def is_sharded(self, company_id):
+        """企業の回答がシャードに保存されるか"""
+        return self.enabled and bool(company_id)
+
+    def shard_path(self, company_id):
+        """企業の回答を保存するデータベースファイル（シャード無効時・企業なしはカタログ）"""
+        if not self.is_sharded(company_id):
+            return self.catalog_path
+        # ファイル名に使えない文字を置換し、衝突防止のためハッシュを付与
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', company_id)[:40]
+        digest = hashlib.sha256(company_id.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.shard_directory, f'{SHARD_FILE_PREFIX}{safe_id}_{digest}{SHARD_FILE_SUFFIX}')
+
+    def shard_paths(self):
+        """既存のシャードファイル一覧"""
+        if not self.enabled:
+            return []
+        return sorted(glob.glob(os.path.join(self.shard_directory, f'{SHARD_FILE_PREFIX}*{SHARD_FILE_SUFFIX}')))
+
+    def all_paths(self):
+        """回答データを保持する全データベース（カタログ＋シャード）"""
+        return [self.catalog_path] + self.shard_paths()
+
+    def prepare_all(self):
+        """既存の全シャードに未適用のマイグレーションを実行（カタログのマイグレーションから呼ぶ）"""
+        for path in self.shard_paths():
+            self._prepare(path)
+
+    def connect(self, company_id, timeout=30):
+        """企業の回答データベースへの接続（シャードは初回接続時にスキーマを作成）"""
+        path = self.shard_path(company_id)
+        if path != self.catalog_path:
+            self._prepare(path)
+        return sqlite3.connect(path, timeout=timeout)
+
+    @contextmanager
+    def transaction(self, company_id):
+        """企業の回答データベースでのトランザクション（正常終了時にコミット）"""
+        conn = self.connect(company_id)
+        try:
+            yield conn.cursor()
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _prepare(self, path):
+        if path in self.prepared:
+            return
+        with self.lock:
+            if path in self.prepared:
+                return
+            os.makedirs(self.shard_directory, exist_ok=True)
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                cursor = conn.cursor()
+                # 複数ワーカーが同時に初期化しても二重適用しないよう書き込みロック下で確認
+                cursor.execute('BEGIN IMMEDIATE')
+                current_version = cursor.execute('PRAGMA user_version').fetchone()[0]
+                for version, migrate in self.migrations:
+                    if version > current_version:
+                        migrate(cursor)
+                        cursor.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+            finally:
+                conn.close()
+            self.prepared.add(path)
+
+    def fan_out(self, func):
+        """func(データベースのパス) を全データベースに対して並列実行し、結果のリストを返す"""
+        paths = self.all_paths()
+        if len(paths) == 1:
+            return [func(paths[0])]
+        for path in paths[1:]:
+            self._prepare(path)
+        return list(self._get_executor().map(func, paths))
+
+    def merge_sorted(self, func, key):
+        """func(データベースのパス) が返すキーの降順のイテレータを、全データベース分キーの降順に結合
+
+        各データベースからは結合に必要な分だけ読み込む（全件をメモリに保持しない）。
+        """
+        paths = self.all_paths()
+        if len(paths) == 1:
+            return func(paths[0])
+        for path in paths[1:]:
+            self._prepare(path)
+        return heapq.merge(*(func(path) for path in paths), key=key, reverse=True)
+
+    def remove(self, company_id):
+        """企業のシャードファイルを削除"""
+        if not self.is_sharded(company_id):
+            return
+        path = self.shard_path(company_id)
+        with self.lock:
+            self.prepared.discard(path)
+            for suffix in ('', '-journal', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='shard-query')
+            return self.executor
+
+    def reset(self):
+        """fork後の初期化（スレッドプールは子プロセスに引き継がれないため作り直す）"""
+        self.lock = threading.Lock()
+        self.prepared = set()
+        self.executor = None
@@ -1,24 +1,38 @@
 #!/usr/bin/env python3
 """
 従業員満足度調査システム スタートアップスクリプト
+
+使い方:
+    python3 start_server.py               # 開発サーバー（Flask）で起動
+    python3 start_server.py --production  # gunicorn（gunicorn.conf.py）で起動
+    python3 start_server.py --migrate     # マイグレーションのみ実行（通常はサーバーの起動時に自動で実行）
+    python3 start_server.py --reload      # 起動中のgunicornをグレースフルリロード
+    python3 start_server.py --asgi        # ASGI版（uvicorn、asgi.py）で起動
 """
 
+import argparse
+import importlib.util
+import signal
 import subprocess
 import sys
 import os
 import time
 
 def check_requirements():
-    """必要なパッケージの確認とインストール"""
-    try:
-        import flask
-        import flask_cors
+    """必要なパッケージの確認とインストール（インポートせずに存在のみ確認）"""
+    required_modules = ['flask', 'flask_cors', 'gunicorn']
+    if all(importlib.util.find_spec(name) is not None for name in required_modules):
         print("✅ 必要なパッケージが既にインストールされています")
-    except ImportError:
+    else:
         print("📦 必要なパッケージをインストール中...")
         subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
 
-def start_server():
+def migrate_database():
+    """マイグレーションの実行（失敗時は終了）"""
+    print("🗄️  データベースのマイグレーションを実行中...")
+    subprocess.check_call([sys.executable, "server.py", "migrate"])
+
+def start_server(production=False, asgi=False):
     """サーバーの起動"""
     try:
         print("🚀 従業員満足度調査システムを起動しています...")
@@ -27,15 +41,44 @@ def start_server():
         print("⏹️  終了するには Ctrl+C を押してください")
         print("-" * 60)
         
-        # サーバー起動
-        subprocess.run([sys.executable, "server.py"])
+        # サーバー起動（マイグレーションは各サーバーの起動時に実行: gunicorn の on_starting・ASGI の lifespan・server.py）
+        if asgi:
+            port = os.environ.get("PORT", "5000")
+            subprocess.run([sys.executable, "-m", "uvicorn", "asgi:application", "--host", "0.0.0.0", "--port", port])
+        elif production:
+            subprocess.run([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"])
+        else:
+            subprocess.run([sys.executable, "server.py"])
         
     except KeyboardInterrupt:
         print("\n✅ サーバーを停止しました")
     except Exception as e:
         print(f"❌ エラーが発生しました: {e}")
 
+def reload_server():
+    """起動中のgunicornへSIGHUPを送りワーカーを順次再起動"""
+    pidfile = os.environ.get("GUNICORN_PIDFILE", "gunicorn.pid")
+    try:
+        with open(pidfile) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, signal.SIGHUP)
+        print(f"🔄 gunicorn（PID {pid}）にリロードを要求しました")
+    except (OSError, ValueError) as e:
+        print(f"❌ リロードに失敗しました: {e}")
+        sys.exit(1)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="従業員満足度調査システム スタートアップスクリプト")
+    parser.add_argument("--production", action="store_true", help="gunicornで本番モード起動")
+    parser.add_argument("--reload", action="store_true", help="起動中のgunicornをグレースフルリロード")
+    parser.add_argument("--asgi", action="store_true", help="ASGI版（uvicorn）で起動")
+    parser.add_argument("--migrate", action="store_true", help="マイグレーションのみ実行")
+    args = parser.parse_args()
+    
+    if args.reload:
+        reload_server()
+        sys.exit(0)
+    
     # 現在のディレクトリにserver.pyがあるかチェック
     if not os.path.exists("server.py"):
         print("❌ server.py が見つかりません。正しいディレクトリで実行してください。")
@@ -43,6 +86,12 @@ if __name__ == "__main__":
     
     # 依存関係のチェック
     check_requirements()
+    if args.migrate:
+        migrate_database()
+        sys.exit(0)
+    if args.asgi and importlib.util.find_spec("uvicorn") is None:
+        print("❌ ASGI版の起動には uvicorn が必要です（pip install uvicorn）")
+        sys.exit(1)
     
     # サーバー起動
-    start_server()
\ No newline at end of file
+    start_server(production=args.production, asgi=args.asgi)
\ No newline at end of file
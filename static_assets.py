@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 静的ファイル配信パイプライン
+
+起動時にHTML/CSS/JSのコンテンツハッシュと圧縮版（gzip/brotli）を
+メモリ上に作成し、強いETag・Cache-Control付きで配信する
+"""
+
+import gzip
+import hashlib
+import os
+import re
+
+from flask import Response, request
+
+try:
+    import brotli  # 任意依存（インストールされている場合のみbrotli版を作成）
+except ImportError:
+    brotli = None
+
+# パイプライン対象の拡張子とContent-Type
+ASSET_CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8'
+}
+
+# 圧縮対象とする最小サイズ（バイト）
+MIN_COMPRESS_SIZE = 1024
+
+# ハッシュ付きURLのプレフィックスとキャッシュ期間
+HASHED_URL_PREFIX = '/assets/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+HASH_LENGTH = 12
+HASHED_NAME_PATTERN = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[a-z]+)$' % HASH_LENGTH)
+
+
+class StaticAsset:
+    """配信用に前処理済みの静的ファイル"""
+
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.content_type = ASSET_CONTENT_TYPES[os.path.splitext(name)[1]]
+        self.digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+
+        # エンコーディング別の本文（identityは常に保持）
+        self.variants = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants['br'] = compressed
+
+    @property
+    def hashed_url(self):
+        stem, ext = os.path.splitext(self.name)
+        return f"{HASHED_URL_PREFIX}{stem}.{self.digest}{ext}"
+
+    def etag(self, encoding):
+        """エンコーディング毎の強いETag"""
+        if encoding == 'identity':
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+
+def parse_accept_encoding(header):
+    """Accept-Encodingヘッダーから受理可能なエンコーディングを取得"""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token)
+    return accepted
+
+
+def etag_matches(if_none_match, asset):
+    """If-None-Matchヘッダーがアセットのいずれかの版と一致するか"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    candidates = {asset.etag(encoding) for encoding in asset.variants}
+    for value in if_none_match.split(','):
+        value = value.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        if value in candidates:
+            return True
+    return False
+
+
+class AssetPipeline:
+    """静的ファイルの事前圧縮・ハッシュ化と配信"""
+
+    def __init__(self, root='.'):
+        self.root = root
+        self.assets = {}
+        self.hashed = {}
+
+    def build(self):
+        """対象ファイルの読み込みとハッシュ・圧縮版の作成"""
+        assets = {}
+        names = sorted(
+            name for name in os.listdir(self.root)
+            if os.path.splitext(name)[1] in ASSET_CONTENT_TYPES
+            and os.path.isfile(os.path.join(self.root, name))
+        )
+
+        # CSS/JSを先に処理し、HTML内の参照をハッシュ付きURLに書き換える
+        for name in names:
+            if not name.endswith('.html'):
+                assets[name] = StaticAsset(name, self._read(name))
+
+        for name in names:
+            if name.endswith('.html'):
+                html = self._read(name).decode('utf-8')
+                assets[name] = StaticAsset(name, self.rewrite_references(html, assets).encode('utf-8'))
+
+        self.assets = assets
+        self.hashed = {asset.hashed_url[len(HASHED_URL_PREFIX):]: asset for asset in assets.values()}
+        return self
+
+    def _read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def rewrite_references(html, assets):
+        """HTML内のCSS/JS参照をハッシュ付きURLに置換"""
+        def replace(match):
+            asset = assets.get(match.group('name'))
+            if asset is None:
+                return match.group(0)
+            return f'{match.group("attr")}="{asset.hashed_url}"'
+
+        return re.sub(r'(?P<attr>href|src)="/?(?P<name>[\w.-]+\.(?:css|js))"', replace, html)
+
+    def html(self, name):
+        """参照書き換え済みのHTMLテキストを取得"""
+        asset = self.assets.get(name)
+        return asset.body.decode('utf-8') if asset else None
+
+    def response(self, filename):
+        """通常URLでの配信（ETagによる再検証を要求）"""
+        asset = self.assets.get(filename.lstrip('/'))
+        if asset is None:
+            return None
+        return self._build_response(asset, REVALIDATE_CACHE_CONTROL)
+
+    def hashed_response(self, filename):
+        """ハッシュ付きURLでの配信（immutableキャッシュ）"""
+        asset = self.hashed.get(filename)
+        if asset is not None:
+            return self._build_response(asset, IMMUTABLE_CACHE_CONTROL)
+
+        # 古いハッシュへのリクエストは現行版を再検証付きで返す
+        match = HASHED_NAME_PATTERN.match(filename)
+        if match:
+            asset = self.assets.get(match.group('stem') + match.group('ext'))
+            if asset is not None:
+                return self._build_response(asset, REVALIDATE_CACHE_CONTROL)
+        return None
+
+    def _build_response(self, asset, cache_control):
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding'))
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and candidate in accepted:
+                encoding = candidate
+                break
+
+        headers = {
+            'ETag': asset.etag(encoding),
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+
+        if etag_matches(request.headers.get('If-None-Match'), asset):
+            return Response(status=304, headers=headers)
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(asset.variants[encoding], headers=headers, content_type=asset.content_type)
+
+    def stats(self):
+        """配信サイズの概要（ログ出力用）"""
+        original = sum(len(asset.body) for asset in self.assets.values())
+        gzipped = sum(len(asset.variants.get('gzip', asset.body)) for asset in self.assets.values())
+        return {'files': len(self.assets), 'original_bytes': original, 'gzip_bytes': gzipped}
@@ -0,0 +1,966 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - ストレージ層（リポジトリ）
+
+回答・送信キー・企業別データベースへの書き込み待ち・調査URL・企業アカウント・自由記述回答・企業カウンタ・
+クロス集計・統計のデータアクセスをまとめたもの。
+SQLite（既定）と PostgreSQL互換データベース（psycopg2が必要）の2つの実装を持ち、
+どちらも storage_conformance.py の同じ確認項目を満たす。
+
+使い方:
+    store = SQLiteStore('survey_database.db')
+    with store.transaction() as session:
+        session.insert_responses(response_rows, free_text_rows)
+
+SQLは ? プレースホルダで記述し、各実装がドライバの形式に変換する。
+"""
+
+import io
+import json
+import sqlite3
+from contextlib import contextmanager
+
+try:
+    import psycopg2  # 任意依存（PostgreSQL互換バックエンドを使用する場合のみ）
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+# survey_responses / free_text_responses の挿入列（行タプルの順序）
+RESPONSE_COLUMNS = ('id', 'submission_time', 'user_agent', 'page_load_time', 'response_data', 'survey_token',
+                    'company_id')
+FREE_TEXT_COLUMNS = ('response_id', 'question_type', 'question_label', 'response_text', 'character_count', 'company_id')
+
+# クロス集計で絞り込み・グループ化できる列（crosstab_cells の列名）
+CROSSTAB_DIMENSIONS = ('department', 'position')
+
+# グループの回答者数を数えるためのセルの設問名（回答1件につき1を加算）
+RESPONDENTS_QUESTION = '*'
+
+
+class StorageSession:
+    """1トランザクション内のデータアクセス（コミットはストア側で実行）"""
+
+    # 2値の大きい方を返すSQL関数名
+    greatest = 'MAX'
+
+    # 企業の削除時に company_id で削除する表（survey_tokens は company_tokens から、company_accounts は最後に削除）
+    company_tables = ('survey_responses', 'free_text_responses', 'shard_outbox', 'submission_keys', 'company_counters',
+                      'crosstab_cells', 'score_buckets', 'driver_moments')
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def prepare(self, sql):
+        """ドライバのプレースホルダ形式への変換"""
+        return sql
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(self.prepare(sql), params)
+        return self.cursor
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(self.prepare(sql), rows)
+
+    def fetchone(self, sql, params=()):
+        return self.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        return self.execute(sql, params).fetchall()
+
+    # ---- 回答 ----
+
+    def insert_responses(self, response_rows, free_text_rows=()):
+        """調査回答と自由記述回答の一括挿入（行は RESPONSE_COLUMNS / FREE_TEXT_COLUMNS の順）"""
+        if response_rows:
+            self.executemany(f'''
+                INSERT INTO survey_responses ({', '.join(RESPONSE_COLUMNS)})
+                VALUES ({', '.join('?' * len(RESPONSE_COLUMNS))})
+            ''', response_rows)
+        if free_text_rows:
+            self.executemany(f'''
+                INSERT INTO free_text_responses ({', '.join(FREE_TEXT_COLUMNS)})
+                VALUES ({', '.join('?' * len(FREE_TEXT_COLUMNS))})
+            ''', free_text_rows)
+
+    def find_submission(self, key, now):
+        """有効期限内の送信キーの回答ID（未登録・期限切れの場合はNone）"""
+        row = self.fetchone('''
+            SELECT response_id FROM submission_keys WHERE idempotency_key = ? AND expires_at > ?
+        ''', (key, now))
+        return row[0] if row else None
+
+    def claim_submission(self, key, response_id, expires_at, now, company_id=None):
+        """送信キーの登録（期限切れのキーは上書き、有効期限内の同じキーがある場合はFalse）
+
+        company_id は回答の企業（企業の削除時に送信キーも削除する）。
+        """
+        self.execute('''
+            INSERT INTO submission_keys (idempotency_key, response_id, expires_at, company_id) VALUES (?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO UPDATE SET
+                response_id = excluded.response_id,
+                expires_at = excluded.expires_at,
+                company_id = excluded.company_id
+            WHERE submission_keys.expires_at <= ?
+        ''', (key, response_id, expires_at, company_id, now))
+        return self.cursor.rowcount == 1
+
+    def delete_expired_submissions(self, now):
+        self.execute('DELETE FROM submission_keys WHERE expires_at <= ?', (now,))
+
+    # ---- 企業別データベースへの書き込み待ち（カタログの shard_outbox） ----
+
+    def enqueue_shard_responses(self, response_rows, free_text_rows=()):
+        """企業別データベースに保存する回答の登録（行は insert_responses と同じ）
+
+        カウンタ・集計と同じカタログのトランザクションで登録し、コミット後に企業別データベースへ書き込む。
+        """
+        free_text = {}
+        for row in free_text_rows:
+            free_text.setdefault(row[0], []).append(list(row[1:5]))
+        self.executemany(f'''
+            INSERT INTO shard_outbox ({', '.join(RESPONSE_COLUMNS)}, free_text)
+            VALUES ({', '.join('?' * (len(RESPONSE_COLUMNS) + 1))})
+        ''', [
+            tuple(row) + (json.dumps(free_text.get(row[0], []), ensure_ascii=False),)
+            for row in response_rows
+        ])
+
+    def pending_shard_responses(self, company_id=None, limit=1000):
+        """書き込み待ちの回答（company_id が None の場合は全企業、登録順）
+
+        行は RESPONSE_COLUMNS, 自由記述のJSON, created_at の順。
+        """
+        columns = f"{', '.join(RESPONSE_COLUMNS)}, free_text, created_at"
+        if company_id is None:
+            return self.fetchall(f'SELECT {columns} FROM shard_outbox ORDER BY rowid LIMIT ?', (limit,))
+        return self.fetchall(f'''
+            SELECT {columns} FROM shard_outbox WHERE company_id = ? ORDER BY rowid LIMIT ?
+        ''', (company_id, limit))
+
+    def delete_shard_responses(self, response_ids):
+        """企業別データベースへ書き込んだ回答の登録の削除"""
+        self.executemany('DELETE FROM shard_outbox WHERE id = ?', [(response_id,) for response_id in response_ids])
+
+    def apply_shard_responses(self, rows):
+        """pending_shard_responses の行を企業別データベースへ挿入（戻り値は挿入した件数）
+
+        挿入済みの回答は除くため、同じ行を複数回（複数プロセスから）書き込んでもよい。
+        作成日時は登録時（カタログのコミット時）のものを使う。
+        """
+        inserted = 0
+        for row in rows:
+            response_row, free_text, created_at = row[:len(RESPONSE_COLUMNS)], row[-2], row[-1]
+            self.execute(f'''
+                INSERT INTO survey_responses ({', '.join(RESPONSE_COLUMNS)}, created_at)
+                VALUES ({', '.join('?' * (len(RESPONSE_COLUMNS) + 1))})
+                ON CONFLICT (id) DO NOTHING
+            ''', tuple(response_row) + (created_at,))
+            if self.cursor.rowcount != 1:
+                continue
+            inserted += 1
+            response_id, company_id = response_row[0], response_row[-1]
+            self.executemany(f'''
+                INSERT INTO free_text_responses ({', '.join(FREE_TEXT_COLUMNS)}, response_time)
+                VALUES ({', '.join('?' * (len(FREE_TEXT_COLUMNS) + 1))})
+            ''', [(response_id, *values, company_id, created_at) for values in json.loads(free_text)])
+        return inserted
+
+    def count_responses(self):
+        return self.fetchone('SELECT COUNT(*) FROM survey_responses')[0]
+
+    def daily_response_counts(self, since):
+        """since（'YYYY-MM-DD HH:MM:SS'、UTC）以降の日別の回答数 ('YYYY-MM-DD', 件数)"""
+        rows = self.fetchall('''
+            SELECT DATE(created_at), COUNT(*)
+            FROM survey_responses
+            WHERE created_at >= ?
+            GROUP BY DATE(created_at)
+        ''', (since,))
+        return [(str(day), count) for day, count in rows]
+
+    def iter_response_data(self):
+        """全回答の response_data を順に返す"""
+        for row in self.execute('SELECT response_data FROM survey_responses'):
+            yield row[0]
+
+    def list_responses(self):
+        """回答一覧（新しい順、(id, submission_time, response_data, created_at)）"""
+        return self.fetchall('''
+            SELECT id, submission_time, response_data, created_at
+            FROM survey_responses
+            ORDER BY created_at DESC
+        ''')
+
+    def list_responses_page(self, before=None, limit=1000):
+        """回答一覧の1ページ（新しい順、before は前ページ末尾の (created_at, id)）
+
+        (created_at, id) のインデックスを順に読むため、ページ毎に全件を並べ替えない。
+        """
+        if before is None:
+            return self.fetchall('''
+                SELECT id, submission_time, response_data, created_at
+                FROM survey_responses
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            ''', (limit,))
+        return self.fetchall('''
+            SELECT id, submission_time, response_data, created_at
+            FROM survey_responses
+            WHERE (created_at, id) < (?, ?)
+            ORDER BY created_at DESC, id DESC LIMIT ?
+        ''', (before[0], before[1], limit))
+
+    # ---- 調査URLトークン ----
+
+    def list_tokens_page(self, before=None, limit=1000):
+        """トークン一覧の1ページ（新しい順、before は前ページ末尾の (created_at, token)）
+
+        行は (token, created_at, expires_at, max_responses, current_responses, is_active, description)
+        """
+        columns = 'token, created_at, expires_at, max_responses, current_responses, is_active, description'
+        if before is None:
+            return self.fetchall(f'''
+                SELECT {columns} FROM survey_tokens
+                ORDER BY created_at DESC, token DESC LIMIT ?
+            ''', (limit,))
+        return self.fetchall(f'''
+            SELECT {columns} FROM survey_tokens
+            WHERE (created_at, token) < (?, ?)
+            ORDER BY created_at DESC, token DESC LIMIT ?
+        ''', (before[0], before[1], limit))
+
+    def create_tokens(self, token_rows, company_id=None):
+        """トークンの一括作成（行は (token, expires_at, max_responses, description)）"""
+        self.executemany('''
+            INSERT INTO survey_tokens (token, expires_at, max_responses, description)
+            VALUES (?, ?, ?, ?)
+        ''', token_rows)
+        if company_id:
+            self.executemany('''
+                INSERT INTO company_tokens (company_id, token)
+                VALUES (?, ?)
+            ''', [(company_id, row[0]) for row in token_rows])
+
+    def get_token(self, token):
+        """トークンの (expires_at, max_responses, current_responses, is_active)（存在しない場合はNone）"""
+        return self.fetchone('''
+            SELECT expires_at, max_responses, current_responses, is_active
+            FROM survey_tokens WHERE token = ?
+        ''', (token,))
+
+    def count_active_tokens(self):
+        return self.fetchone('SELECT COUNT(*) FROM survey_tokens WHERE is_active = 1')[0]
+
+    def list_company_tokens(self, company_id):
+        """企業のトークン一覧（新しい順、行は list_tokens_page と同じ）"""
+        return self.fetchall('''
+            SELECT st.token, st.created_at, st.expires_at, st.max_responses,
+                   st.current_responses, st.is_active, st.description
+            FROM company_tokens ct
+            JOIN survey_tokens st ON ct.token = st.token
+            WHERE ct.company_id = ?
+            ORDER BY st.created_at DESC
+        ''', (company_id,))
+
+    def get_active_token(self, token):
+        """有効なトークンの (current_responses, max_responses)（無効・存在しない場合はNone）"""
+        return self.fetchone('''
+            SELECT current_responses, max_responses FROM survey_tokens
+            WHERE token = ? AND is_active = 1
+        ''', (token,))
+
+    def get_company_token_quotas(self, company_id, tokens):
+        """企業所有の有効なトークンの残り回答数（トークン→残数）"""
+        tokens = list(tokens)
+        if not tokens:
+            return {}
+        placeholders = ','.join('?' * len(tokens))
+        return dict(self.fetchall(f'''
+            SELECT st.token, st.max_responses - st.current_responses
+            FROM company_tokens ct
+            JOIN survey_tokens st ON ct.token = st.token
+            WHERE ct.company_id = ? AND st.is_active = 1 AND st.token IN ({placeholders})
+        ''', [company_id] + tokens))
+
+    def add_token_responses(self, counts):
+        """トークン毎の回答数の加算（counts: トークン→件数）"""
+        self.executemany('''
+            UPDATE survey_tokens
+            SET current_responses = current_responses + ?
+            WHERE token = ?
+        ''', [(count, token) for token, count in counts.items()])
+
+    def reserve_token_responses(self, counts):
+        """回答数上限を超えない有効なトークンのみ回答数を加算（counts: トークン→件数、戻り値: 加算できなかったトークン）"""
+        rejected = []
+        for token, count in counts.items():
+            self.execute('''
+                UPDATE survey_tokens
+                SET current_responses = current_responses + ?
+                WHERE token = ? AND is_active = 1 AND current_responses + ? <= max_responses
+            ''', (count, token, count))
+            if self.cursor.rowcount != 1:
+                rejected.append(token)
+        return rejected
+
+    def get_token_state(self, token):
+        """トークンの有効状態（存在しない場合はNone）"""
+        row = self.fetchone('SELECT is_active FROM survey_tokens WHERE token = ?', (token,))
+        return None if row is None else bool(row[0])
+
+    def deactivate_token(self, token):
+        self.execute('UPDATE survey_tokens SET is_active = 0 WHERE token = ?', (token,))
+
+    def get_token_company_id(self, token):
+        """トークンを所有する企業ID（企業に紐付かない場合はNone）"""
+        row = self.fetchone('SELECT company_id FROM company_tokens WHERE token = ?', (token,))
+        return row[0] if row else None
+
+    # ---- 自由記述回答 ----
+
+    def free_text_statistics(self):
+        """設問別の (question_type, question_label, 件数, 合計文字数, 最小, 最大)"""
+        return self.fetchall('''
+            SELECT question_type, question_label, COUNT(*), SUM(character_count),
+                   MIN(character_count), MAX(character_count)
+            FROM free_text_responses
+            GROUP BY question_type, question_label
+        ''')
+
+    def recent_free_text(self, limit=10):
+        """最新の (response_text, character_count, response_time, question_label)"""
+        return self.fetchall('''
+            SELECT response_text, character_count, response_time, question_label
+            FROM free_text_responses
+            ORDER BY response_time DESC
+            LIMIT ?
+        ''', (limit,))
+
+    def company_free_text_statistics(self, company_id, since=None, until=None, question_type=None):
+        """企業の設問別の (question_type, 件数, 合計文字数, 最小, 最大)（since 以降・until より前）
+
+        (company_id, question_type, response_time, id, character_count) のインデックスのみで集計する。
+        """
+        conditions, params = free_text_conditions(company_id, since, until, question_type)
+        return self.fetchall(f'''
+            SELECT question_type, COUNT(*), SUM(character_count), MIN(character_count), MAX(character_count)
+            FROM free_text_responses
+            WHERE {conditions}
+            GROUP BY question_type
+        ''', params)
+
+    def list_company_free_text(self, company_id, since=None, until=None, question_type=None, before=None,
+                               limit=50, preview_chars=200):
+        """企業の自由記述回答の1ページ（新しい順、before は前ページ末尾の (response_time, id)）
+
+        行は (id, question_type, 先頭 preview_chars 文字, character_count, response_time)。
+        絞り込みと並び順はインデックスで処理し、本文は返す行の分だけ読み込む。
+        """
+        conditions, params = free_text_conditions(company_id, since, until, question_type)
+        if before is not None:
+            conditions += ' AND (response_time, id) < (?, ?)'
+            params += list(before)
+        return self.fetchall(f'''
+            SELECT id, question_type, substr(response_text, 1, ?), character_count, response_time
+            FROM free_text_responses
+            WHERE {conditions}
+            ORDER BY response_time DESC, id DESC LIMIT ?
+        ''', [preview_chars] + params + [limit])
+
+    def get_company_free_text(self, company_id, text_id):
+        """企業の自由記述回答1件の (id, question_type, question_label, response_text, character_count, response_time)"""
+        return self.fetchone('''
+            SELECT id, question_type, question_label, response_text, character_count, response_time
+            FROM free_text_responses
+            WHERE id = ? AND company_id = ?
+        ''', (text_id, company_id))
+
+    # ---- 企業 ----
+
+    def create_company(self, company_id, company_name, access_key, max_urls, max_responses_per_url,
+                       min_cell_size=None):
+        """企業アカウントとカウンタの作成（同じ企業IDが登録済みの場合はFalse）"""
+        self.execute('''
+            INSERT INTO company_accounts
+                (company_id, company_name, access_key, max_urls, max_responses_per_url, min_cell_size)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (company_id) DO NOTHING
+        ''', (company_id, company_name, access_key, max_urls, max_responses_per_url, min_cell_size))
+        if self.cursor.rowcount != 1:
+            return False
+        self.execute('''
+            INSERT INTO company_counters (company_id) VALUES (?)
+            ON CONFLICT (company_id) DO NOTHING
+        ''', (company_id,))
+        return True
+
+    def update_company(self, company_id, company_name, access_key, max_urls, max_responses_per_url, is_active,
+                       min_cell_size=None):
+        """企業アカウントの更新（存在しない場合はFalse）"""
+        self.execute('''
+            UPDATE company_accounts
+            SET company_name = ?, access_key = ?, max_urls = ?,
+                max_responses_per_url = ?, is_active = ?, min_cell_size = ?
+            WHERE company_id = ?
+        ''', (company_name, access_key, max_urls, max_responses_per_url, int(bool(is_active)), min_cell_size,
+              company_id))
+        return self.cursor.rowcount == 1
+
+    def delete_company(self, company_id):
+        """企業アカウントと調査URL・回答・書き込み待ちの回答・送信キー・集計の削除（存在しない場合はFalse）"""
+        if not self.company_exists(company_id):
+            return False
+        self.execute('''
+            DELETE FROM survey_tokens
+            WHERE token IN (SELECT token FROM company_tokens WHERE company_id = ?)
+        ''', (company_id,))
+        for table in self.company_tables + ('company_tokens', 'company_accounts'):
+            self.execute(f'DELETE FROM {table} WHERE company_id = ?', (company_id,))
+        return True
+
+    def company_exists(self, company_id):
+        return self.fetchone('SELECT 1 FROM company_accounts WHERE company_id = ?', (company_id,)) is not None
+
+    def authenticate_company(self, company_id, access_key):
+        """有効な企業の (company_id, company_name)（企業IDとアクセスキーが一致しない場合はNone）"""
+        return self.fetchone('''
+            SELECT company_id, company_name FROM company_accounts
+            WHERE company_id = ? AND access_key = ? AND is_active = 1
+        ''', (company_id, access_key))
+
+    def is_active_company(self, company_id):
+        return self.fetchone('''
+            SELECT 1 FROM company_accounts WHERE company_id = ? AND is_active = 1
+        ''', (company_id,)) is not None
+
+    def get_company_limits(self, company_id):
+        """企業の (max_urls, max_responses_per_url)（存在しない場合はNone）"""
+        return self.fetchone('''
+            SELECT max_urls, max_responses_per_url FROM company_accounts WHERE company_id = ?
+        ''', (company_id,))
+
+    def adjust_company_counters(self, company_id, active_urls_delta=0, responses_delta=0):
+        """企業別カウンタの更新"""
+        self.execute('''
+            INSERT INTO company_counters (company_id) VALUES (?)
+            ON CONFLICT (company_id) DO NOTHING
+        ''', (company_id,))
+
+        if responses_delta:
+            self.execute(f'''
+                UPDATE company_counters
+                SET active_urls = {self.greatest}(active_urls + ?, 0),
+                    total_responses = total_responses + ?,
+                    last_response_at = CURRENT_TIMESTAMP
+                WHERE company_id = ?
+            ''', (active_urls_delta, responses_delta, company_id))
+        else:
+            self.execute(f'''
+                UPDATE company_counters
+                SET active_urls = {self.greatest}(active_urls + ?, 0)
+                WHERE company_id = ?
+            ''', (active_urls_delta, company_id))
+
+    def get_company_counters(self, company_id):
+        """(active_urls, total_responses, last_response_at)（未作成の場合はNone）"""
+        return self.fetchone('''
+            SELECT active_urls, total_responses, last_response_at
+            FROM company_counters WHERE company_id = ?
+        ''', (company_id,))
+
+    def sum_company_responses(self):
+        return self.fetchone('SELECT COALESCE(SUM(total_responses), 0) FROM company_counters')[0]
+
+    # ---- クロス集計 ----
+
+    def add_crosstab_cells(self, rows):
+        """クロス集計セルへの加算（rows: (企業ID, 部署, 役職, 設問, 回答数, 合計, 二乗和)）"""
+        self.executemany('''
+            INSERT INTO crosstab_cells
+                (company_id, department, position, question, response_count, score_sum, score_sum_sq)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (company_id, question, department, position) DO UPDATE SET
+                response_count = crosstab_cells.response_count + excluded.response_count,
+                score_sum = crosstab_cells.score_sum + excluded.score_sum,
+                score_sum_sq = crosstab_cells.score_sum_sq + excluded.score_sum_sq
+        ''', rows)
+
+    def fetch_crosstab(self, company_id=None, group_by=(), filters=None, questions=None, min_count=None):
+        """セルの合計 (グループ列の値..., 設問, 回答数, 合計, 二乗和)
+
+        company_id が None の場合は全企業、filters は {列名: 値}、questions は設問名のリスト。
+        min_count を指定した場合は回答者数が min_count 未満のグループ・回答数が min_count 未満の
+        設問をSQL（HAVING）で除外する（小セルの数値は読み込まない）。
+        """
+        scope, scope_params = crosstab_conditions(company_id, group_by, filters)
+        conditions, params = list(scope), list(scope_params)
+        if questions:
+            conditions.append(f"question IN ({', '.join('?' for _ in questions)})")
+            params.extend(questions)
+        columns = ''.join(f'{name}, ' for name in group_by)
+        having = ''
+        if min_count is not None:
+            # 回答者数（RESPONDENTS_QUESTION のセルの合計）が min_count 以上のグループのみ
+            respondents = ' AND '.join(scope + ['question = ?'])
+            keys = ', '.join(group_by)
+            if group_by:
+                conditions.append(f'''({keys}) IN (
+                    SELECT {keys} FROM crosstab_cells WHERE {respondents}
+                    GROUP BY {keys} HAVING SUM(response_count) >= ?
+                )''')
+            else:
+                conditions.append(f'''EXISTS (
+                    SELECT 1 FROM crosstab_cells WHERE {respondents}
+                    GROUP BY question HAVING SUM(response_count) >= ?
+                )''')
+            params.extend(scope_params + [RESPONDENTS_QUESTION, min_count, min_count])
+            having = 'HAVING SUM(response_count) >= ?'
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self.fetchall(f'''
+            SELECT {columns}question, SUM(response_count), SUM(score_sum), SUM(score_sum_sq)
+            FROM crosstab_cells {where}
+            GROUP BY {columns}question {having}
+        ''', params)
+
+    def fetch_small_groups(self, company_id=None, group_by=(), filters=None, min_count=1):
+        """回答者数が min_count 未満のグループ (グループ列の値..., 該当する全グループの回答者数の合計)
+
+        個々のグループの回答者数は返さない（合計は補完秘匿の判定用）。
+        group_by が空の場合は絞り込んだ範囲全体が min_count 未満のときに1行を返す。
+        """
+        scope, params = crosstab_conditions(company_id, group_by, filters)
+        columns = ''.join(f'{name}, ' for name in group_by)
+        return self.fetchall(f'''
+            SELECT {columns}SUM(SUM(response_count)) OVER ()
+            FROM crosstab_cells
+            WHERE {' AND '.join(scope + ['question = ?'])}
+            GROUP BY {', '.join(group_by) or 'question'}
+            HAVING SUM(response_count) < ?
+        ''', params + [RESPONDENTS_QUESTION, min_count])
+
+    def add_score_buckets(self, rows):
+        """期間別の点数毎の件数への加算（rows: (企業ID, 期間, 設問, 点数, 件数)）"""
+        self.executemany('''
+            INSERT INTO score_buckets (company_id, period, question, score, response_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (company_id, question, period, score) DO UPDATE SET
+                response_count = score_buckets.response_count + excluded.response_count
+        ''', rows)
+
+    def fetch_score_buckets(self, company_id=None, questions=None, since=None):
+        """期間別の点数毎の件数 (期間, 設問, 点数, 件数)（company_id が None の場合は全企業の合計）"""
+        conditions, params = [], []
+        if company_id is not None:
+            conditions.append('company_id = ?')
+            params.append(company_id)
+        if questions:
+            conditions.append(f"question IN ({', '.join('?' for _ in questions)})")
+            params.extend(questions)
+        if since is not None:
+            conditions.append('period >= ?')
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self.fetchall(f'''
+            SELECT period, question, score, SUM(response_count)
+            FROM score_buckets {where}
+            GROUP BY period, question, score
+            ORDER BY period
+        ''', params)
+
+    def fetch_score_distribution(self, company_id, questions, min_count=1):
+        """全期間・指定設問の点数毎の件数の合計 (点数, 件数)（件数が min_count 未満の点数は除く）"""
+        return self.fetchall(f'''
+            SELECT score, SUM(response_count)
+            FROM score_buckets
+            WHERE company_id = ? AND question IN ({', '.join('?' for _ in questions)})
+            GROUP BY score
+            HAVING SUM(response_count) >= ?
+            ORDER BY score
+        ''', [company_id] + list(questions) + [min_count])
+
+    def get_driver_moments(self, company_id):
+        """キードライバー分析のモーメント (変数一覧のJSON, 回答数, 合計, 積の合計)（未作成の場合はNone）"""
+        return self.fetchone('''
+            SELECT variables, response_count, sums, cross_products FROM driver_moments WHERE company_id = ?
+        ''', (company_id,))
+
+    def put_driver_moments(self, company_id, variables, count, sums, cross_products):
+        self.execute('''
+            INSERT INTO driver_moments (company_id, variables, response_count, sums, cross_products)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (company_id) DO UPDATE SET
+                variables = excluded.variables,
+                response_count = excluded.response_count,
+                sums = excluded.sums,
+                cross_products = excluded.cross_products
+        ''', (company_id, variables, count, sums, cross_products))
+
+    # ---- 統計・データバージョン ----
+
+    def update_statistics(self, total_responses):
+        self.execute('''
+            UPDATE survey_statistics
+            SET total_responses = ?, last_updated = CURRENT_TIMESTAMP
+            WHERE id = 1
+        ''', (total_responses,))
+
+    def bump_data_version(self, company_id=None):
+        """データ更新時のバージョン更新（全体と企業別）"""
+        scopes = ['global']
+        if company_id:
+            scopes.append(f'company:{company_id}')
+        for scope in scopes:
+            self.execute('''
+                INSERT INTO data_versions (scope, version) VALUES (?, 1)
+                ON CONFLICT (scope) DO UPDATE SET version = data_versions.version + 1
+            ''', (scope,))
+
+    def get_data_version(self, scope):
+        row = self.fetchone('SELECT version FROM data_versions WHERE scope = ?', (scope,))
+        return row[0] if row else 0
+
+    def get_data_versions(self, scopes):
+        """スコープ→バージョン（未作成のスコープは含まない）"""
+        scopes = list(scopes)
+        if not scopes:
+            return {}
+        return dict(self.fetchall(f'''
+            SELECT scope, version FROM data_versions WHERE scope IN ({', '.join('?' * len(scopes))})
+        ''', scopes))
+
+
+def crosstab_conditions(company_id=None, group_by=(), filters=None):
+    """クロス集計セルの絞り込み条件（SQLの条件のリストとパラメータ、未対応の列はValueError）"""
+    filters = filters or {}
+    if any(name not in CROSSTAB_DIMENSIONS for name in list(group_by) + list(filters)):
+        raise ValueError('unknown crosstab dimension')
+    conditions, params = [], []
+    if company_id is not None:
+        conditions.append('company_id = ?')
+        params.append(company_id)
+    for name, value in filters.items():
+        conditions.append(f'{name} = ?')
+        params.append(value)
+    return conditions, params
+
+
+def free_text_conditions(company_id, since=None, until=None, question_type=None):
+    """企業の自由記述回答の絞り込み条件（SQLとパラメータ）"""
+    conditions, params = ['company_id = ?'], [company_id]
+    if question_type is not None:
+        conditions.append('question_type = ?')
+        params.append(question_type)
+    if since is not None:
+        conditions.append('response_time >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('response_time < ?')
+        params.append(until)
+    return ' AND '.join(conditions), params
+
+
+class SQLiteStore:
+    """SQLiteバックエンド（リクエスト毎に接続を開く）
+
+    スキーマは server.py のマイグレーションで作成する。
+    """
+
+    session_class = StorageSession
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    @contextmanager
+    def transaction(self):
+        """書き込み用セッション（正常終了時にコミット、例外時はロールバック）"""
+        conn = self.connect()
+        try:
+            yield self.session_class(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def read(self):
+        """読み取り用セッション"""
+        conn = self.connect()
+        try:
+            yield self.session_class(conn.cursor())
+        finally:
+            conn.close()
+
+    @classmethod
+    def session(cls, cursor):
+        """既存のカーソル（呼び出し側のトランザクション）を使うセッション"""
+        return cls.session_class(cursor)
+
+
+def copy_csv_field(value):
+    """COPY（CSV形式）の1項目（NULLは空欄、それ以外は引用符で囲んで空文字と区別）"""
+    if value is None:
+        return ''
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = '\\x' + bytes(value).hex()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def bytea_value(value):
+    """BYTEA列の値（memoryview）をSQLite版と同じ型に戻す
+
+    BYTEAには従来のJSON文字列の回答もバイト列で保存されるため、JSONオブジェクト（'{' で始まる）は
+    文字列に戻す（コンパクト形式は形式バージョンのバイトで始まるため区別できる）。
+    """
+    if isinstance(value, memoryview):
+        value = bytes(value)
+    if isinstance(value, bytes) and value[:1] == b'{':
+        return value.decode('utf-8')
+    return value
+
+
+class PostgresSession(StorageSession):
+    """PostgreSQL互換データベース用のセッション"""
+
+    greatest = 'GREATEST'
+
+    # 企業別データベース（shard_outbox）はSQLiteのみの機能
+    company_tables = tuple(table for table in StorageSession.company_tables if table != 'shard_outbox')
+
+    def prepare(self, sql):
+        return sql.replace('?', '%s')
+
+    def insert_responses(self, response_rows, free_text_rows=()):
+        """COPY による一括挿入"""
+        if response_rows:
+            self._copy('survey_responses', RESPONSE_COLUMNS, response_rows)
+        if free_text_rows:
+            self._copy('free_text_responses', FREE_TEXT_COLUMNS, free_text_rows)
+
+    def _copy(self, table, columns, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(copy_csv_field(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        self.cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')", buffer
+        )
+
+    def iter_response_data(self):
+        for value in super().iter_response_data():
+            yield bytea_value(value)
+
+    def list_responses(self):
+        return [(row[0], row[1], bytea_value(row[2]), row[3]) for row in super().list_responses()]
+
+    def list_responses_page(self, before=None, limit=1000):
+        return [(row[0], row[1], bytea_value(row[2]), row[3]) for row in super().list_responses_page(before, limit)]
+
+    def get_driver_moments(self, company_id):
+        row = super().get_driver_moments(company_id)
+        if row is None:
+            return None
+        return row[0], row[1], bytes(row[2]), bytes(row[3])
+
+
+# PostgreSQL互換データベースのスキーマ（SQLite版は server.py のマイグレーションで作成）
+# 企業別データベース（shard_outbox）はSQLiteのみの機能のため含まない
+POSTGRES_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS survey_responses (
+        id TEXT PRIMARY KEY,
+        submission_time TEXT NOT NULL,
+        user_agent TEXT,
+        page_load_time BIGINT,
+        response_data BYTEA NOT NULL,
+        survey_token TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        company_id TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_survey_responses_company ON survey_responses (company_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_survey_responses_created ON survey_responses (created_at, id)',
+    '''
+    CREATE TABLE IF NOT EXISTS free_text_responses (
+        id BIGSERIAL PRIMARY KEY,
+        response_id TEXT NOT NULL,
+        question_type TEXT NOT NULL,
+        question_label TEXT,
+        response_text TEXT NOT NULL,
+        character_count INTEGER,
+        response_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        company_id TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_free_text_company_time ON free_text_responses (company_id, response_time, id)',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_free_text_company_question
+    ON free_text_responses (company_id, question_type, response_time, id, character_count)
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_free_text_time ON free_text_responses (response_time)',
+    '''
+    CREATE TABLE IF NOT EXISTS survey_tokens (
+        token TEXT PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP,
+        max_responses INTEGER DEFAULT 1,
+        current_responses INTEGER DEFAULT 0,
+        is_active INTEGER DEFAULT 1,
+        description TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_survey_tokens_created ON survey_tokens (created_at, token)',
+    '''
+    CREATE TABLE IF NOT EXISTS company_accounts (
+        company_id TEXT PRIMARY KEY,
+        company_name TEXT NOT NULL,
+        access_key TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_active INTEGER DEFAULT 1,
+        max_urls INTEGER DEFAULT 10,
+        max_responses_per_url INTEGER DEFAULT 1000,
+        min_cell_size INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_company_accounts_created ON company_accounts (created_at)',
+    '''
+    CREATE TABLE IF NOT EXISTS company_tokens (
+        company_id TEXT,
+        token TEXT,
+        PRIMARY KEY (company_id, token)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_company_tokens_token ON company_tokens (token)',
+    '''
+    CREATE TABLE IF NOT EXISTS company_counters (
+        company_id TEXT PRIMARY KEY,
+        active_urls INTEGER NOT NULL DEFAULT 0,
+        total_responses INTEGER NOT NULL DEFAULT 0,
+        last_response_at TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS survey_statistics (
+        id SERIAL PRIMARY KEY,
+        total_responses INTEGER DEFAULT 0,
+        completion_rate REAL DEFAULT 0.0,
+        avg_satisfaction REAL DEFAULT 0.0,
+        nps_score REAL DEFAULT 0.0,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    INSERT INTO survey_statistics (id, total_responses)
+    VALUES (1, 0) ON CONFLICT (id) DO NOTHING
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS crosstab_cells (
+        company_id TEXT NOT NULL,
+        department TEXT NOT NULL,
+        position TEXT NOT NULL,
+        question TEXT NOT NULL,
+        response_count INTEGER NOT NULL DEFAULT 0,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        score_sum_sq DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (company_id, question, department, position)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS score_buckets (
+        company_id TEXT NOT NULL,
+        period TEXT NOT NULL,
+        question TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        response_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (company_id, question, period, score)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS driver_moments (
+        company_id TEXT PRIMARY KEY,
+        variables TEXT NOT NULL,
+        response_count BIGINT NOT NULL DEFAULT 0,
+        sums BYTEA NOT NULL,
+        cross_products BYTEA NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS submission_keys (
+        idempotency_key TEXT PRIMARY KEY,
+        response_id TEXT NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL,
+        company_id TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_submission_keys_expires ON submission_keys (expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_submission_keys_company ON submission_keys (company_id)'
+]
+
+
+class PostgresStore:
+    """PostgreSQL互換データベースのバックエンド（スレッドセーフな接続プール）
+
+    pool を指定した場合は psycopg2 の接続プールと同じ getconn / putconn / closeall を持つオブジェクトを使う
+    （storage_conformance.py の確認用の代替実装など）。
+    """
+
+    session_class = PostgresSession
+
+    def __init__(self, dsn=None, min_connections=1, max_connections=10, pool=None):
+        if pool is None:
+            if psycopg2 is None:
+                raise RuntimeError('psycopg2 is required for the PostgreSQL backend (pip install psycopg2-binary)')
+            pool = psycopg2.pool.ThreadedConnectionPool(min_connections, max_connections, dsn)
+        self.pool = pool
+
+    @contextmanager
+    def _connection(self):
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        """書き込み用セッション（正常終了時にコミット、例外時はロールバック）"""
+        with self._connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    yield self.session_class(cursor)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def read(self):
+        """読み取り用セッション（終了時にロールバックして接続をプールに戻す）"""
+        with self._connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    yield self.session_class(cursor)
+            finally:
+                conn.rollback()
+
+    @classmethod
+    def session(cls, cursor):
+        """既存のカーソル（呼び出し側のトランザクション）を使うセッション"""
+        return cls.session_class(cursor)
+
+    def create_schema(self):
+        with self.transaction() as session:
+            for statement in POSTGRES_SCHEMA:
+                session.execute(statement)
+
+    def close(self):
+        self.pool.closeall()
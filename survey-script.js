@@ -390,8 +390,9 @@ async function submitSurvey() {
         // 実際のAPI送信
         await submitToServer(submissionData);
         
-        // ローカルストレージをクリア
+        // ローカルストレージ・送信キーをクリア
         localStorage.removeItem('surveyData');
+        sessionStorage.removeItem('survey_submission_key');
         
         // 完了モーダルを表示
         document.getElementById('completionModal').style.display = 'flex';
@@ -408,32 +409,57 @@ async function submitSurvey() {
     }
 }
 
+// 送信の再試行回数と間隔（ミリ秒、通信エラー・サーバーエラー時）
+const SUBMIT_RETRY_DELAYS = [1000, 3000];
+
+// 送信キーの取得（同じ回答の再送・二重クリックをサーバーで重複と判定するため、送信完了まで同じキーを使う）
+function getSubmissionKey() {
+    let key = sessionStorage.getItem('survey_submission_key');
+    if (!key) {
+        key = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+        sessionStorage.setItem('survey_submission_key', key);
+    }
+    return key;
+}
+
 // 実際のAPI送信
 async function submitToServer(data) {
-    try {
-        // トークンがある場合は追加
-        if (window.SURVEY_TOKEN) {
-            data.survey_token = window.SURVEY_TOKEN;
-        }
-        
-        const response = await fetch('/api/submit', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(data)
-        });
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+    // トークンがある場合は追加
+    if (window.SURVEY_TOKEN) {
+        data.survey_token = window.SURVEY_TOKEN;
+    }
+    const submissionKey = getSubmissionKey();
+    
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch('/api/submit', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': submissionKey
+                },
+                body: JSON.stringify(data)
+            });
+            
+            if (!response.ok) {
+                const error = new Error(`HTTP error! status: ${response.status}`);
+                // 入力内容の誤り（4xx）は再試行しない
+                error.retryable = response.status >= 500;
+                throw error;
+            }
+            
+            const result = await response.json();
+            return result;
+            
+        } catch (error) {
+            console.error('送信エラー:', error);
+            if (error.retryable === false || attempt >= SUBMIT_RETRY_DELAYS.length) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, SUBMIT_RETRY_DELAYS[attempt]));
         }
-        
-        const result = await response.json();
-        return result;
-        
-    } catch (error) {
-        console.error('送信エラー:', error);
-        throw error;
     }
 }
 
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+従業員満足度調査システム - 信頼区間と期間比較の検定
+
+回答を走査せず、保存済みの十分統計量（回答数・合計・二乗和、または点数毎の件数）だけから
+平均・NPSの信頼区間と、前期間との差の検定を計算する。ダッシュボードの各項目で呼び出しても
+数µs〜数十µsで済むよう、t分布の分位点はキャッシュする。
+
+    平均      t分布による信頼区間、2期間の差はWelchのt検定
+    NPS       推奨者・批判者の割合（多項分布）の分散による正規近似の信頼区間、2期間の差はz検定
+
+NPSは0〜10点の推奨度で 9〜10点を推奨者、0〜6点を批判者とし、-100〜100で表す。
+"""
+
+import math
+from functools import lru_cache
+from statistics import NormalDist
+
+DEFAULT_CONFIDENCE = 0.95
+
+# 有意とみなすp値
+SIGNIFICANCE_LEVEL = 0.05
+
+# この自由度以上はt分布の分位点を展開式で近似する（誤差は1e-4未満）
+T_EXPANSION_MIN_DF = 30
+
+STANDARD_NORMAL = NormalDist()
+
+
+# ---- 分布 ----
+
+def _beta_continued_fraction(a, b, x):
+    """正則化不完全ベータ関数の連分数（Lentz法）"""
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        for numerator in (m * (b - m) * x / ((a + m2 - 1.0) * (a + m2)),
+                          -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1.0))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            delta = c * d
+            result *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return result
+
+
+def regularized_beta(a, b, x):
+    """正則化不完全ベータ関数 I_x(a, b)"""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    log_front = (math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                 + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return math.exp(log_front) * _beta_continued_fraction(a, b, x) / a
+    return 1.0 - math.exp(log_front) * _beta_continued_fraction(b, a, 1.0 - x) / b
+
+
+def t_two_sided_p(t, df):
+    """t分布の両側p値"""
+    if df <= 0 or math.isnan(t):
+        return 1.0
+    return regularized_beta(df / 2.0, 0.5, df / (df + t * t))
+
+
+@lru_cache(maxsize=4096)
+def t_quantile(confidence, df):
+    """両側 confidence の信頼区間に使うt分布の分位点"""
+    z = STANDARD_NORMAL.inv_cdf(0.5 + confidence / 2.0)
+    if df >= T_EXPANSION_MIN_DF:
+        # Cornish-Fisher展開
+        z3, z5 = z ** 3, z ** 5
+        return (z + (z3 + z) / (4 * df) + (5 * z5 + 16 * z3 + 3 * z) / (96 * df ** 2)
+                + (3 * z ** 7 + 19 * z5 + 17 * z3 - 15 * z) / (384 * df ** 3))
+    alpha = 1.0 - confidence
+    low, high = 0.0, 1000.0
+    for _ in range(100):
+        middle = (low + high) / 2.0
+        if t_two_sided_p(middle, df) > alpha:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2.0
+
+
+def normal_two_sided_p(z):
+    return 2.0 * (1.0 - STANDARD_NORMAL.cdf(abs(z)))
+
+
+# ---- 十分統計量 ----
+
+def moments_from_buckets(buckets):
+    """点数毎の件数 {点数: 件数} から (回答数, 合計, 二乗和)"""
+    count = total = total_sq = 0
+    for score, bucket_count in buckets.items():
+        count += bucket_count
+        total += score * bucket_count
+        total_sq += score * score * bucket_count
+    return count, total, total_sq
+
+
+def sample_variance(count, total, total_sq):
+    if count < 2:
+        return 0.0
+    return max((total_sq - total * total / count) / (count - 1), 0.0)
+
+
+def mean_interval(count, total, total_sq, confidence=DEFAULT_CONFIDENCE):
+    """平均の信頼区間（回答数が2未満の場合は区間なし）"""
+    if count <= 0:
+        return None
+    mean = total / count
+    result = {'n': count, 'mean': round(mean, 3), 'lower': None, 'upper': None}
+    if count >= 2:
+        margin = t_quantile(confidence, count - 1) * math.sqrt(sample_variance(count, total, total_sq) / count)
+        result.update(lower=round(mean - margin, 3), upper=round(mean + margin, 3))
+    return result
+
+
+def nps_components(buckets):
+    """推奨度の件数から (回答数, 推奨者の割合, 批判者の割合)"""
+    count = sum(buckets.values())
+    if count <= 0:
+        return 0, 0.0, 0.0
+    promoters = sum(bucket_count for score, bucket_count in buckets.items() if score >= 9)
+    detractors = sum(bucket_count for score, bucket_count in buckets.items() if score <= 6)
+    return count, promoters / count, detractors / count
+
+
+def nps_variance(count, promoters, detractors):
+    """NPS（-1〜1）の推定量の分散"""
+    return (promoters + detractors - (promoters - detractors) ** 2) / count
+
+
+def nps_interval(buckets, confidence=DEFAULT_CONFIDENCE):
+    """NPSと信頼区間（-100〜100、区間は範囲内に切り詰める）"""
+    count, promoters, detractors = nps_components(buckets)
+    if count <= 0:
+        return None
+    nps = promoters - detractors
+    margin = STANDARD_NORMAL.inv_cdf(0.5 + confidence / 2.0) * math.sqrt(nps_variance(count, promoters, detractors))
+    return {
+        'n': count,
+        'nps': round(nps * 100, 1),
+        'lower': round(max(nps - margin, -1.0) * 100, 1),
+        'upper': round(min(nps + margin, 1.0) * 100, 1)
+    }
+
+
+# ---- 期間比較 ----
+
+def compare_means(current, previous):
+    """2期間の平均の差のWelchのt検定（current・previous は (回答数, 合計, 二乗和)）"""
+    (n1, s1, q1), (n0, s0, q0) = current, previous
+    if n1 < 2 or n0 < 2:
+        return None
+    v1, v0 = sample_variance(n1, s1, q1) / n1, sample_variance(n0, s0, q0) / n0
+    difference = s1 / n1 - s0 / n0
+    standard_error = math.sqrt(v1 + v0)
+    if standard_error == 0:
+        p_value = 1.0 if difference == 0 else 0.0
+    else:
+        df = (v1 + v0) ** 2 / ((v1 * v1 / (n1 - 1) if v1 else 0.0) + (v0 * v0 / (n0 - 1) if v0 else 0.0))
+        p_value = t_two_sided_p(difference / standard_error, df)
+    return significance_result(difference, p_value)
+
+
+def compare_nps(current, previous):
+    """2期間のNPSの差のz検定（current・previous は推奨度の件数 {点数: 件数}）"""
+    n1, p1, d1 = nps_components(current)
+    n0, p0, d0 = nps_components(previous)
+    if n1 < 2 or n0 < 2:
+        return None
+    difference = (p1 - d1) - (p0 - d0)
+    standard_error = math.sqrt(nps_variance(n1, p1, d1) + nps_variance(n0, p0, d0))
+    if standard_error == 0:
+        p_value = 1.0 if difference == 0 else 0.0
+    else:
+        p_value = normal_two_sided_p(difference / standard_error)
+    return significance_result(difference * 100, p_value)
+
+
+def significance_result(difference, p_value):
+    return {
+        'difference': round(difference, 3),
+        'p_value': round(min(max(p_value, 0.0), 1.0), 4),
+        'significant': p_value < SIGNIFICANCE_LEVEL
+    }